@@ -0,0 +1,69 @@
+# ============================================================
+# Bulk insert benchmark for the EXAMINATION table
+# ============================================================
+# Compares rows/sec of the per-row insert path
+# (one INSERT execute per row inside one DatabaseManager.transaction(),
+# committed once at the end like the bulk paths) with the bulk paths of
+# insert_examination_records ("values" and "copy").
+# Runs against the PostgreSQL instance configured in src/config.py.
+# WARNING: the benchmark deletes all rows of EXAMINATION.
+#
+# Usage:
+#   python -m benchmarks.bench_insert --rows 20000 --batch-size 5000
+# ============================================================
+
+import argparse
+import time
+
+from src.config import DB_CONFIG, INSERT_BATCH_SIZE
+from src.database_manager import INSERT_EXAMINATION, DatabaseManager
+from src.dataset import generate_examination_batches
+
+
+def run_method(db: DatabaseManager, records, method: str, batch_size: int) -> float:
+    db.clear_examinations()
+    start = time.perf_counter()
+    if method == "row":
+        with db.transaction() as cur:
+            for record in records:
+                cur.execute(INSERT_EXAMINATION, record)
+    else:
+        db.insert_examination_records(records, method=method, batch_size=batch_size)
+    elapsed = time.perf_counter() - start
+
+    inserted = db.fetch_one("SELECT count(*) AS n FROM examination;")["n"]
+    if inserted != len(records):
+        raise RuntimeError(f"{method}: expected {len(records)} rows, found {inserted}.")
+    return len(records) / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Rows/sec of EXAMINATION insert paths.")
+    parser.add_argument("--rows", type=int, default=20000)
+    parser.add_argument("--batch-size", type=int, default=INSERT_BATCH_SIZE)
+    parser.add_argument("--methods", nargs="+", default=["row", "values", "copy"])
+    args = parser.parse_args()
+
+    db = DatabaseManager(config=DB_CONFIG)
+    db.setup_schema()
+    records = [
+        record
+        for batch in generate_examination_batches(
+            args.rows, db.get_patients(), db.get_doctors(), db.get_disease_map(), args.batch_size
+        )
+        for record in batch
+    ]
+
+    print(f"{'Method':8s} {'Rows':>10s} {'Rows/sec':>12s} {'Speedup':>8s}")
+    baseline = None
+    for method in args.methods:
+        rate = run_method(db, records, method, args.batch_size)
+        baseline = baseline or rate
+        print(f"{method:8s} {len(records):10d} {rate:12.0f} {rate / baseline:7.1f}x")
+
+    db.clear_examinations()
+    db.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,214 @@
+# ============================================================
+# Scaling benchmark of the classifiers (no database needed)
+# ============================================================
+# models_dataset-shaped data is generated in memory with the
+# choose_lens rules (generate_models_dataset), split 80/20 and, for
+# every size and model, the following steps are timed:
+#   fit            set_training_data() + fit() on the train split
+#   build_lookup   dense prediction table (see src/lookup.py)
+#   predict_row    per row, on a sample of the test split
+#   predict_batch  predict_batch() on the whole test split
+#   evaluate       evaluate_on_test() on the test split
+#   cv             stratified_kfold_scores() on the whole dataset, run twice with the
+#                  same random_state: different scores exit with status 1
+# Each step is timed without tracing (best of --repeat runs), then run
+# once more under tracemalloc to record its peak memory.
+#
+# Usage:
+#   python -m benchmarks.bench_models --sizes 1e3 1e4 1e5 1e6 1e7 --output bench.json
+#   python -m benchmarks.bench_models --sizes 1e3 1e4 --compare bench.json
+# --compare exits with status 1 when a step got slower or used more
+# memory than the baseline by more than --threshold.
+# ============================================================
+
+import argparse
+import json
+import os
+import platform
+import sys
+import time
+import tracemalloc
+from datetime import datetime, timezone
+from typing import Callable, List, Tuple
+
+import numpy as np
+import pandas as pd
+from sklearn.model_selection import train_test_split
+
+from src.dataset import generate_models_dataset
+from src.evaluation import evaluate_on_test, stratified_kfold_scores
+from src.bagging import BaggedID3Classifier
+from src.id3_model import ID3Classifier
+from src.naive_bayes_model import NaiveBayesClassifier
+from src.r1_model import OneRClassifier
+
+MODELS = {"1r": OneRClassifier, "id3": ID3Classifier, "nb": NaiveBayesClassifier, "bagged": BaggedID3Classifier}
+TARGET_COL = "lenses"
+
+# timings below this are dominated by noise and never reported as regressions
+MIN_SECONDS = 1e-3
+
+
+def measure(func: Callable[[], object], repeat: int, trace_memory: bool) -> Tuple[float, int]:
+    # (best time in seconds, peak traced bytes)
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+
+    peak = 0
+    if trace_memory:
+        tracemalloc.start()
+        try:
+            func()
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+    return best, peak
+
+
+def bench_model(name: str, df: pd.DataFrame, train_df: pd.DataFrame, test_df: pd.DataFrame, args) -> List[dict]:
+    model_cls = MODELS[name]
+    results = []
+
+    def record(step: str, func: Callable[[], object], rows: int, repeat: int = args.repeat):
+        seconds, peak = measure(func, repeat, not args.no_memory)
+        results.append({
+            "model": name,
+            "size": len(df),
+            "step": step,
+            "rows": rows,
+            "seconds": seconds,
+            "rows_per_sec": rows / seconds if seconds > 0 else None,
+            "peak_bytes": peak,
+        })
+        print(f"{name:4s} {len(df):>10d} {step:14s} {seconds:10.4f}s {rows / max(seconds, 1e-12):14.0f} rows/s {peak / 2**20:10.1f} MiB")
+
+    def fit():
+        model = model_cls()
+        model.set_training_data(train_df)
+        model.fit(TARGET_COL)
+        return model
+
+    record("fit", fit, len(train_df))
+    model = fit()
+
+    def build_lookup():
+        # the cached table is dropped so every run builds it again (1R keeps no separate table)
+        if hasattr(model, "lookup"):
+            model.lookup = None
+        model.build_lookup()
+
+    record("build_lookup", build_lookup, 0)
+    model.build_lookup()
+
+    sample = test_df.head(args.predict_rows).to_dict("records")
+
+    def predict_rows():
+        for row in sample:
+            model.predict_row(row)
+
+    record("predict_row", predict_rows, len(sample))
+    record("predict_batch", lambda: model.predict_batch(test_df), len(test_df))
+    record("evaluate", lambda: evaluate_on_test(model, test_df, TARGET_COL), len(test_df))
+    if not args.no_cv:
+        # CV refits k models, a single run is enough at every size
+        cv_scores = []
+        record("cv", lambda: cv_scores.append(stratified_kfold_scores(model_cls, df, TARGET_COL, k=args.k, random_state=42)),
+               len(df), repeat=1)
+        # the scores must depend only on random_state: a second run (the traced one, or an extra one) is compared
+        if len(cv_scores) == 1:
+            cv_scores.append(stratified_kfold_scores(model_cls, df, TARGET_COL, k=args.k, random_state=42))
+        results[-1]["reproducible"] = all(scores == cv_scores[0] for scores in cv_scores[1:])
+        if not results[-1]["reproducible"]:
+            print(f"[ERROR] {name} size={len(df)}: CV scores differ between runs with the same random_state")
+    return results
+
+
+def run(args) -> dict:
+    results = []
+    print(f"{'Model':4s} {'Size':>10s} {'Step':14s} {'Time':>11s} {'Throughput':>21s} {'Peak':>14s}")
+    for size in args.sizes:
+        df = generate_models_dataset(size, seed=args.seed)
+        train_df, test_df = train_test_split(df, test_size=0.2, shuffle=True, random_state=42)
+        for name in args.models:
+            results.extend(bench_model(name, df, train_df, test_df, args))
+        del df, train_df, test_df
+    return {
+        "meta": {
+            "created_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "python": sys.version.split()[0],
+            "numpy": np.__version__,
+            "pandas": pd.__version__,
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "args": {k: v for k, v in vars(args).items() if k not in ("output", "compare")},
+        },
+        "results": results,
+    }
+
+
+def compare(current: dict, baseline: dict, threshold: float) -> List[str]:
+    # Regressions of the steps present in both runs, as printable lines
+    base = {(r["model"], r["size"], r["step"]): r for r in baseline["results"]}
+    regressions = []
+    print(f"\n{'Model':4s} {'Size':>10s} {'Step':14s} {'Time':>9s} {'Memory':>9s}")
+    for r in current["results"]:
+        old = base.get((r["model"], r["size"], r["step"]))
+        if old is None:
+            continue
+        time_ratio = r["seconds"] / old["seconds"] if old["seconds"] > 0 else 1.0
+        mem_ratio = r["peak_bytes"] / old["peak_bytes"] if old["peak_bytes"] and r["peak_bytes"] else 1.0
+        flags = []
+        if time_ratio > 1 + threshold and r["seconds"] - old["seconds"] > MIN_SECONDS:
+            flags.append(f"time {old['seconds']:.4f}s -> {r['seconds']:.4f}s")
+        if mem_ratio > 1 + threshold:
+            flags.append(f"memory {old['peak_bytes'] / 2**20:.1f} -> {r['peak_bytes'] / 2**20:.1f} MiB")
+        mark = "  REGRESSION" if flags else ""
+        print(f"{r['model']:4s} {r['size']:>10d} {r['step']:14s} {time_ratio:8.2f}x {mem_ratio:8.2f}x{mark}")
+        if flags:
+            regressions.append(f"{r['model']} size={r['size']} {r['step']}: " + ", ".join(flags))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Scaling benchmark of fit, predict and cross-validation.")
+    parser.add_argument("--sizes", nargs="+", type=lambda s: int(float(s)), default=[10**3, 10**4, 10**5, 10**6, 10**7])
+    parser.add_argument("--models", nargs="+", choices=list(MODELS), default=list(MODELS))
+    parser.add_argument("--repeat", type=int, default=3, help="timed runs per step, the best one is kept")
+    parser.add_argument("--predict-rows", type=int, default=10000, help="test rows scored one by one with predict_row")
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--no-cv", action="store_true")
+    parser.add_argument("--no-memory", action="store_true", help="skip the tracemalloc run of every step")
+    parser.add_argument("--output", help="write the results to this JSON file")
+    parser.add_argument("--compare", help="baseline JSON file to check the results against")
+    parser.add_argument("--threshold", type=float, default=0.25, help="allowed slowdown / memory growth (0.25 = 25%%)")
+    args = parser.parse_args()
+
+    results = run(args)
+    not_reproducible = [r for r in results["results"] if r.get("reproducible") is False]
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+        print(f"[OK] Results written to {args.output}")
+
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.threshold)
+        if regressions:
+            print(f"\n[ERROR] {len(regressions)} regression(s) against {args.compare}:")
+            for line in regressions:
+                print("  " + line)
+            sys.exit(1)
+        print(f"\n[OK] No regressions against {args.compare}")
+
+    if not_reproducible:
+        print(f"\n[ERROR] CV scores of {', '.join(sorted({r['model'] for r in not_reproducible}))} are not reproducible")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,16 +1,20 @@
-import pandas as pd
 from sklearn.model_selection import train_test_split
 
 from src.dataset import insert_data, orange_export_to_csv, export_to_csv
 from src.evaluation import summarize_cv
+from src.artifacts import load_or_fit_models
+from src.dataset_cache import load_dataset_frame
+from src.metrics import span
 from src.database_manager import DatabaseManager
 
 from src.r1_model import OneRClassifier
 from src.id3_model import ID3Classifier
 from src.naive_bayes_model import NaiveBayesClassifier
+from src.bagging import BaggedID3Classifier
 from src.config import (
     DB_CONFIG,
     DATASET_SIZE,
+    CV_N_JOBS,
     ORANGE_OUTPUT_FILE,
     ORANGE_SQL_CREATE_DATASET_VIEW,
     ORANGE_DATASET_TABLE,
@@ -23,24 +27,36 @@ def run_r1_model():
     r1_model = OneRClassifier()
     r1_model.set_training_data(train_df)
     r1_model.fit(target_col="lenses")
-    r1_model.run_evaluate(test_df=test_df)
+    with span("evaluate", rows=len(test_df), model="1r"):
+        r1_model.run_evaluate(test_df=test_df)
 
 def run_id3_model():
     id3_model = ID3Classifier()
     id3_model.set_training_data(train_df)
     id3_model.fit("lenses")
-    id3_model.run_evaluate(test_df=test_df)
+    with span("evaluate", rows=len(test_df), model="id3"):
+        id3_model.run_evaluate(test_df=test_df)
 
 def run_naive_bayes_model():
     nb = NaiveBayesClassifier()
     nb.set_training_data(train_df)
     nb.fit("lenses")
-    nb.run_evaluate(test_df=test_df)
+    with span("evaluate", rows=len(test_df), model="nb"):
+        nb.run_evaluate(test_df=test_df)
+
+def run_bagged_id3_model():
+    bagged = BaggedID3Classifier(random_state=42)
+    bagged.set_training_data(train_df)
+    bagged.fit("lenses")
+    with span("evaluate", rows=len(test_df), model="bagged_id3"):
+        bagged.run_evaluate(test_df=test_df)
 
 def main():
     global train_df, test_df 
     database_manager = DatabaseManager(config=DB_CONFIG)
-    
+    # Create tables and initial data (only when the schema version changed)
+    database_manager.setup_schema()
+
     # Creating and inserting synthetic data into EXAMINATION table
     insert_data(
         db=database_manager,
@@ -65,8 +81,12 @@ def main():
     )
     
     # LOAD AND SPLIT DATA
-    df = pd.read_csv(TAB_DATASET_FILE, sep="\t")
-    train_df, test_df = train_test_split(df, test_size=0.2, shuffle=True, random_state=42)
+    with span("load_dataset") as stage:
+        # binary cache written by export_to_csv, categorical columns
+        df = load_dataset_frame(TAB_DATASET_FILE)
+        stage.set(rows=len(df))
+    with span("train_test_split", rows=len(df)):
+        train_df, test_df = train_test_split(df, test_size=0.2, shuffle=True, random_state=42)
     
     # RUN ONE-RULE MODEL
     run_r1_model()
@@ -77,10 +97,25 @@ def main():
     # RUN NAIVE BAYES MODEL
     run_naive_bayes_model()
     print()
+    # RUN BAGGED ID3 ENSEMBLE
+    run_bagged_id3_model()
+    print()
     
     # K-Fold Cross-Validation
-    summarize_cv(df, target_col="lenses", k=5)
+    summarize_cv(df, target_col="lenses", k=5, random_state=42, n_jobs=CV_N_JOBS)
+    print()
+
+    # Models trained on the whole dataset, saved for the web app (kept if dataset.tab did not change)
+    with span("save_artifacts", rows=len(df)):
+        load_or_fit_models(
+            {"1r": OneRClassifier, "id3": ID3Classifier, "nb": NaiveBayesClassifier, "bagged": BaggedID3Classifier},
+            data_file=TAB_DATASET_FILE,
+            target_col="lenses",
+            df=df,
+        )
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    # every stage is logged as a child span of "main" (see METRICS_LOG_FILE)
+    with span("main"):
+        main()
\ No newline at end of file
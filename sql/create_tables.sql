@@ -51,3 +51,12 @@ CREATE TABLE EXAMINATION (
     disease_id INT REFERENCES DISEASE(disease_id)
 );
 
+
+-- ==========================
+-- Indexes
+-- ==========================
+
+-- joins of the export views and lookups of a patient's / disease's examinations
+CREATE INDEX examination_patient_id_idx ON EXAMINATION (patient_id);
+CREATE INDEX examination_disease_id_idx ON EXAMINATION (disease_id);
+CREATE INDEX examination_exam_date_idx ON EXAMINATION (exam_date);
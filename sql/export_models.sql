@@ -1,8 +1,11 @@
 -- ==================================================
 -- TAB EXPORT VIEW
 -- ==================================================
+-- Materialized: the join is computed when the view is created or refreshed
+-- (DatabaseManager.refresh_materialized_views(), called by insert_data),
+-- not on every export. Created only when missing, so running this file is cheap.
 
-CREATE OR REPLACE VIEW models_dataset AS
+CREATE MATERIALIZED VIEW IF NOT EXISTS models_dataset AS
 SELECT
     p.age_group::TEXT AS age_group,
     d.disease_name::TEXT AS disease_name,
@@ -11,7 +14,31 @@ SELECT
         ELSE 'no'
     END AS astigmatic,
     e.tear_rate::TEXT AS tear_rate,
-    e.lenses::TEXT AS lenses
+    e.lenses::TEXT AS lenses,
+    -- watermark for incremental loads, not exported to the .tab file
+    e.exam_id
 FROM EXAMINATION e
 JOIN PATIENT p  ON e.patient_id = p.patient_id
-JOIN DISEASE d  ON e.disease_id = d.disease_id;
\ No newline at end of file
+JOIN DISEASE d  ON e.disease_id = d.disease_id
+WITH DATA;
+
+-- needed by REFRESH MATERIALIZED VIEW CONCURRENTLY
+CREATE UNIQUE INDEX IF NOT EXISTS models_dataset_exam_id_idx ON models_dataset (exam_id);
+
+-- Same rows as a plain view, always up to date. Reads that must see every examination
+-- (incremental loads after a watermark, in-database counts, streamed chunks) use it
+-- instead of models_dataset, see DatabaseManager.live_view().
+CREATE OR REPLACE VIEW models_dataset_live AS
+SELECT
+    p.age_group::TEXT AS age_group,
+    d.disease_name::TEXT AS disease_name,
+    CASE 
+        WHEN e.astigmatic THEN 'yes'
+        ELSE 'no'
+    END AS astigmatic,
+    e.tear_rate::TEXT AS tear_rate,
+    e.lenses::TEXT AS lenses,
+    e.exam_id
+FROM EXAMINATION e
+JOIN PATIENT p  ON e.patient_id = p.patient_id
+JOIN DISEASE d  ON e.disease_id = d.disease_id;
@@ -30,17 +30,22 @@ SELECT
     ''     AS tear_rate,
     'class' AS lenses;
 
--- Data rows
-CREATE OR REPLACE VIEW orange_data AS
+-- Data rows, materialized like models_dataset (refreshed by DatabaseManager.refresh_materialized_views())
+CREATE MATERIALIZED VIEW IF NOT EXISTS orange_data AS
 SELECT
     p.age_group::TEXT AS age_group,
     d.disease_name::TEXT AS disease_name,
     CASE WHEN e.astigmatic THEN 'yes' ELSE 'no' END AS astigmatic,
     e.tear_rate::TEXT AS tear_rate,
-    e.lenses::TEXT AS lenses
+    e.lenses::TEXT AS lenses,
+    -- unique key for REFRESH ... CONCURRENTLY, not exported
+    e.exam_id
 FROM EXAMINATION e
 JOIN PATIENT p  ON e.patient_id = p.patient_id
-JOIN DISEASE d  ON e.disease_id = d.disease_id;
+JOIN DISEASE d  ON e.disease_id = d.disease_id
+WITH DATA;
+
+CREATE UNIQUE INDEX IF NOT EXISTS orange_data_exam_id_idx ON orange_data (exam_id);
 
 -- Final export view
 CREATE OR REPLACE VIEW orange_dataset AS
@@ -50,4 +55,4 @@ SELECT * FROM orange_header_types
 UNION ALL
 SELECT * FROM orange_header_roles
 UNION ALL
-SELECT * FROM orange_data;
+SELECT age_group, disease_name, astigmatic, tear_rate, lenses FROM orange_data;
@@ -0,0 +1,143 @@
+# ============================================================
+# Saved model artifacts
+# ============================================================
+# A trained model is stored as a small JSON document with only what
+# prediction needs (counts, rules, tree arrays), never the training rows:
+#   {"format": ..., "version": ..., "model": "1r" | "id3" | "nb",
+#    "fingerprint": sha256 of the training data file, "state": {...}}
+# An artifact is reused only while the data fingerprint is unchanged.
+# ============================================================
+
+import hashlib
+import json
+import os
+import tempfile
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any, Dict, Optional, Tuple, Union
+
+import numpy as np
+import pandas as pd
+
+from src.contingency import ContingencyCounts
+from src.encoding import EncodedDataset
+from src.config import ARTIFACTS_DIR, TAB_DATASET_FILE
+from src.dataset_cache import load_encoded_dataset
+
+ARTIFACT_FORMAT = "isel-ml-model"
+# bump when the state layout of any model changes, older artifacts are then retrained
+ARTIFACT_VERSION = 1
+
+FINGERPRINT_BLOCK_BYTES = 1 << 20
+
+
+def data_fingerprint(path: Path) -> str:
+    # sha256 of the data file, read in blocks
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(FINGERPRINT_BLOCK_BYTES), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def artifact_path(name: str, artifacts_dir: Path = ARTIFACTS_DIR) -> Path:
+    return Path(artifacts_dir) / f"{name}.json"
+
+
+def write_artifact(path: Path, kind: str, state: Dict[str, Any], fingerprint: Optional[str]):
+    document = {
+        "format": ARTIFACT_FORMAT,
+        "version": ARTIFACT_VERSION,
+        "model": kind,
+        "fingerprint": fingerprint,
+        "created_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "state": state,
+    }
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    # written to a temporary file and renamed, readers never see a half written artifact
+    fd, tmp = tempfile.mkstemp(dir=path.parent, prefix=f".{path.name}.", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(document, f, separators=(",", ":"))
+        # mkstemp creates the file readable by the owner only
+        os.chmod(tmp, 0o644)
+        os.replace(tmp, path)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+
+
+def read_artifact(path: Path, kind: str, fingerprint: Optional[str] = None) -> Tuple[Dict[str, Any], Optional[str]]:
+    # Returns (state, fingerprint); ValueError when the artifact cannot be used
+    with open(path, "r", encoding="utf-8") as f:
+        document = json.load(f)
+    if not isinstance(document, dict) or document.get("format") != ARTIFACT_FORMAT or "state" not in document:
+        raise ValueError(f"{path} is not a model artifact.")
+    if document.get("version") != ARTIFACT_VERSION:
+        raise ValueError(f"{path} has artifact version {document.get('version')}, expected {ARTIFACT_VERSION}.")
+    if document.get("model") != kind:
+        raise ValueError(f"{path} holds a '{document.get('model')}' model, expected '{kind}'.")
+    if fingerprint is not None and document.get("fingerprint") != fingerprint:
+        raise ValueError(f"{path} was trained on other data.")
+    return document["state"], document.get("fingerprint")
+
+
+def counts_to_state(counts: ContingencyCounts) -> Dict[str, Any]:
+    return {
+        "target_col": counts.target_col,
+        "attributes": list(counts.attributes),
+        "vocabularies": {c: list(v) for c, v in counts.vocabularies.items()},
+        "class_counts": counts.class_counts.tolist(),
+        "attr_counts": {a: counts.attr_counts[a].tolist() for a in counts.attributes},
+    }
+
+
+def counts_from_state(state: Dict[str, Any]) -> ContingencyCounts:
+    n_classes = len(state["class_counts"])
+    return ContingencyCounts(
+        target_col=state["target_col"],
+        attributes=list(state["attributes"]),
+        vocabularies={c: list(v) for c, v in state["vocabularies"].items()},
+        class_counts=np.array(state["class_counts"], dtype=np.int64),
+        attr_counts={
+            a: np.array(table, dtype=np.int64).reshape(len(state["vocabularies"][a]), n_classes)
+            for a, table in state["attr_counts"].items()
+        },
+    )
+
+
+def load_or_fit_models(
+    model_classes: Dict[str, type],
+    data_file: Path = TAB_DATASET_FILE,
+    target_col: str = "lenses",
+    artifacts_dir: Path = ARTIFACTS_DIR,
+    df: Optional[Union[pd.DataFrame, EncodedDataset]] = None,
+    retrain: bool = False,
+    fit_params: Optional[Dict[str, Dict[str, Any]]] = None,
+) -> Dict[str, Any]:
+    # Loads every model from its artifact when it was trained on the current data_file,
+    # otherwise (or with retrain=True) trains it on the whole file and saves a new artifact.
+    # The data file is read at most once, and only when something has to be trained.
+    # fit_params: constructor arguments of the models that are trained, per model name
+    fingerprint = data_fingerprint(data_file)
+    models = {}
+    for name, model_class in model_classes.items():
+        path = artifact_path(name, artifacts_dir)
+        if path.exists() and not retrain:
+            try:
+                models[name] = model_class.load(path, fingerprint=fingerprint)
+                print(f"[OK] Model '{name}' loaded from {path}")
+                continue
+            except (ValueError, KeyError) as e:
+                print(f"[INFO] {e} Retraining '{name}'.")
+
+        if df is None:
+            df = load_encoded_dataset(data_file)
+        model = model_class(**(fit_params or {}).get(name, {}))
+        model.set_training_data(df)
+        model.fit(target_col)
+        model.save(path, fingerprint=fingerprint)
+        print(f"[OK] Model '{name}' trained and saved to {path}")
+        models[name] = model
+    return models
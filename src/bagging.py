@@ -0,0 +1,262 @@
+# ============================================================
+# Bagged ID3 ensemble
+# ============================================================
+# n_estimators ID3 trees, each fitted on a bootstrap sample of the
+# training rows (drawn with replacement) and, with max_features, on a
+# random subset of the attributes (random subspace). A tree gets only an
+# index array into the encoded dataset, no rows are copied. With more
+# than one worker the dataset is put in shared memory once and the trees
+# are fitted on a process pool; every tree draws its sample from its own
+# seed, so the ensemble does not depend on the number of workers.
+# Prediction stacks the class codes of all trees and takes the most
+# common class of every row in one pass.
+# ============================================================
+
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Dict, List, Optional, Tuple, Union
+
+import numpy as np
+import pandas as pd
+
+from src.artifacts import read_artifact, write_artifact
+from src.config import BAGGING_N_JOBS, BAGGING_PARALLEL_MIN_ROWS
+from src.encoding import UNKNOWN_CODE, EncodedDataset, as_encoded, recode
+from src.id3_model import ID3Classifier
+from src.lookup import LOOKUP_MAX_CELLS, PredictionTable, build_prediction_table
+from src.metrics import span
+from src.shared_data import SharedArrays, attach_dataset, pool_workers
+
+
+def draw_sample(seed: np.random.SeedSequence, n_rows: int, attrs: List[str],
+                max_features: Optional[int], bootstrap: bool) -> Tuple[np.ndarray, List[str]]:
+    # (row indices, attributes) of one tree. Rows are sorted, the tree reads the codes in memory order.
+    rng = np.random.default_rng(seed)
+    if bootstrap:
+        rows = np.sort(rng.integers(0, n_rows, size=n_rows))
+    else:
+        rows = np.arange(n_rows)
+    if max_features is not None and max_features < len(attrs):
+        chosen = np.sort(rng.choice(len(attrs), size=max_features, replace=False))
+        attrs = [attrs[j] for j in chosen]
+    return rows, attrs
+
+
+def _fit_tree(data: EncodedDataset, target_col: str, tree_params: Dict[str, Any], seed: np.random.SeedSequence,
+              attrs: List[str], max_features: Optional[int], bootstrap: bool) -> Dict[str, Any]:
+    # State of one fitted tree (see ID3Classifier.to_state), small and picklable
+    rows, tree_attrs = draw_sample(seed, len(data), attrs, max_features, bootstrap)
+    tree = ID3Classifier(**tree_params)
+    tree.data = data
+    tree.vocabularies = data.vocabularies
+    tree._fit(target_col, rows=rows, attrs=tree_attrs)
+    return tree.to_state()
+
+
+# dataset attached once per worker process by _init_bagging_worker
+_bagging_worker = {}
+
+def _init_bagging_worker(handle):
+    data, _ = attach_dataset(handle)
+    _bagging_worker["data"] = data
+
+def _bagging_job(target_col, tree_params, seed, attrs, max_features, bootstrap):
+    return _fit_tree(_bagging_worker["data"], target_col, tree_params, seed, attrs, max_features, bootstrap)
+
+
+class BaggedID3Classifier:
+    def __init__(
+        self,
+        n_estimators: int = 25,
+        max_features: Optional[int] = None,
+        bootstrap: bool = True,
+        random_state: Optional[int] = 0,
+        n_jobs: Optional[int] = BAGGING_N_JOBS,
+        parallel_min_rows: int = BAGGING_PARALLEL_MIN_ROWS,
+        **tree_params,
+    ):
+        # n_estimators: number of trees
+        # max_features: attributes drawn for every tree (None = all attributes, plain bagging)
+        # bootstrap: False fits every tree on all rows (only the attribute subsets differ)
+        # random_state: seed of the samples, fixed by default so every fit on the same rows (CV folds,
+        # saved artifacts) gives the same ensemble; None draws new samples on every fit
+        # n_jobs: worker processes fitting the trees (1 = serial, None = one per CPU)
+        # parallel_min_rows: smaller training sets are fitted serially, the pool would cost more than it saves
+        # tree_params: ID3Classifier parameters of every tree (max_depth, min_samples_leaf, ...)
+        if n_estimators < 1:
+            raise ValueError("n_estimators must be >= 1.")
+        if max_features is not None and max_features < 1:
+            raise ValueError("max_features must be >= 1.")
+        if parallel_min_rows < 1:
+            raise ValueError("parallel_min_rows must be >= 1.")
+        # invalid tree parameters fail here, not in a worker
+        ID3Classifier(**tree_params)
+        self.n_estimators = n_estimators
+        self.max_features = max_features
+        self.bootstrap = bootstrap
+        self.random_state = random_state
+        self.n_jobs = n_jobs
+        self.parallel_min_rows = parallel_min_rows
+        self.tree_params = dict(tree_params)
+        self.data: Optional[EncodedDataset] = None
+        self.vocabularies: Dict[str, List[str]] = {}
+        self.target_col: Optional[str] = None
+        self.attributes: List[str] = []
+        self.trees: List[ID3Classifier] = []
+        self.fitted: bool = False
+        # optional dense prediction table, see build_lookup()
+        self.lookup: Optional[PredictionTable] = None
+
+    def set_training_data(self, data: Union[pd.DataFrame, EncodedDataset]):
+        self.data = as_encoded(data)
+        self.vocabularies = self.data.vocabularies
+
+    def _workers(self, n_rows: int) -> int:
+        # Serial below parallel_min_rows and inside worker processes (e.g. a cross-validation job),
+        # see pool_workers()
+        if n_rows < self.parallel_min_rows:
+            return 1
+        return min(self.n_estimators, pool_workers(self.n_jobs))
+
+    def fit(self, target_col: str):
+        if self.data is None:
+            raise RuntimeError("Use set_training_data() first.")
+        if (self.data.codes == UNKNOWN_CODE).any():
+            raise ValueError("Training data contains values outside the vocabulary.")
+
+        data = self.data
+        attrs = [c for c in data.columns if c != target_col]
+        seeds = np.random.SeedSequence(self.random_state).spawn(self.n_estimators)
+        jobs = [(target_col, self.tree_params, seed, attrs, self.max_features, self.bootstrap) for seed in seeds]
+        workers = self._workers(len(data))
+
+        with span("fit", rows=len(data), model="bagged_id3", trees=self.n_estimators, n_jobs=workers):
+            if workers == 1:
+                states = [_fit_tree(data, *job) for job in jobs]
+            else:
+                with SharedArrays.from_dataset(data) as shared:
+                    with ProcessPoolExecutor(max_workers=workers, initializer=_init_bagging_worker,
+                                             initargs=(shared.handle,)) as pool:
+                        # map keeps the tree order
+                        states = list(pool.map(_bagging_job, *zip(*jobs)))
+
+        self.target_col = target_col
+        self.attributes = attrs
+        self._set_trees([ID3Classifier.from_state(state) for state in states])
+        # voted class of every attribute combination, built once with the fit
+        self.build_lookup()
+
+    def _set_trees(self, trees: List[ID3Classifier]):
+        # a refit invalidates the prediction table
+        self.lookup = None
+        self.trees = trees
+        # every tree is encoded with the vocabularies of the ensemble
+        for tree in trees:
+            tree.vocabularies = self.vocabularies
+        self.fitted = True
+
+    @property
+    def params(self) -> Dict[str, Any]:
+        return {
+            "n_estimators": self.n_estimators,
+            "max_features": self.max_features,
+            "bootstrap": self.bootstrap,
+            "random_state": self.random_state,
+            **self.tree_params,
+        }
+
+    def save(self, path, fingerprint: Optional[str] = None):
+        # The state of every tree (compiled node arrays), no rows are stored
+        if not self.fitted:
+            raise RuntimeError("Model not fitted. Call fit() first.")
+        state = {
+            "target_col": self.target_col,
+            "attributes": list(self.attributes),
+            "vocabularies": {c: list(self.vocabularies[c]) for c in self.attributes + [self.target_col]},
+            "params": self.params,
+            "trees": [tree.to_state() for tree in self.trees],
+        }
+        write_artifact(path, "bagged_id3", state, fingerprint)
+
+    @classmethod
+    def load(cls, path, fingerprint: Optional[str] = None) -> "BaggedID3Classifier":
+        # fingerprint: when given, artifacts trained on other data raise ValueError
+        state, _ = read_artifact(path, "bagged_id3", fingerprint)
+        model = cls(**state.get("params", {}))
+        model.target_col = state["target_col"]
+        model.attributes = list(state["attributes"])
+        model.vocabularies = {c: list(v) for c, v in state["vocabularies"].items()}
+        model._set_trees([ID3Classifier.from_state(tree) for tree in state["trees"]])
+        model.build_lookup()
+        return model
+
+    def build_lookup(self, max_cells: int = LOOKUP_MAX_CELLS) -> bool:
+        # Precomputes the voted class of every combination of known attribute values.
+        # Returns False when the attribute space is larger than max_cells (no table).
+        if not self.fitted:
+            raise RuntimeError("Model not fitted. Call fit() first.")
+        if self.lookup is not None:
+            return True
+        self.lookup = build_prediction_table(
+            self.attributes, self.vocabularies, self.target_col, self._predict_codes, max_cells
+        )
+        return self.lookup is not None
+
+    def _vote(self, votes: np.ndarray) -> np.ndarray:
+        # votes: (trees, rows) class codes. Most common class of every row, the lowest class code on ties.
+        n_classes = len(self.vocabularies[self.target_col])
+        n_rows = votes.shape[1]
+        # one bincount over (row, class) cells counts the votes of all rows
+        cells = votes + (np.arange(n_rows) * n_classes)[None, :]
+        counts = np.bincount(cells.ravel(), minlength=n_rows * n_classes).reshape(n_rows, n_classes)
+        return np.argmax(counts, axis=1)
+
+    def predict_row(self, row):
+        if not self.fitted:
+            raise RuntimeError("Model not fitted. Call fit() first.")
+        if self.lookup is not None:
+            label = self.lookup.predict_row(row)
+            if label is not None:
+                return label
+        classes = self.vocabularies[self.target_col]
+        votes = np.array([[classes.index(tree.predict_row(row))] for tree in self.trees], dtype=np.intp)
+        return classes[int(self._vote(votes)[0])]
+
+    def predict_encoded(self, data: EncodedDataset) -> np.ndarray:
+        if not self.fitted:
+            raise RuntimeError("Model not fitted. Call fit() first.")
+
+        data = recode(data, self.vocabularies)
+        if self.lookup is not None:
+            return self.lookup.predict_encoded(data, self._predict_codes)
+        return self._predict_codes(data)
+
+    def _predict_codes(self, data: EncodedDataset) -> np.ndarray:
+        # data is already in the model vocabularies, the trees share them
+        votes = np.empty((len(self.trees), len(data)), dtype=np.intp)
+        for t, tree in enumerate(self.trees):
+            votes[t] = tree._predict_codes(data)
+        return self._vote(votes)
+
+    def predict_batch(self, data: Union[pd.DataFrame, EncodedDataset]) -> np.ndarray:
+        codes = self.predict_encoded(as_encoded(data, self.vocabularies))
+        return np.array(self.vocabularies[self.target_col], dtype=object)[codes]
+
+    def score(self):
+        assert self.data is not None
+        assert self.target_col is not None
+        preds = self.predict_encoded(self.data)
+        real = self.data.column(self.target_col)
+        return int((preds == real).sum()) / len(real)
+
+    def run_evaluate(self, test_df):
+        print("\n===============================")
+        print(" Model: Bagged ID3 Trees")
+        print("===============================")
+        nodes = [tree.tree_stats()["nodes"] for tree in self.trees]
+        print(f"Trees: {len(self.trees)}, nodes per tree: {np.mean(nodes):.1f} (min {min(nodes)}, max {max(nodes)})")
+
+        print("\nAccuracy:")
+        print(f"  Train: {self.score()*100:.2f}%")
+
+        from src.evaluation import evaluate_on_test
+        print(f"  Test:  {evaluate_on_test(self, test_df, self.target_col)*100:.2f}%")
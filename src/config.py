@@ -1,3 +1,4 @@
+import os
 from pathlib import Path
 
 from src.models import DatabaseConfig
@@ -10,9 +11,26 @@ DB_CONFIG = DatabaseConfig(
     db_host="172.31.17.248",
     db_port=5432
 )
+# Connections kept in the DatabaseManager pool
+DB_POOL_MIN_CONNECTIONS = 1
+DB_POOL_MAX_CONNECTIONS = 10
 
 # Size of generated dataset
 DATASET_SIZE = 300
+# Rows sent to the database per bulk insert batch
+INSERT_BATCH_SIZE = 5000
+# Bulk insert method: "copy" (COPY FROM STDIN) or "values" (multi-row INSERT ... VALUES)
+INSERT_METHOD = "copy"
+# Worker processes for cross-validation (1 = serial, None = one per CPU)
+CV_N_JOBS = None
+# Worker processes building the subtrees of one ID3 tree (1 = serial, None = one per CPU)
+ID3_N_JOBS = 1
+# Nodes with at least this many rows are split with the help of the ID3 workers, smaller subtrees are built by one worker
+ID3_PARALLEL_MIN_ROWS = 200_000
+# Worker processes fitting the trees of BaggedID3Classifier (1 = serial, None = one per CPU)
+BAGGING_N_JOBS = None
+# Training sets with fewer rows are fitted serially by BaggedID3Classifier
+BAGGING_PARALLEL_MIN_ROWS = 200_000
 
 BASE_DIR = Path(__file__).resolve().parent.parent
 
@@ -25,7 +43,25 @@ TAB_DATASET_FILE = BASE_DIR / "data" / "dataset.tab"
 MODELS_SQL_CREATE_DATASET_VIEW = BASE_DIR / "sql" / "export_models.sql"
 # Name of the view in database
 MODELS_DATASET_TABLE = "models_dataset"
+# Saved models (<model>.json), reused by the web app while dataset.tab is unchanged
+ARTIFACTS_DIR = BASE_DIR / "data" / "models"
+# Rows per chunk when training from a stream (fit_stream), bounds the memory of one chunk
+DATASET_CHUNK_ROWS = 100_000
+# JSON lines with the timing spans of pipeline stages, off unless the ISEL_METRICS_LOG environment
+# variable names a file (e.g. data/metrics.jsonl)
+METRICS_LOG_FILE = Path(os.environ["ISEL_METRICS_LOG"]) if os.environ.get("ISEL_METRICS_LOG") else None
 # Drop create database tables and types query
 DROP_CREATE_TABLES = BASE_DIR / "sql" / "create_tables.sql"
 # Initial populate of tables in database
-INITIAL_POPULATE_DATABASE = BASE_DIR / "sql" / "populate_tables.sql"
\ No newline at end of file
+INITIAL_POPULATE_DATABASE = BASE_DIR / "sql" / "populate_tables.sql"
+# Version of create_tables.sql + populate_tables.sql, bump it to make setup_schema() rebuild the database
+SCHEMA_VERSION = 2
+# Materialized views of the export queries, refreshed after insert_data()
+MATERIALIZED_VIEWS = ("models_dataset", "orange_data")
+# Plain views with the rows of a materialized view, read where a stale refresh is not acceptable
+LIVE_VIEWS = {"models_dataset": "models_dataset_live"}
+# Web app: seconds between checks of dataset.tab for changes (None = refit only through /admin/refit)
+REFIT_INTERVAL_SECONDS = 60
+# Web app: token expected in the X-Admin-Token header of /admin endpoints, read from the
+# ISEL_ADMIN_TOKEN environment variable (None = admin endpoints disabled)
+ADMIN_TOKEN = os.environ.get("ISEL_ADMIN_TOKEN") or None
\ No newline at end of file
@@ -0,0 +1,217 @@
+# ============================================================
+# (attribute, value, class) contingency counts
+# ============================================================
+# Sufficient statistics of the count based models (1R, Naive Bayes):
+#   class_counts[k]        = number of rows of class k
+#   attr_counts[a][v, k]   = number of rows with attribute a = v and class k
+# All counts are indexed by the codes of an EncodedDataset.
+# ============================================================
+
+from dataclasses import dataclass
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple, Union
+
+import numpy as np
+import pandas as pd
+
+from src.encoding import DATASET_SCHEMA, UNKNOWN_CODE, EncodedDataset, as_encoded, build_vocabulary, normalize_value
+
+# rows per bincount block, bounds the temporary index array
+COUNT_BLOCK_ROWS = 1 << 20
+
+
+@dataclass
+class ContingencyCounts:
+    target_col: str
+    attributes: List[str]
+    vocabularies: Dict[str, List[str]]
+    class_counts: np.ndarray                # (classes,) int64
+    attr_counts: Dict[str, np.ndarray]      # attr -> (values, classes) int64
+
+    @property
+    def total(self) -> int:
+        return int(self.class_counts.sum())
+
+    @property
+    def n_classes(self) -> int:
+        return len(self.class_counts)
+
+    def reindex(self, vocabularies: Dict[str, List[str]]) -> "ContingencyCounts":
+        # Same counts expressed over other (superset) vocabularies
+        def mapping(name: str) -> np.ndarray:
+            index = {v: k for k, v in enumerate(vocabularies[name])}
+            return np.array([index[v] for v in self.vocabularies[name]], dtype=np.intp)
+
+        classes = mapping(self.target_col)
+        n_classes = len(vocabularies[self.target_col])
+        class_counts = np.zeros(n_classes, dtype=np.int64)
+        class_counts[classes] = self.class_counts
+        attr_counts = {}
+        for a in self.attributes:
+            table = np.zeros((len(vocabularies[a]), n_classes), dtype=np.int64)
+            table[np.ix_(mapping(a), classes)] = self.attr_counts[a]
+            attr_counts[a] = table
+        used = {c: list(vocabularies[c]) for c in self.attributes + [self.target_col]}
+        return ContingencyCounts(self.target_col, list(self.attributes), used, class_counts, attr_counts)
+
+    def __add__(self, other: "ContingencyCounts") -> "ContingencyCounts":
+        if other.target_col != self.target_col or other.attributes != self.attributes:
+            raise ValueError("Counts of different columns cannot be merged.")
+        left, right = self, other
+        if left.vocabularies != right.vocabularies:
+            # union of both vocabularies, kept sorted like the encoder does
+            union = {c: sorted(set(left.vocabularies[c]) | set(right.vocabularies[c])) for c in left.vocabularies}
+            left, right = left.reindex(union), right.reindex(union)
+        return ContingencyCounts(
+            self.target_col,
+            list(self.attributes),
+            left.vocabularies,
+            left.class_counts + right.class_counts,
+            {a: left.attr_counts[a] + right.attr_counts[a] for a in self.attributes},
+        )
+
+    def __sub__(self, other: "ContingencyCounts") -> "ContingencyCounts":
+        # Counts of the rows of self that are not in other (other counts a subset of the same rows)
+        if other.target_col != self.target_col or other.attributes != self.attributes:
+            raise ValueError("Counts of different columns cannot be subtracted.")
+        if other.vocabularies != self.vocabularies:
+            raise ValueError("Counts over different vocabularies cannot be subtracted.")
+        return ContingencyCounts(
+            self.target_col,
+            list(self.attributes),
+            self.vocabularies,
+            self.class_counts - other.class_counts,
+            {a: self.attr_counts[a] - other.attr_counts[a] for a in self.attributes},
+        )
+
+    @classmethod
+    def from_encoded(cls, data: EncodedDataset, target_col: str, rows: Optional[np.ndarray] = None) -> "ContingencyCounts":
+        # rows: indices of the rows to count (None = all)
+        attrs = [c for c in data.columns if c != target_col]
+        sizes = [len(data.vocabularies[a]) for a in attrs]
+        class_counts, tables = count_tensor(
+            data.codes,
+            rows,
+            [data.column_index(a) for a in attrs],
+            sizes,
+            data.column_index(target_col),
+            len(data.vocabularies[target_col]),
+        )
+        vocabularies = {c: data.vocabularies[c] for c in attrs + [target_col]}
+        return cls(target_col, attrs, vocabularies, class_counts, dict(zip(attrs, tables)))
+
+
+def counts_from_chunks(chunks: Iterable[Union[pd.DataFrame, EncodedDataset]], target_col: str) -> ContingencyCounts:
+    # Counts of a dataset read chunk by chunk (pd.read_csv(chunksize=...), a database cursor, ...).
+    # Only one encoded chunk and the (small) running counts are in memory at a time.
+    total: Optional[ContingencyCounts] = None
+    for chunk in chunks:
+        if len(chunk) == 0:
+            continue
+        data = as_encoded(chunk)
+        if (data.codes == UNKNOWN_CODE).any():
+            raise ValueError("Training data contains values outside the vocabulary.")
+        counts = ContingencyCounts.from_encoded(data, target_col)
+        # vocabularies of the chunks may differ, + merges them
+        total = counts if total is None else total + counts
+    if total is None:
+        raise ValueError("No training rows in the chunks.")
+    return total
+
+
+def counts_query(dataset_table: str, attributes: Sequence[str], target_col: str) -> str:
+    # One aggregate over the table: a (attribute, target) group for every attribute plus the
+    # target alone for the class counts. grouping_id has the bit of an attribute cleared
+    # (attributes[0] = highest bit) in the rows grouped by it, and all bits set in the class rows.
+    columns = ", ".join(list(attributes) + [target_col])
+    sets = ", ".join([f"({a}, {target_col})" for a in attributes] + [f"({target_col})"])
+    return (
+        f"SELECT {columns}, GROUPING({', '.join(attributes)}) AS grouping_id, COUNT(*) AS n "
+        f"FROM {dataset_table} GROUP BY GROUPING SETS ({sets});"
+    )
+
+
+def counts_from_grouped_rows(rows: Iterable[dict], attributes: Sequence[str], target_col: str) -> ContingencyCounts:
+    # Counts from the result rows of counts_query(). Values are normalized like the encoder
+    # does (NULL becomes "nan"), so the counts equal ContingencyCounts.from_encoded of the same rows.
+    attributes = list(attributes)
+    all_bits = (1 << len(attributes)) - 1
+    attr_of_mask = {all_bits ^ (1 << (len(attributes) - 1 - j)): a for j, a in enumerate(attributes)}
+    class_totals: Dict[str, int] = {}
+    pair_counts: Dict[str, Dict[Tuple[str, str], int]] = {a: {} for a in attributes}
+
+    def value(v) -> str:
+        return "nan" if v is None else normalize_value(v)
+
+    for row in rows:
+        label, n, mask = value(row[target_col]), int(row["n"]), int(row["grouping_id"])
+        if mask == all_bits:
+            class_totals[label] = class_totals.get(label, 0) + n
+        else:
+            attr = attr_of_mask[mask]
+            key = (value(row[attr]), label)
+            pair_counts[attr][key] = pair_counts[attr].get(key, 0) + n
+    if not class_totals:
+        raise ValueError("No training rows in the grouped counts.")
+
+    vocabularies = {a: build_vocabulary(a, {v for v, _ in pair_counts[a]}) for a in attributes}
+    vocabularies[target_col] = build_vocabulary(target_col, class_totals)
+    class_index = {c: k for k, c in enumerate(vocabularies[target_col])}
+    class_counts = np.zeros(len(class_index), dtype=np.int64)
+    for label, n in class_totals.items():
+        class_counts[class_index[label]] = n
+    attr_counts = {}
+    for a in attributes:
+        value_index = {v: k for k, v in enumerate(vocabularies[a])}
+        table = np.zeros((len(value_index), len(class_index)), dtype=np.int64)
+        for (v, label), n in pair_counts[a].items():
+            table[value_index[v], class_index[label]] = n
+        attr_counts[a] = table
+    return ContingencyCounts(target_col, attributes, vocabularies, class_counts, attr_counts)
+
+
+def counts_from_db(db, dataset_table: str, target_col: str, attributes: Optional[Sequence[str]] = None) -> ContingencyCounts:
+    # Counts aggregated by the database (db: DatabaseManager): one GROUPING SETS query,
+    # only a few dozen grouped rows are fetched instead of the whole table.
+    # attributes default to the training columns of models_dataset.
+    # A materialized view is counted through its live view, rows inserted since its refresh are included.
+    if attributes is None:
+        attributes = [c for c in DATASET_SCHEMA if c != target_col]
+    rows = db.fetch_all(counts_query(db.live_view(dataset_table), attributes, target_col))
+    return counts_from_grouped_rows(rows, attributes, target_col)
+
+
+def count_tensor(
+    codes: np.ndarray,
+    rows: Optional[np.ndarray],
+    attr_cols: Sequence[int],
+    sizes: Sequence[int],
+    target_col: int,
+    n_classes: int,
+) -> Tuple[np.ndarray, List[np.ndarray]]:
+    # Class counts and one (values, classes) table per attribute column, for the given
+    # row indices (None = all rows), from a single bincount per block of rows
+    sizes = np.asarray(sizes, dtype=np.intp)
+    # every (attribute, value) pair gets its own block of n_classes cells in one flat tensor
+    offsets = np.cumsum(sizes) - sizes
+    n_cells = int(sizes.sum()) * n_classes
+    n_rows = codes.shape[0] if rows is None else len(rows)
+
+    flat = np.zeros(n_cells, dtype=np.int64)
+    class_counts = np.zeros(n_classes, dtype=np.int64)
+    for start in range(0, n_rows, COUNT_BLOCK_ROWS):
+        block = slice(start, start + COUNT_BLOCK_ROWS) if rows is None else rows[start:start + COUNT_BLOCK_ROWS]
+        y = codes[block, target_col].astype(np.intp)
+        keys = np.empty((len(y), len(attr_cols)), dtype=np.intp)
+        for j, c in enumerate(attr_cols):
+            keys[:, j] = codes[block, c]
+        keys += offsets
+        keys *= n_classes
+        keys += y[:, None]
+        flat += np.bincount(keys.ravel(), minlength=n_cells)
+        class_counts += np.bincount(y, minlength=n_classes)
+
+    tables = [
+        flat[offset * n_classes:(offset + size) * n_classes].reshape(size, n_classes)
+        for offset, size in zip(offsets, sizes)
+    ]
+    return class_counts, tables
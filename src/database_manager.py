@@ -1,39 +1,134 @@
-import psycopg2
+import io
+import os
+import tempfile
+import threading
+import uuid
 from pathlib import Path
-from psycopg2.extras import RealDictCursor
+from typing import Iterator, List, Optional, Sequence
+from psycopg2.extras import RealDictCursor, execute_values
+from psycopg2.pool import ThreadedConnectionPool
 from contextlib import contextmanager
 from psycopg2 import OperationalError, InterfaceError, DatabaseError, ProgrammingError, IntegrityError
 
 from src.models import DatabaseConfig
-from src.config import DROP_CREATE_TABLES, INITIAL_POPULATE_DATABASE
+from src.config import (
+    DROP_CREATE_TABLES,
+    INITIAL_POPULATE_DATABASE,
+    SCHEMA_VERSION,
+    MATERIALIZED_VIEWS,
+    LIVE_VIEWS,
+    DB_POOL_MIN_CONNECTIONS,
+    DB_POOL_MAX_CONNECTIONS,
+)
+
+# pg_advisory_xact_lock key serializing concurrent setup_schema() calls
+SCHEMA_LOCK_ID = 4242001
+
+EXAMINATION_COLUMNS = ("exam_date", "astigmatic", "tear_rate", "lenses", "patient_id", "doctor_id", "disease_id")
+# one EXAMINATION row, parameters in EXAMINATION_COLUMNS order
+INSERT_EXAMINATION = f"INSERT INTO examination ({', '.join(EXAMINATION_COLUMNS)}) VALUES (%s, %s, %s, %s, %s, %s, %s);"
+
+
 class DatabaseManager:
-    def __init__(self, config: DatabaseConfig):
+    # Every call borrows its own connection from a thread-safe pool and opens its own cursor,
+    # so one manager can be shared between threads (web app workers, parallel exports).
+    # The schema is not touched on construction, call setup_schema() explicitly.
+    def __init__(
+        self,
+        config: DatabaseConfig,
+        min_connections: int = DB_POOL_MIN_CONNECTIONS,
+        max_connections: int = DB_POOL_MAX_CONNECTIONS,
+    ):
         self.config = config
-        self.conn = None
-        self.cur = None
+        self.min_connections = min_connections
+        self.max_connections = max_connections
+        self.pool: Optional[ThreadedConnectionPool] = None
+        # ThreadedConnectionPool raises when exhausted, the semaphore makes callers wait instead
+        self._slots = threading.BoundedSemaphore(max_connections)
         self.connect()
-        self.execute_sql_file(DROP_CREATE_TABLES)
-        self.execute_sql_file(INITIAL_POPULATE_DATABASE)
         print("[OK] Database connected")
 
     def connect(self):
+        if self.pool is not None:
+            return
         try:
-            self.conn = psycopg2.connect(
+            self.pool = ThreadedConnectionPool(
+                self.min_connections,
+                self.max_connections,
                 dbname=self.config.db_name,
                 user=self.config.db_user,
                 password=self.config.db_pass,
                 host=self.config.db_host,
                 port=self.config.db_port
             )
-            self.cur = self.conn.cursor(cursor_factory=RealDictCursor)
         except Exception as e:
             print(self._human_message_from_exception(e))
 
     def close(self):
-        if self.cur:
-            self.cur.close()
-        if self.conn:
-            self.conn.close()
+        if self.pool:
+            self.pool.closeall()
+            self.pool = None
+
+    @contextmanager
+    def cursor(self, commit: bool = True):
+        # Connection from the pool + new cursor for one unit of work.
+        # Committed at the end (rolled back if commit=False or on error), then returned to the pool.
+        if self.pool is None:
+            raise RuntimeError("Database pool is not initialized. Call connect() first.")
+        with self._slots:
+            conn = self.pool.getconn()
+            try:
+                with conn.cursor(cursor_factory=RealDictCursor) as cur:
+                    yield cur
+                if commit:
+                    conn.commit()
+                else:
+                    conn.rollback()
+            except Exception:
+                conn.rollback()
+                raise
+            finally:
+                self.pool.putconn(conn)
+
+    @contextmanager
+    def transaction(self):
+        # Cursor of one caller-owned transaction: everything executed in the block is committed
+        # together when it ends, or rolled back as a whole on error. Nothing is shared with other callers.
+        #   with db.transaction() as cur:
+        #       for record in records:
+        #           cur.execute(INSERT_EXAMINATION, record)
+        with self.cursor(commit=True) as cur:
+            yield cur
+
+    def setup_schema(self, force: bool = False) -> bool:
+        # Creates tables, types and initial data only when the stored schema version differs
+        # from SCHEMA_VERSION (or force=True). Safe to call from many processes at once:
+        # the check and the rebuild run in one transaction under an advisory lock.
+        # Returns True when the schema was (re)built.
+        try:
+            with self.cursor() as cur:
+                cur.execute("SELECT pg_advisory_xact_lock(%s);", (SCHEMA_LOCK_ID,))
+                cur.execute("""
+                    CREATE TABLE IF NOT EXISTS schema_version (
+                        version INT NOT NULL,
+                        applied_at TIMESTAMP NOT NULL DEFAULT now()
+                    );
+                """)
+                cur.execute("SELECT max(version) AS version FROM schema_version;")
+                current = cur.fetchone()["version"]
+                if current == SCHEMA_VERSION and not force:
+                    print(f"[OK] Database schema is up to date (version {current})")
+                    return False
+
+                for sql_path in (DROP_CREATE_TABLES, INITIAL_POPULATE_DATABASE):
+                    with open(sql_path, "r", encoding="utf-8") as f:
+                        cur.execute(f.read())
+                cur.execute("INSERT INTO schema_version (version) VALUES (%s);", (SCHEMA_VERSION,))
+            print(f"[OK] Database schema created (version {SCHEMA_VERSION})")
+            return True
+        except Exception as e:
+            print(self._human_message_from_exception(e))
+            return False
 
     def execute_sql_file(self, sql_path: Path):
         try:
@@ -43,6 +138,39 @@ class DatabaseManager:
         except Exception as e:
             print(self._human_message_from_exception(e))
 
+    def refresh_materialized_views(self, views: Sequence[str] = MATERIALIZED_VIEWS, concurrently: bool = True) -> List[str]:
+        # Recomputes the given materialized views, the ones not created yet (by the export
+        # queries) are skipped. CONCURRENTLY keeps a view readable during the refresh and
+        # writes only the changed rows; it needs the unique exam_id index and a populated
+        # view, so a view that was never populated gets a plain refresh.
+        # Returns the names of the refreshed views.
+        refreshed = []
+        try:
+            with self.cursor() as cur:
+                cur.execute(
+                    "SELECT matviewname, ispopulated FROM pg_matviews WHERE matviewname = ANY(%s);",
+                    (list(views),),
+                )
+                populated = {r["matviewname"]: r["ispopulated"] for r in cur.fetchall()}
+                for view in views:
+                    if view not in populated:
+                        continue
+                    mode = "CONCURRENTLY " if concurrently and populated[view] else ""
+                    cur.execute(f"REFRESH MATERIALIZED VIEW {mode}{view};")
+                    refreshed.append(view)
+            if refreshed:
+                print(f"[OK] Refreshed materialized views: {', '.join(refreshed)}")
+        except Exception as e:
+            print(self._human_message_from_exception(e))
+            return []
+        return refreshed
+
+    @staticmethod
+    def live_view(table: str) -> str:
+        # Relation with the current rows of table: materialized views are only as fresh as their
+        # last refresh, their plain view twin (LIVE_VIEWS) is used instead. Other names are kept.
+        return LIVE_VIEWS.get(table, table)
+
     @contextmanager
     def session(self):
         try:
@@ -52,38 +180,52 @@ class DatabaseManager:
             self.close()
 
     def execute(self, query: str, params=None, commit=False):
-        if not self.cur:
-            print("Database cursor is not initialized. Call connect() first.")
-            return
-        if not self.conn:
-            print("Database connection is not initialized. Call connect() first.")
-            return
         try:
-            self.cur.execute(query, params)
+            with self.cursor(commit=commit) as cur:
+                cur.execute(query, params)
         except Exception as e:
             print(self._human_message_from_exception(e))
-        if commit:
-            self.conn.commit()
 
     def fetch_all(self, query: str, params=None):
-        if not self.cur:
-            print("Database cursor is not initialized. Call connect() first.")
-            return
         try:
-            self.cur.execute(query, params)
+            with self.cursor(commit=False) as cur:
+                cur.execute(query, params)
+                return cur.fetchall()
         except Exception as e:
             print(self._human_message_from_exception(e))
-        return self.cur.fetchall()
+            return []
 
     def fetch_one(self, query: str, params=None):
-        if not self.cur:
-            print("Database cursor is not initialized. Call connect() first.")
-            return
         try:
-            self.cur.execute(query, params)
+            with self.cursor(commit=False) as cur:
+                cur.execute(query, params)
+                return cur.fetchone()
         except Exception as e:
             print(self._human_message_from_exception(e))
-        return self.cur.fetchone()
+            return None
+
+    def stream_query(self, query: str, params=None, chunk_size: int = 10000) -> Iterator[List[dict]]:
+        # Yields the result of query in lists of at most chunk_size rows.
+        # A named (server-side) cursor keeps the result on the server, so only one chunk is
+        # held in memory. The connection stays borrowed until the generator is exhausted or closed.
+        # Errors are raised (not printed) so a broken stream cannot look like a short result.
+        if self.pool is None:
+            raise RuntimeError("Database pool is not initialized. Call connect() first.")
+        with self._slots:
+            conn = self.pool.getconn()
+            try:
+                with conn.cursor(name=f"stream_{uuid.uuid4().hex}", cursor_factory=RealDictCursor) as cur:
+                    cur.itersize = chunk_size
+                    cur.execute(query, params)
+                    while True:
+                        rows = cur.fetchmany(chunk_size)
+                        if not rows:
+                            break
+                        yield rows
+            finally:
+                # read only, nothing to commit; also closes the transaction of the named cursor
+                conn.rollback()
+                self.pool.putconn(conn)
 
     def get_patients(self):
         rows = self.fetch_all("SELECT patient_id FROM PATIENT;")
@@ -114,17 +256,73 @@ class DatabaseManager:
         self.execute("DELETE FROM examination;", commit=True)
 
     def insert_examination_record(self, exam_date, astig, tear, lens, patient, doctor, disease_id):
+        # One row in its own committed transaction. Many rows: insert_examination_records(),
+        # or execute INSERT_EXAMINATION for each of them inside one transaction()
+        try:
+            with self.cursor() as cur:
+                cur.execute(INSERT_EXAMINATION, (exam_date, astig, tear, lens, patient, doctor, disease_id))
+        except Exception as e:
+            print(self._human_message_from_exception(e))
+
+    def insert_examination_records(self, records: Sequence[tuple], method: str = "copy", batch_size: int = 5000):
+        # records: tuples in EXAMINATION_COLUMNS order, sent in batches instead of one execute per row
+        # All batches of one call are committed together
+        if method not in ("copy", "values"):
+            raise ValueError(f"Unknown insert method '{method}', use 'copy' or 'values'.")
+        columns = ", ".join(EXAMINATION_COLUMNS)
         try:
-            self.execute("""
-                INSERT INTO examination (exam_date, astigmatic, tear_rate, lenses, patient_id, doctor_id, disease_id)
-                VALUES (%s, %s, %s, %s, %s, %s, %s);
-            """, (exam_date, astig, tear, lens, patient, doctor, disease_id))
+            with self.cursor() as cur:
+                if method == "values":
+                    # multi-row INSERT ... VALUES (...), (...), batch_size rows per statement
+                    execute_values(cur, f"INSERT INTO examination ({columns}) VALUES %s", records, page_size=batch_size)
+                else:
+                    for start in range(0, len(records), batch_size):
+                        buffer = io.StringIO()
+                        for record in records[start:start + batch_size]:
+                            buffer.write("\t".join(self._copy_text(v) for v in record))
+                            buffer.write("\n")
+                        buffer.seek(0)
+                        cur.copy_expert(f"COPY examination ({columns}) FROM STDIN", buffer)
         except Exception as e:
             print(self._human_message_from_exception(e))
 
+    @staticmethod
+    def _copy_text(value) -> str:
+        # COPY text format: \N for NULL, t/f for booleans, escaped backslash/tab/newline
+        if value is None:
+            return "\\N"
+        if isinstance(value, bool):
+            return "t" if value else "f"
+        text = value.isoformat() if hasattr(value, "isoformat") else str(value)
+        return text.replace("\\", "\\\\").replace("\t", "\\t").replace("\n", "\\n").replace("\r", "\\r")
+
     def get_dataset_rows(self, dataset_table: str):
         return self.fetch_all(f"SELECT * FROM {dataset_table};")
-    
+
+    def copy_query_to_file(self, query: str, output_file: Path, options: str) -> int:
+        # Streams the result of query into output_file with COPY ... TO STDOUT,
+        # the server sends it in chunks that are written as they arrive (nothing is fetched into memory).
+        # The rows go to a temporary file next to output_file that replaces it only after a complete
+        # COPY with at least one row: a failed or empty export leaves the previous file untouched.
+        # Returns the number of copied rows.
+        output_file = Path(output_file)
+        fd, tmp = tempfile.mkstemp(dir=output_file.parent, prefix=f".{output_file.name}.", suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w", newline="", encoding="utf-8") as f, self.cursor(commit=False) as cur:
+                cur.copy_expert(f"COPY ({query}) TO STDOUT WITH ({options})", f)
+                rows = max(cur.rowcount, 0)
+            if rows:
+                # mkstemp creates the file readable by the owner only
+                os.chmod(tmp, 0o644)
+                os.replace(tmp, output_file)
+            return rows
+        except Exception as e:
+            print(self._human_message_from_exception(e))
+            return 0
+        finally:
+            # left over when the copy failed or was empty
+            Path(tmp).unlink(missing_ok=True)
+
     def _human_message_from_exception(self, exc: Exception) -> str:
         if isinstance(exc, OperationalError):
             msg = str(exc).strip()
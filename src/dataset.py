@@ -13,14 +13,23 @@
 # ============================================================
 
 import random
-import csv
-import pandas as pd
 from datetime import date, timedelta
 from pathlib import Path
+from typing import Dict, Iterator, List, Tuple
+
+import numpy as np
+import pandas as pd
 
 
-from src.models import Disease, TearRate, LensType
+from src.models import AgeGroup, Disease, TearRate, LensType
 from src.database_manager import DatabaseManager
+from src.config import INSERT_BATCH_SIZE, INSERT_METHOD, DATASET_CHUNK_ROWS, TAB_DATASET_FILE
+from src.dataset_cache import write_dataset_cache
+from src.encoding import DATASET_SCHEMA
+from src.metrics import span
+
+# Columns of models_dataset used for training (the view also has exam_id)
+MODELS_DATASET_COLUMNS = list(DATASET_SCHEMA)
 
 
 
@@ -34,44 +43,90 @@ def choose_lens(disease: Disease, astig: bool, tear: TearRate) -> LensType:
     return LensType.SOFT
 
 
-def insert_data(db: DatabaseManager, records_num: int, delete_before_insert: bool):
+def generate_examination_batches(
+    records_num: int,
+    patients: List[int],
+    doctors: List[int],
+    disease_map: Dict[str, int],
+    batch_size: int,
+) -> Iterator[List[tuple]]:
+    # Yields lists of at most batch_size records in EXAMINATION_COLUMNS order
+    base_date = date(2025, 1, 1)
+    batch = []
+    for i in range(records_num):
+        patient = random.choice(patients)
+        doctor = random.choice(doctors)
+        disease = random.choice(list(Disease))
+        if disease == Disease.ASTIGMATIC:
+            astigmatic = True
+        else:
+            astigmatic = random.random() < 0.3
+        tear = random.choice(list(TearRate))
+
+        lens = choose_lens(disease, astigmatic, tear)
+        disease_id = disease_map[disease.value]
+        exam_date = base_date + timedelta(days=i)
+
+        batch.append((exam_date, astigmatic, tear.value, lens.value, patient, doctor, disease_id))
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def generate_models_dataset(records_num: int, seed=None) -> pd.DataFrame:
+    # models_dataset rows generated in memory (no database), same distribution as
+    # generate_examination_batches and labels from choose_lens; columns are plain strings like in dataset.tab
+    rng = np.random.default_rng(seed)
+    age_groups = np.array([a.value for a in AgeGroup], dtype=object)
+    diseases = list(Disease)
+    tear_rates = list(TearRate)
+
+    age = rng.integers(len(age_groups), size=records_num)
+    disease = rng.integers(len(diseases), size=records_num)
+    astigmatic = (disease == diseases.index(Disease.ASTIGMATIC)) | (rng.random(records_num) < 0.3)
+    tear = rng.integers(len(tear_rates), size=records_num)
+
+    # choose_lens evaluated once per (disease, astigmatic, tear) combination
+    lenses = np.array([
+        [[choose_lens(d, astig, t).value for t in tear_rates] for astig in (False, True)]
+        for d in diseases
+    ], dtype=object)
+
+    return pd.DataFrame({
+        "age_group": age_groups[age],
+        "disease_name": np.array([d.value for d in diseases], dtype=object)[disease],
+        "astigmatic": np.where(astigmatic, "yes", "no").astype(object),
+        "tear_rate": np.array([t.value for t in tear_rates], dtype=object)[tear],
+        "lenses": lenses[disease, astigmatic.astype(np.intp), tear],
+    }, columns=MODELS_DATASET_COLUMNS)
+
+
+def insert_data(
+    db: DatabaseManager,
+    records_num: int,
+    delete_before_insert: bool,
+    batch_size: int = INSERT_BATCH_SIZE,
+    method: str = INSERT_METHOD,
+):
     try:
         print("[INFO] Creating data ...")
-        patients = db.get_patients()
-        doctors = db.get_doctors()
-        disease_map = db.get_disease_map()
+        with span("insert_data", rows=records_num, method=method, batch_size=batch_size):
+            patients = db.get_patients()
+            doctors = db.get_doctors()
+            disease_map = db.get_disease_map()
+
+            if delete_before_insert:
+                db.clear_examinations()
+
+            for batch in generate_examination_batches(records_num, patients, doctors, disease_map, batch_size):
+                db.insert_examination_records(batch, method=method, batch_size=batch_size)
+
+        # the export views are materialized, bring them up to date with the new rows
+        with span("refresh_materialized_views"):
+            db.refresh_materialized_views()
 
-        base_date = date(2025, 1, 1)
-        
-        if delete_before_insert:
-            db.clear_examinations()
-        
-        for i in range(records_num):
-            patient = random.choice(patients)
-            doctor = random.choice(doctors)
-            disease = random.choice(list(Disease))
-            if disease == Disease.ASTIGMATIC:
-                astigmatic = True
-            else:
-                astigmatic = random.random() < 0.3
-            tear = random.choice(list(TearRate))
-            
-            lens = choose_lens(disease, astigmatic, tear)
-            disease_id = disease_map[disease.value]
-            exam_date = base_date + timedelta(days=i)
-
-            db.insert_examination_record(
-                exam_date,
-                astigmatic,
-                tear.value,
-                lens.value,
-                patient,
-                doctor,
-                disease_id
-            )
-        
-        if db.conn:
-            db.conn.commit()
         print(f"[OK] Generated {records_num} records for table examination.")
 
     except Exception as e:
@@ -80,18 +135,18 @@ def insert_data(db: DatabaseManager, records_num: int, delete_before_insert: boo
 
 def orange_export_to_csv(db: DatabaseManager, output_file: Path, sql_create_view_query: Path, dataset_table: str):
     try:
-        print("[INFO] Updating database views before data export")
+        print("[INFO] Creating database views before data export")
+        # materialized data rows are created only when missing, insert_data() refreshes them
         db.execute_sql_file(sql_create_view_query)
-        print("[OK] Views refreshed successfully.")
+        print("[OK] Views ready.")
         
-        rows = db.get_dataset_rows(dataset_table)
+        output_file.parent.mkdir(parents=True, exist_ok=True)
+        with span("orange_export_to_csv", table=dataset_table) as stage:
+            # text format keeps the empty role cells of the header rows unquoted
+            rows = db.copy_query_to_file(f"SELECT * FROM {dataset_table}", output_file, "FORMAT text, NULL ''")
+            stage.set(rows=rows)
         if not rows:
             raise RuntimeError("Query returned no data. Check the view definition.")
-        
-        with open(output_file, "w", newline="") as f:
-            writer = csv.writer(f, delimiter="\t")
-            for row in rows:
-                writer.writerow(row.values())
 
         print(f"[OK] Dataset for Orange DataMining exported to: {output_file}")
 
@@ -100,16 +155,52 @@ def orange_export_to_csv(db: DatabaseManager, output_file: Path, sql_create_view
         print(e)
 
 def export_to_csv(db: DatabaseManager, sql_create_view_query: Path, dataset_table: str, output_file: Path) -> Path:
-    db.execute_sql_file(sql_create_view_query)
-    rows = db.get_dataset_rows(dataset_table)
-
+    with span("export_to_csv", table=dataset_table) as stage:
+        db.execute_sql_file(sql_create_view_query)
+        output_file.parent.mkdir(parents=True, exist_ok=True)
+
+        # streamed straight from the server into the file, peak memory does not depend on the table size
+        columns = ", ".join(MODELS_DATASET_COLUMNS)
+        rows = db.copy_query_to_file(
+            f"SELECT {columns} FROM {dataset_table}", output_file, "FORMAT csv, DELIMITER E'\\t', HEADER true"
+        )
+        stage.set(rows=rows)
     if not rows:
         raise RuntimeError("No data in view dataset_table.")
 
-    output_file.parent.mkdir(parents=True, exist_ok=True)
-    
-    df = pd.DataFrame(rows)
-    df.to_csv(output_file, sep="\t", index=False)
-
     print(f"[OK] Dataset for model training exported to: {output_file}")
+    # binary copy for load_dataset_frame(), later loads skip parsing the text file
+    write_dataset_cache(output_file)
     return output_file
+
+
+def iter_dataset_chunks(path: Path = TAB_DATASET_FILE, chunksize: int = DATASET_CHUNK_ROWS) -> Iterator[pd.DataFrame]:
+    # dataset.tab read chunksize rows at a time, for fit_stream().
+    # Categorical columns keep one copy of every distinct string per chunk instead of one per row.
+    yield from pd.read_csv(path, sep="\t", chunksize=chunksize, dtype="category")
+
+
+def iter_dataset_chunks_from_db(db: DatabaseManager, dataset_table: str, chunksize: int = DATASET_CHUNK_ROWS) -> Iterator[pd.DataFrame]:
+    # models view read through a server-side cursor, chunksize rows at a time, for fit_stream().
+    # A materialized view is read through its live view (current rows, see DatabaseManager.live_view).
+    columns = ", ".join(MODELS_DATASET_COLUMNS)
+    for rows in db.stream_query(f"SELECT {columns} FROM {db.live_view(dataset_table)};", chunk_size=chunksize):
+        yield pd.DataFrame(rows, columns=MODELS_DATASET_COLUMNS).astype("category")
+
+
+def load_new_examinations(db: DatabaseManager, dataset_table: str, last_exam_id: int) -> Tuple[pd.DataFrame, int]:
+    # Rows of the models view added after the last_exam_id watermark, for partial_fit().
+    # Returns the new rows (training columns only) and the new watermark.
+    # A materialized view would miss rows inserted since its last refresh, its live view is read instead.
+    columns = ", ".join(MODELS_DATASET_COLUMNS)
+    rows = db.fetch_all(
+        f"SELECT exam_id, {columns} FROM {db.live_view(dataset_table)} WHERE exam_id > %s ORDER BY exam_id;",
+        (last_exam_id,),
+    )
+    if not rows:
+        return pd.DataFrame(columns=MODELS_DATASET_COLUMNS), last_exam_id
+
+    df = pd.DataFrame(rows)
+    watermark = int(df["exam_id"].max())
+    print(f"[OK] Loaded {len(df)} new examinations (exam_id > {last_exam_id})")
+    return df[MODELS_DATASET_COLUMNS], watermark
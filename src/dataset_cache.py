@@ -0,0 +1,117 @@
+# ============================================================
+# Binary cache of the exported dataset
+# ============================================================
+# Parsing dataset.tab takes longer than training on it, so the
+# encoded dataset is kept next to it in two files:
+#   dataset.codes.npy   int8 value codes (rows, columns), column-major
+#   dataset.meta.json   columns, vocabularies, rows and the size and
+#                       mtime of the dataset.tab it was built from
+# The cache is used only while dataset.tab is the file it was built
+# from, otherwise it is rebuilt. The codes are memory-mapped, so a
+# load neither parses nor copies rows: the columns of load_dataset_frame()
+# are categoricals over views of the mapped array.
+# ============================================================
+
+import json
+import os
+import tempfile
+from pathlib import Path
+from typing import Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from src.config import TAB_DATASET_FILE
+from src.encoding import EncodedDataset, encode_dataset
+from src.metrics import span
+
+CACHE_FORMAT = "isel-ml-dataset"
+# bump when the layout of the cache files changes, older caches are then rebuilt
+CACHE_VERSION = 1
+
+
+def cache_paths(data_file: Path = TAB_DATASET_FILE) -> Tuple[Path, Path]:
+    # (codes file, metadata file) of data_file, e.g. dataset.codes.npy and dataset.meta.json
+    data_file = Path(data_file)
+    return data_file.with_suffix(".codes.npy"), data_file.with_suffix(".meta.json")
+
+
+def _source_stat(data_file: Path) -> dict:
+    stat = os.stat(data_file)
+    return {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+
+
+def _replace_atomically(path: Path, write):
+    # write(file object) goes to a temporary file that then replaces path,
+    # readers see either the old or the new file
+    fd, tmp = tempfile.mkstemp(dir=path.parent, prefix=f".{path.name}.", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            write(f)
+        os.chmod(tmp, 0o644)
+        os.replace(tmp, path)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+
+
+def write_dataset_cache(data_file: Path = TAB_DATASET_FILE) -> EncodedDataset:
+    # Parses data_file once and writes its cache. Returns the encoded dataset.
+    data_file = Path(data_file)
+    codes_file, meta_file = cache_paths(data_file)
+    with span("write_dataset_cache", file=data_file.name) as stage:
+        source = _source_stat(data_file)
+        # categorical columns: every distinct string is parsed once, rows are only codes
+        data = encode_dataset(pd.read_csv(data_file, sep="\t", dtype="category"))
+        data.codes = np.asfortranarray(data.codes)
+        meta = {
+            "format": CACHE_FORMAT,
+            "version": CACHE_VERSION,
+            "source": source,
+            "rows": len(data),
+            "columns": data.columns,
+            "vocabularies": data.vocabularies,
+        }
+        # the metadata is written last, a cache without it (or with an old one) is never used
+        meta_file.unlink(missing_ok=True)
+        _replace_atomically(codes_file, lambda f: np.save(f, data.codes, allow_pickle=False))
+        _replace_atomically(meta_file, lambda f: f.write(json.dumps(meta).encode("utf-8")))
+        stage.set(rows=len(data), bytes=data.nbytes)
+    print(f"[OK] Dataset cache written to {codes_file}")
+    return data
+
+
+def read_dataset_cache(data_file: Path = TAB_DATASET_FILE) -> Optional[EncodedDataset]:
+    # The cached dataset of data_file, None when there is no cache or it was built from another version of the file
+    data_file = Path(data_file)
+    codes_file, meta_file = cache_paths(data_file)
+    try:
+        with open(meta_file, "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        if meta.get("format") != CACHE_FORMAT or meta.get("version") != CACHE_VERSION:
+            return None
+        if meta["source"] != _source_stat(data_file):
+            return None
+        codes = np.load(codes_file, mmap_mode="r", allow_pickle=False)
+    except (OSError, ValueError, KeyError):
+        return None
+    if codes.dtype != np.int8 or codes.shape != (meta["rows"], len(meta["columns"])):
+        return None
+    return EncodedDataset(codes, meta["columns"], meta["vocabularies"])
+
+
+def load_encoded_dataset(data_file: Path = TAB_DATASET_FILE) -> EncodedDataset:
+    # Encoded dataset of data_file, from the cache when it is up to date (rebuilt otherwise).
+    # The codes of a cached dataset are a read-only memory map.
+    with span("load_encoded_dataset", file=Path(data_file).name) as stage:
+        data = read_dataset_cache(data_file)
+        stage.set(cached=data is not None)
+        if data is None:
+            data = write_dataset_cache(data_file)
+        stage.set(rows=len(data))
+    return data
+
+
+def load_dataset_frame(data_file: Path = TAB_DATASET_FILE) -> pd.DataFrame:
+    # data_file as a DataFrame of categorical columns (replaces pd.read_csv(data_file, sep="\t"))
+    return load_encoded_dataset(data_file).to_frame()
@@ -0,0 +1,163 @@
+# ============================================================
+# Integer-coded categorical representation of models_dataset
+# ============================================================
+# Every column is stored as int8 codes into a per-column vocabulary:
+#   codes[i, j] = index of row i value in vocabularies[columns[j]]
+#   code -1     = value outside the vocabulary (unseen value)
+# Vocabularies of the models_dataset columns are built from the enums
+# in src/models.py, extended with any other value found in the data.
+# They are kept sorted, so code order is the same as string order.
+# ============================================================
+
+from dataclasses import dataclass
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple, Union
+
+import numpy as np
+import pandas as pd
+
+from src.models import AgeGroup, Disease, TearRate, LensType
+
+UNKNOWN_CODE = -1
+MAX_VOCABULARY_SIZE = np.iinfo(np.int8).max
+
+DATASET_SCHEMA: Dict[str, List[str]] = {
+    "age_group": [a.value for a in AgeGroup],
+    "disease_name": [d.value for d in Disease],
+    "astigmatic": ["no", "yes"],
+    "tear_rate": [t.value for t in TearRate],
+    "lenses": [l.value for l in LensType],
+}
+
+
+@dataclass
+class EncodedDataset:
+    codes: np.ndarray                       # (rows, columns) int8
+    columns: List[str]
+    vocabularies: Dict[str, List[str]]
+
+    def __len__(self) -> int:
+        return self.codes.shape[0]
+
+    @property
+    def nbytes(self) -> int:
+        return self.codes.nbytes
+
+    def column_index(self, name: str) -> int:
+        return self.columns.index(name)
+
+    def column(self, name: str) -> np.ndarray:
+        return self.codes[:, self.column_index(name)]
+
+    def take(self, idx: np.ndarray) -> "EncodedDataset":
+        return EncodedDataset(self.codes[idx], self.columns, self.vocabularies)
+
+    def to_frame(self) -> pd.DataFrame:
+        return pd.DataFrame({
+            c: pd.Categorical.from_codes(self.codes[:, j], categories=self.vocabularies[c])
+            for j, c in enumerate(self.columns)
+        })
+
+
+def normalize_value(value) -> str:
+    if type(value) is str:
+        return value.strip()
+    # booleans are stored as yes/no in models_dataset
+    if isinstance(value, (bool, np.bool_)):
+        return "yes" if value else "no"
+    return str(value).strip()
+
+
+def _normalize_column(col: pd.Series) -> pd.Series:
+    if col.dtype == bool:
+        return col.map({True: "yes", False: "no"})
+    if col.dtype == object and pd.api.types.infer_dtype(col, skipna=False) not in ("string", "empty"):
+        # mixed values (e.g. JSON booleans next to strings) take the single-value path
+        return col.map(normalize_value)
+    return col.astype(str).str.strip()
+
+
+def build_vocabulary(name: str, values: Iterable[str]) -> List[str]:
+    vocabulary = sorted(set(DATASET_SCHEMA.get(name, [])) | set(values))
+    if len(vocabulary) > MAX_VOCABULARY_SIZE:
+        raise ValueError(f"Column '{name}' has {len(vocabulary)} distinct values, int8 codes allow {MAX_VOCABULARY_SIZE}.")
+    return vocabulary
+
+
+def _encode_values(col: pd.Series, name: str, vocabulary: Optional[Sequence[str]]) -> Tuple[np.ndarray, List[str]]:
+    # (int8 codes, vocabulary); the vocabulary is built from the schema and the values when not given
+    if isinstance(col.dtype, pd.CategoricalDtype):
+        # only the categories are normalized, rows go through their category codes without any strings.
+        # Missing values (code -1) become "nan" like astype(str) does, -1 indexes the appended "nan".
+        categories = np.append(col.cat.categories.astype(str).str.strip().to_numpy(dtype=object), "nan")
+        codes = col.cat.codes.to_numpy()
+        if vocabulary is None:
+            present = np.bincount(codes.astype(np.intp) % len(categories), minlength=len(categories)) > 0
+            vocabulary = build_vocabulary(name, categories[present])
+        index = {v: k for k, v in enumerate(vocabulary)}
+        mapping = np.array([index.get(v, UNKNOWN_CODE) for v in categories], dtype=np.int8)
+        return mapping[codes], list(vocabulary)
+
+    values = _normalize_column(col)
+    if vocabulary is None:
+        vocabulary = build_vocabulary(name, values.unique())
+    return pd.Categorical(values, categories=vocabulary).codes.astype(np.int8, copy=False), list(vocabulary)
+
+
+def encode_column(col: pd.Series, vocabulary: Sequence[str]) -> np.ndarray:
+    return _encode_values(col, str(col.name), vocabulary)[0]
+
+
+def encode_dataset(df: pd.DataFrame, vocabularies: Optional[Dict[str, List[str]]] = None) -> EncodedDataset:
+    # Columns present in `vocabularies` are encoded with it (unseen values -> -1),
+    # the others get a vocabulary built from the schema and the data itself
+    vocabularies = vocabularies or {}
+    columns = list(df.columns)
+    codes = np.empty((len(df), len(columns)), dtype=np.int8, order="F")
+    used = {}
+    for j, c in enumerate(columns):
+        codes[:, j], used[c] = _encode_values(df[c], c, vocabularies.get(c))
+    return EncodedDataset(codes, columns, used)
+
+
+def recode(data: EncodedDataset, vocabularies: Dict[str, List[str]]) -> EncodedDataset:
+    # Re-express codes in another set of vocabularies (columns not listed are kept as they are)
+    if all(data.vocabularies[c] == vocabularies.get(c, data.vocabularies[c]) for c in data.columns):
+        return data
+    codes = np.empty_like(data.codes)
+    used = {}
+    for j, c in enumerate(data.columns):
+        target = vocabularies.get(c, data.vocabularies[c])
+        index = {v: k for k, v in enumerate(target)}
+        # last entry maps code -1 to -1
+        mapping = np.array([index.get(v, UNKNOWN_CODE) for v in data.vocabularies[c]] + [UNKNOWN_CODE], dtype=np.int8)
+        codes[:, j] = mapping[data.codes[:, j]]
+        used[c] = list(target)
+    return EncodedDataset(codes, list(data.columns), used)
+
+
+def as_encoded(data: Union[pd.DataFrame, EncodedDataset], vocabularies: Optional[Dict[str, List[str]]] = None) -> EncodedDataset:
+    if isinstance(data, EncodedDataset):
+        return recode(data, vocabularies) if vocabularies else data
+    return encode_dataset(data, vocabularies)
+
+
+def majority_code(codes: np.ndarray, n_values: int) -> int:
+    # Most frequent code; ties go to the value that appears first, like value_counts().idxmax()
+    counts = np.bincount(codes, minlength=n_values)
+    candidates = np.flatnonzero(counts == counts.max())
+    if len(candidates) == 1:
+        return int(candidates[0])
+    first_seen = [int(np.argmax(codes == c)) for c in candidates]
+    return int(candidates[int(np.argmin(first_seen))])
+
+
+def majority_code_from_counts(counts: np.ndarray, first_seen: np.ndarray) -> int:
+    # majority_code() from the counts of every code and the position of its first row
+    candidates = np.flatnonzero(counts == counts.max())
+    return int(candidates[int(np.argmin(first_seen[candidates]))])
+
+
+def first_seen_values(data: EncodedDataset, name: str) -> List[str]:
+    # Values of column name in the order of their first row (like unique())
+    vocabulary = data.vocabularies[name]
+    return [vocabulary[k] for k in pd.unique(data.column(name))]
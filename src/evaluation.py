@@ -1,48 +1,269 @@
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from functools import partial
 from sklearn.model_selection import StratifiedKFold
+from typing import Any, Dict, List, Sequence, Union
+import itertools
 import numpy as np
+import os
+
+from src.contingency import ContingencyCounts
+from src.encoding import UNKNOWN_CODE, EncodedDataset, as_encoded, majority_code_from_counts
+from src.metrics import span
+from src.shared_data import SharedArrays, attach_dataset
 
 def evaluate_on_test(model, test_df, target_col):
-    test_df = test_df.copy()
-    # norm as string
-    for c in test_df.columns:
-        test_df[c] = test_df[c].astype(str).str.strip()
-    preds = []
-    real = test_df[target_col].tolist()
-    for i in range(len(test_df)):
-        preds.append(model.predict_row(test_df.iloc[i]))
-    correct = sum(1 for p, r in zip(preds, real) if p == r)
+    # encode with the model vocabularies, so predictions and labels are compared as class codes
+    test = as_encoded(test_df, model.vocabularies)
+    # read only: test rows are scored with the prediction table built by the model's fit
+    real = test.column(target_col)
+    preds = model.predict_encoded(test)
+    correct = int((preds == real).sum())
     return correct / len(real)
 
-def summarize_cv(df, target_col="lenses", k=5):
+def summarize_cv(df, target_col="lenses", k=5, random_state=None, n_jobs=1):
+    # n_jobs=1 runs the folds serially, otherwise (model, fold) jobs go to a process pool
+    # (None = one worker per CPU)
     from src.r1_model import OneRClassifier
     from src.id3_model import ID3Classifier
     from src.naive_bayes_model import NaiveBayesClassifier
+    from src.bagging import BaggedID3Classifier
     
     print("\n===============================")
     print(f" {k}-Fold Cross Validation Summary")
     print("===============================")
     print(f"{'Model':12s} {'Mean Acc':>10s} {'Std Dev':>10s}   Folds")
 
-    models = [("1R", OneRClassifier), ("ID3", ID3Classifier), ("NaiveBayes", NaiveBayesClassifier)]
+    # the ensemble samples with the CV seed, so the scores depend only on random_state
+    bagged = BaggedID3Classifier if random_state is None else partial(BaggedID3Classifier, random_state=random_state)
+    models = [("1R", OneRClassifier), ("ID3", ID3Classifier), ("NaiveBayes", NaiveBayesClassifier),
+              ("BaggedID3", bagged)]
 
-    for name, cls in models:
-        scores = stratified_kfold_scores(cls, df, target_col, k=k)
+    with span("summarize_cv", rows=len(df), k=k, n_jobs=n_jobs):
+        if n_jobs == 1:
+            results = {name: stratified_kfold_scores(cls, df, target_col, k=k, random_state=random_state) for name, cls in models}
+        else:
+            results = parallel_kfold_scores(models, df, target_col, k=k, random_state=random_state, n_jobs=n_jobs)
+
+    for name, _ in models:
+        scores = results[name]
         print(f"{name:12s} {np.mean(scores):10.3f} {np.std(scores):10.3f}   {', '.join(f'{s:.3f}' for s in scores)}")
 
-def stratified_kfold_scores(model_cls, df, target_col, k=5, random_state=None):
+def fold_assignments(y, k=5, random_state=None) -> np.ndarray:
+    # folds[i] = index of the stratified fold holding row i out
     skf = StratifiedKFold(n_splits=k, shuffle=True, random_state=random_state)
-    y = df[target_col].astype(str).values
-    X = df.reset_index(drop=True)
+    folds = np.empty(len(y), dtype=np.int16)
+    for fold, (_, test_idx) in enumerate(skf.split(np.zeros(len(y)), y)):
+        folds[test_idx] = fold
+    return folds
+
+def _fold_score(model_cls, data: EncodedDataset, folds: np.ndarray, target_col, fold: int) -> float:
+    test_mask = folds == fold
+    model = model_cls()
+    model.set_training_data(data.take(np.flatnonzero(~test_mask)))
+    model.fit(target_col)
+    return evaluate_on_test(model, data.take(np.flatnonzero(test_mask)), target_col)
 
+def stratified_kfold_scores(model_cls, df, target_col, k=5, random_state=None, use_counts=True):
+    # encode once, folds are int8 row subsets of the same matrix.
+    # Count based models (1R, Naive Bayes) are scored with count_kfold_scores() unless use_counts=False,
+    # the scores are the same as with refitting on every training split.
+    data = as_encoded(df)
+    folds = fold_assignments(data.column(target_col), k=k, random_state=random_state)
+    if use_counts and is_count_model(model_cls):
+        return count_kfold_scores(model_cls, data, folds, target_col, k)
+    return [_fold_score(model_cls, data, folds, target_col, fold) for fold in range(k)]
+
+def is_count_model(model_cls) -> bool:
+    # models trained from ContingencyCounts alone (fit_counts)
+    return hasattr(model_cls, "fit_counts")
+
+def _fit_count_model(model_cls, counts: ContingencyCounts, first_seen: np.ndarray, params=None):
+    # first_seen[c] = position of the first training row of class c, fit() of 1R breaks ties
+    # of its default class by it, fit() of Naive Bayes ties of the default class and the scores
+    from src.r1_model import OneRClassifier
+
+    model = model_cls(**(params or {}))
+    if issubclass(model_cls, OneRClassifier):
+        model.fit_counts(counts, default_code=majority_code_from_counts(counts.class_counts, first_seen))
+    else:
+        classes = counts.vocabularies[counts.target_col]
+        model.fit_counts(counts, class_order=[classes[c] for c in np.argsort(first_seen, kind="stable")])
+    return model
+
+def _check_codes(data: EncodedDataset):
+    if (data.codes == UNKNOWN_CODE).any():
+        raise ValueError("Training data contains values outside the vocabulary.")
+
+def _fold_counts(data: EncodedDataset, folds: np.ndarray, target_col, k: int):
+    # (rows of every fold, counts of every fold, counts of all rows, first row of every class in every fold)
+    order = np.argsort(folds, kind="stable")
+    bounds = np.searchsorted(folds[order], np.arange(k + 1))
+    fold_rows = [order[bounds[f]:bounds[f + 1]] for f in range(k)]
+    per_fold = [ContingencyCounts.from_encoded(data, target_col, rows) for rows in fold_rows]
+    total = per_fold[0]
+    for counts in per_fold[1:]:
+        total = total + counts
+
+    # first row of every class in every fold (len(data) = none)
+    y = data.column(target_col)
+    firsts = np.full((k, total.n_classes), len(data), dtype=np.intp)
+    for f, rows in enumerate(fold_rows):
+        classes, index = np.unique(y[rows], return_index=True)
+        firsts[f, classes] = rows[index]
+    return fold_rows, per_fold, total, firsts
+
+def count_kfold_scores(model_cls, data: EncodedDataset, folds: np.ndarray, target_col, k: int):
+    # The counts of every fold are built once (each row is counted once, so one pass over the data
+    # for any k); the training counts of a fold are total - fold. Every model is fitted from
+    # counts only and scores its held-out rows with its prediction table.
+    _check_codes(data)
+    fold_rows, per_fold, total, firsts = _fold_counts(data, folds, target_col, k)
     scores = []
-    for train_idx, test_idx in skf.split(X, y):
-        train_df = X.iloc[train_idx].copy()
-        test_df  = X.iloc[test_idx].copy()
+    for f, rows in enumerate(fold_rows):
+        first_seen = np.delete(firsts, f, axis=0).min(axis=0)
+        model = _fit_count_model(model_cls, total - per_fold[f], first_seen)
+        scores.append(evaluate_on_test(model, data.take(rows), target_col))
+    return scores
+
+def count_loo_scores(model_cls, df, target_col) -> np.ndarray:
+    # Leave-one-out of a count based model: score (0 or 1) of every row predicted by the model
+    # trained on all other rows. Rows with the same values and class leave the same training counts,
+    # so one model is fitted per distinct row (and per first row of a class, which moves the
+    # first seen position of its class), not per row.
+    data = as_encoded(df)
+    _check_codes(data)
+    total = ContingencyCounts.from_encoded(data, target_col)
+    y = data.column(target_col)
 
-        model = model_cls()
-        model.set_training_data(train_df)
-        model.fit(target_col)
+    # first and second row of every class
+    n = len(data)
+    first = np.full(total.n_classes, n, dtype=np.intp)
+    second = np.full(total.n_classes, n, dtype=np.intp)
+    for c in np.flatnonzero(total.class_counts):
+        positions = np.flatnonzero(y == c)[:2]
+        first[c] = positions[0]
+        if len(positions) > 1:
+            second[c] = positions[1]
+    is_first = np.zeros(n, dtype=np.int8)
+    is_first[first[first < n]] = 1
+
+    # one integer per distinct (values, class, is_first) row, digits in base vocabulary size
+    sizes = [len(data.vocabularies[c]) for c in data.columns] + [2]
+    if np.prod(sizes, dtype=float) < 2 ** 62:
+        keys = np.zeros(n, dtype=np.int64)
+        for column, size in zip(list(data.codes.T) + [is_first], sizes):
+            keys *= size
+            keys += column
+    else:
+        keys = np.column_stack([data.codes, is_first])
+    _, representatives, inverse = np.unique(keys, axis=0, return_index=True, return_inverse=True)
+    correct = np.empty(len(representatives), dtype=float)
+    for g, r in enumerate(representatives):
+        held_out = np.array([r])
+        first_seen = first.copy()
+        if is_first[r]:
+            first_seen[y[r]] = second[y[r]]
+        model = _fit_count_model(model_cls, total - ContingencyCounts.from_encoded(data, target_col, held_out), first_seen)
+        correct[g] = float(model.predict_encoded(data.take(held_out))[0] == y[r])
+    return correct[inverse.ravel()]
+
+def parameter_grid(param_grid: Dict[str, Sequence[Any]]) -> List[Dict[str, Any]]:
+    # Every combination of the listed values: {"a": [1, 2], "b": [3]} -> [{"a": 1, "b": 3}, {"a": 2, "b": 3}]
+    names = list(param_grid)
+    return [dict(zip(names, values)) for values in itertools.product(*(param_grid[n] for n in names))]
+
+def grid_search_cv(model_cls, df, target_col, param_grid: Union[Dict[str, Sequence[Any]], Sequence[Dict[str, Any]]],
+                   k=5, n_repeats=1, random_state=None) -> List[Dict[str, Any]]:
+    # Repeated stratified k-fold CV of every parameter set (param_grid: value lists per parameter or a list
+    # of parameter dicts). The data is encoded once and the folds of a repeat are shared by all parameter sets:
+    # count based models are fitted from the fold counts of count_kfold_scores(), ID3 trees of a fold share
+    # their node statistics (fit_grid()), other models are refitted. With one parameter set and n_repeats=1
+    # the scores are those of stratified_kfold_scores().
+    # Returns [{"params", "mean", "std", "scores"}] sorted by mean accuracy, best first.
+    grid = parameter_grid(param_grid) if isinstance(param_grid, dict) else [dict(p) for p in param_grid]
+    data = as_encoded(df)
+    _check_codes(data)
+    y = data.column(target_col)
+    scores = np.zeros((len(grid), n_repeats * k))
+
+    with span("grid_search_cv", rows=len(data), k=k, n_repeats=n_repeats, configs=len(grid)):
+        for repeat in range(n_repeats):
+            # each repeat reshuffles the folds
+            seed = None if random_state is None else random_state + repeat
+            folds = fold_assignments(y, k=k, random_state=seed)
+            if is_count_model(model_cls):
+                fold_rows, per_fold, total, firsts = _fold_counts(data, folds, target_col, k)
+                for f, rows in enumerate(fold_rows):
+                    train = total - per_fold[f]
+                    first_seen = np.delete(firsts, f, axis=0).min(axis=0)
+                    test = data.take(rows)
+                    for g, params in enumerate(grid):
+                        model = _fit_count_model(model_cls, train, first_seen, params)
+                        scores[g, repeat * k + f] = evaluate_on_test(model, test, target_col)
+                continue
+
+            for f in range(k):
+                test_mask = folds == f
+                train = data.take(np.flatnonzero(~test_mask))
+                test = data.take(np.flatnonzero(test_mask))
+                if hasattr(model_cls, "fit_grid"):
+                    base = model_cls()
+                    base.set_training_data(train)
+                    models = base.fit_grid(target_col, grid)
+                else:
+                    models = []
+                    for params in grid:
+                        model = model_cls(**params)
+                        model.set_training_data(train)
+                        model.fit(target_col)
+                        models.append(model)
+                for g, model in enumerate(models):
+                    scores[g, repeat * k + f] = evaluate_on_test(model, test, target_col)
+
+    results = [
+        {"params": params, "mean": float(np.mean(s)), "std": float(np.std(s)), "scores": s.tolist()}
+        for params, s in zip(grid, scores)
+    ]
+    # stable sort, equal means keep the grid order
+    return sorted(results, key=lambda r: -r["mean"])
+
+def print_grid_search(results: List[Dict[str, Any]], top=10):
+    print(f"{'Mean Acc':>10s} {'Std Dev':>10s}   Parameters")
+    for r in results[:top]:
+        params = ", ".join(f"{name}={value}" for name, value in r["params"].items()) or "(defaults)"
+        print(f"{r['mean']:10.3f} {r['std']:10.3f}   {params}")
+
+# dataset attached once per worker process by _init_cv_worker
+_cv_worker = {}
+
+def _init_cv_worker(handle):
+    data, arrays = attach_dataset(handle)
+    _cv_worker["data"] = data
+    _cv_worker["folds"] = arrays["folds"]
+
+def _cv_job(model_cls, target_col, fold):
+    return _fold_score(model_cls, _cv_worker["data"], _cv_worker["folds"], target_col, fold)
+
+def parallel_kfold_scores(models, df, target_col, k=5, random_state=None, n_jobs=None):
+    # models: [(name, model_cls)]. Every (model, fold) pair is one job on a process pool.
+    # The encoded dataset and the fold assignment are put in shared memory once and
+    # attached by the workers, folds are fixed up front so results depend only on random_state.
+    data = as_encoded(df)
+    folds = fold_assignments(data.column(target_col), k=k, random_state=random_state)
+    scores = {name: [0.0] * k for name, _ in models}
+    # count based models take one pass over the data, they are not worth a worker
+    for name, cls in models:
+        if is_count_model(cls):
+            scores[name] = count_kfold_scores(cls, data, folds, target_col, k)
+    jobs = [(name, cls, fold) for name, cls in models if not is_count_model(cls) for fold in range(k)]
+    if not jobs:
+        return scores
+    workers = min(len(jobs), n_jobs or os.cpu_count() or 1)
 
-        acc = evaluate_on_test(model, test_df, target_col)
-        scores.append(acc)
-    return scores
\ No newline at end of file
+    with SharedArrays.from_dataset(data, folds=folds) as shared:
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_cv_worker, initargs=(shared.handle,)) as pool:
+            futures = {pool.submit(_cv_job, cls, target_col, fold): (name, fold) for name, cls, fold in jobs}
+            for future in as_completed(futures):
+                name, fold = futures[future]
+                scores[name][fold] = future.result()
+    return scores
@@ -1,7 +1,19 @@
+import numpy as np
 import pandas as pd
+import heapq
+import itertools
 import math
-from typing import Dict, Optional
-from dataclasses import dataclass
+from concurrent.futures import Future, ProcessPoolExecutor
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple, Union
+from dataclasses import dataclass, field
+
+from src.artifacts import read_artifact, write_artifact
+from src.config import ID3_N_JOBS, ID3_PARALLEL_MIN_ROWS
+from src.contingency import ContingencyCounts, count_tensor, counts_from_chunks
+from src.metrics import span
+from src.encoding import UNKNOWN_CODE, EncodedDataset, as_encoded, majority_code, normalize_value, recode
+from src.lookup import LOOKUP_MAX_CELLS, PredictionTable, build_prediction_table
+from src.shared_data import SharedArrays, attach_dataset, pool_workers, row_index_dtype
 
 
 # Tree
@@ -10,132 +22,765 @@ class TreeNode:
     attribute: Optional[str] = None       # attr name if node
     branches: Optional[Dict[str, "TreeNode"]] = None
     label: Optional[str] = None           # if leaf
+    # majority class of the training rows (first seen on ties, None for loaded trees), the label when cut to a leaf
+    majority: Optional[str] = field(default=None, compare=False, repr=False)
+    # class counts of the training rows reaching the node (None for loaded trees), used by pruning
+    counts: Optional[np.ndarray] = field(default=None, compare=False, repr=False)
 
     def is_leaf(self) -> bool:
         return self.label is not None
 
 
-class ID3Classifier:
-    def __init__(self):
-        self.df: Optional[pd.DataFrame] = None
-        self.target_col: Optional[str] = None
-        self.tree: Optional[TreeNode] = None
-        self.default_class: Optional[str] = None
-        self.fitted: bool = False
+# Class counts and split candidates of the rows reaching one node, filled as they are needed.
+# fit_grid() keeps them per node path, so trees fitted with other parameters reuse them.
+@dataclass
+class SplitStats:
+    class_counts: np.ndarray
+    tables: List[np.ndarray]                        # (value, class) counts per candidate attribute
+    values: Optional[List[List[int]]] = None        # value codes per attribute in order of appearance
+    gains: Optional[Dict[str, float]] = None
+    smallest_branch: Optional[Dict[str, int]] = None
+    majority: Optional[str] = None
+    splits: Dict[str, List[Tuple[int, np.ndarray]]] = field(default_factory=dict)
 
-    def set_training_data(self, df: pd.DataFrame):
-        # simple normalization
-        self.df = df.astype(str).apply(lambda col: col.str.strip())
 
-    def _entropy(self, col: pd.Series) -> float:
-        counts = col.value_counts()
-        total = len(col)
-        return -sum((count / total) * math.log2(count / total) for count in counts if count > 0)
+# Flat array form of a TreeNode tree, node 0 is the root
+@dataclass
+class CompiledTree:
+    feature: np.ndarray     # (nodes,) index into attributes, -1 for leaves
+    children: np.ndarray    # (nodes, max_values + 1) child node per value code, -1 = no branch
+    label: np.ndarray       # (nodes,) class code for leaves, -1 for inner nodes
 
-    def _info_gain(self, df: pd.DataFrame, attr: str) -> float:
-        base_entropy = self._entropy(df[self.target_col])
-        values = df[attr].unique()
+    @property
+    def n_nodes(self) -> int:
+        return len(self.feature)
 
-        entropy_after_split = 0.0
-        for v in values:
-            subset = df[df[attr] == v]
-            weight = len(subset) / len(df)
-            entropy_after_split += weight * self._entropy(subset[self.target_col])
 
-        return base_entropy - entropy_after_split
+PRUNING_METHODS = (None, "pessimistic")
 
-    def _majority_class(self, df: pd.DataFrame) -> str:
-        counts = df[self.target_col].value_counts()
-        majority_class = counts.index[0]
-        return str(majority_class)
 
-    def _build_tree(self, df: pd.DataFrame, attrs) -> TreeNode:
-        classes = df[self.target_col].unique()
+# Parallel fit: the training codes are shared with the workers once, every worker keeps
+# a model over them. Nodes with parallel_min_rows rows or more are split by the parent with
+# counts summed from row chunks counted by the workers, the subtrees of smaller children are
+# built whole by one worker. Both give exactly what the serial fit computes.
+_id3_worker = {}
 
-        # if only one class -> leaf
-        if len(classes) == 1:
-            return TreeNode(label=str(classes[0]))
+def _init_id3_worker(handle, params, target_col):
+    data, _ = attach_dataset(handle)
+    model = ID3Classifier(**params)
+    model.data = data
+    model.vocabularies = data.vocabularies
+    model.target_col = target_col
+    _id3_worker["model"] = model
 
-        # if no attr -> leaf with majority class
-        if not attrs:
-            return TreeNode(label=self._majority_class(df))
+def _subtree_job(rows, attrs, depth):
+    return _id3_worker["model"]._build_tree(rows, attrs, depth)
 
-        gains = {attr: self._info_gain(df, attr) for attr in attrs}
-        best_attr = max(gains, key=lambda a: gains[a])
-        branches = {}
-        for value in df[best_attr].unique():
-            # divide dataset by best_attr
-            subset = df[df[best_attr] == value]
-            if subset.empty:
-                # if there is no examples -> leaf with majority class
-                branches[value] = TreeNode(label=self._majority_class(df))
+def _counts_job(rows, cols, sizes, n_classes):
+    data = _id3_worker["model"].data
+    return count_tensor(data.codes, rows, cols, sizes, data.column_index(_id3_worker["model"].target_col), n_classes)
+
+
+class ID3Classifier:
+    def __init__(
+        self,
+        max_depth: Optional[int] = None,
+        min_samples_leaf: int = 1,
+        min_gain: float = 0.0,
+        max_nodes: Optional[int] = None,
+        pruning: Optional[str] = None,
+        n_jobs: Optional[int] = ID3_N_JOBS,
+        parallel_min_rows: int = ID3_PARALLEL_MIN_ROWS,
+    ):
+        # max_depth: nodes at this depth become leaves (None = grow until pure / no attributes left)
+        # min_samples_leaf: attributes whose split leaves a branch with fewer rows are not used
+        # min_gain: a node whose best split gains less becomes a leaf (0 = any split)
+        # max_nodes: the tree is grown best first up to at most this many nodes, see _grow_best_first()
+        # pruning: "pessimistic" prunes the grown tree on its training counts, see _prune_pessimistic()
+        # n_jobs: worker processes building one tree (1 = serial, None = one per CPU), the tree is the same
+        # parallel_min_rows: nodes with fewer rows are built by a single worker, smaller datasets are fitted serially
+        if max_depth is not None and max_depth < 0:
+            raise ValueError("max_depth must be >= 0.")
+        if min_samples_leaf < 1:
+            raise ValueError("min_samples_leaf must be >= 1.")
+        if max_nodes is not None and max_nodes < 1:
+            raise ValueError("max_nodes must be >= 1.")
+        if parallel_min_rows < 1:
+            raise ValueError("parallel_min_rows must be >= 1.")
+        if pruning not in PRUNING_METHODS:
+            raise ValueError(f"Unknown pruning '{pruning}', use one of {PRUNING_METHODS}.")
+        self.max_depth = max_depth
+        self.min_samples_leaf = min_samples_leaf
+        self.min_gain = min_gain
+        self.max_nodes = max_nodes
+        self.pruning = pruning
+        self.n_jobs = n_jobs
+        self.parallel_min_rows = parallel_min_rows
+        # (process pool, workers) while a parallel fit runs
+        self._pool: Optional[Tuple[ProcessPoolExecutor, int]] = None
+        self.data: Optional[EncodedDataset] = None
+        self.vocabularies: Dict[str, List[str]] = {}
+        self.target_col: Optional[str] = None
+        self.tree: Optional[TreeNode] = None
+        self.default_class: Optional[str] = None
+        self.fitted: bool = False
+        # prediction structures, built from tree by _compile()
+        self.attributes: List[str] = []
+        self.compiled: Optional[CompiledTree] = None
+        self.default_code: int = UNKNOWN_CODE
+        # plain list copies of the arrays for the single-row path
+        self._value_codes: Dict[str, Dict[str, int]] = {}
+        self._row_feature: List[int] = []
+        self._row_children: List[List[int]] = []
+        self._row_label: List[Optional[str]] = []
+        # optional dense prediction table, see build_lookup()
+        self.lookup: Optional[PredictionTable] = None
+        # training rows reaching every compiled node (0 for loaded trees), weights of tree_stats()
+        self._node_rows: np.ndarray = np.empty(0, dtype=np.int64)
+
+    def set_training_data(self, data: Union[pd.DataFrame, EncodedDataset]):
+        self.data = as_encoded(data)
+        self.vocabularies = self.data.vocabularies
+
+    def _entropy(self, counts: List[int]) -> float:
+        # class counts taken in value_counts() order, so the float sum is the same as on a column
+        total = sum(counts)
+        return -sum((count / total) * math.log2(count / total) for count in sorted(counts, reverse=True) if count > 0)
+
+    def _info_gain(self, base_entropy: float, total: int, value_counts: List[List[int]]) -> float:
+        # value_counts: class counts of every attribute value, in order of appearance
+        entropy_after_split = 0.0
+        for counts in value_counts:
+            weight = sum(counts) / total
+            entropy_after_split += weight * self._entropy(counts)
+
+        return base_entropy - entropy_after_split
+
+    def _label(self, attr: str, code) -> str:
+        return self.vocabularies[attr][int(code)]
+
+    def _majority_class(self, rows: np.ndarray) -> str:
+        assert self.data is not None
+        y = self.data.codes[rows, self.data.column_index(self.target_col)]
+        return self._label(self.target_col, majority_code(y, len(self.vocabularies[self.target_col])))
+
+    def _values_in_order(self, rows: np.ndarray, cols: List[int], sizes: List[int], n_present: int) -> List[List[int]]:
+        # Value codes of every column in order of first appearance among rows (like unique()).
+        # All present values almost always show up in the first rows, so a growing prefix is scanned.
+        assert self.data is not None
+        offsets = np.cumsum(sizes) - sizes
+        column_of = np.repeat(np.arange(len(cols)), sizes)
+        size = 64
+        while True:
+            prefix = rows[:size]
+            slots = np.empty((len(prefix), len(cols)), dtype=np.intp)
+            for j, c in enumerate(cols):
+                slots[:, j] = self.data.codes[prefix, c]
+            slots += offsets
+            order = pd.unique(slots.ravel())
+            if len(order) == n_present or size >= len(rows):
+                break
+            size *= 8
+
+        values: List[List[int]] = [[] for _ in cols]
+        for slot in order:
+            j = column_of[slot]
+            values[j].append(int(slot - offsets[j]))
+        return values
+
+    def _split_stats(self, rows: np.ndarray, attrs: List[str]) -> SplitStats:
+        assert self.data is not None
+        n_classes = len(self.vocabularies[self.target_col])
+        cols = [self.data.column_index(a) for a in attrs]
+        sizes = [len(self.vocabularies[a]) for a in attrs]
+        if self._pool is not None:
+            # one chunk of rows per worker, the counts of the chunks add up
+            pool, workers = self._pool
+            parts = [
+                pool.submit(_counts_job, chunk, cols, sizes, n_classes) for chunk in np.array_split(rows, workers)
+            ]
+            results = [part.result() for part in parts]
+            class_counts = sum(r[0] for r in results)
+            tables = [sum(r[1][j] for r in results) for j in range(len(cols))]
+            return SplitStats(class_counts, tables)
+        # one class-count pass gives the (value, class) tables of every candidate attribute
+        class_counts, tables = count_tensor(
+            self.data.codes, rows, cols, sizes, self.data.column_index(self.target_col), n_classes
+        )
+        return SplitStats(class_counts, tables)
+
+    def _gains(self, stats: SplitStats, rows: np.ndarray, attrs: List[str]) -> Dict[str, float]:
+        if stats.gains is None:
+            assert self.data is not None
+            cols = [self.data.column_index(a) for a in attrs]
+            sizes = [len(self.vocabularies[a]) for a in attrs]
+            n_present = sum(int((t.sum(axis=1) > 0).sum()) for t in stats.tables)
+            stats.values = self._values_in_order(rows, cols, sizes, n_present)
+            base_entropy = self._entropy(stats.class_counts.tolist())
+            stats.gains = {
+                attr: self._info_gain(base_entropy, len(rows), [stats.tables[j][v].tolist() for v in stats.values[j]])
+                for j, attr in enumerate(attrs)
+            }
+            stats.smallest_branch = {
+                attr: int(stats.tables[j].sum(axis=1)[stats.values[j]].min()) for j, attr in enumerate(attrs)
+            }
+        return stats.gains
+
+    def _majority(self, stats: SplitStats, rows: np.ndarray) -> str:
+        # majority class of rows, ties go to the class seen first (majority_code)
+        if stats.majority is None:
+            counts = stats.class_counts
+            candidates = np.flatnonzero(counts == counts.max())
+            if len(candidates) == 1:
+                stats.majority = self._label(self.target_col, candidates[0])
             else:
-                # continue with dividing dataset by remaining attributes
-                remaining_attrs = [a for a in attrs if a != best_attr]
-                branches[value] = self._build_tree(subset, remaining_attrs)
+                stats.majority = self._majority_class(rows)
+        return stats.majority
+
+    def _leaf(self, stats: SplitStats, rows: np.ndarray) -> TreeNode:
+        # leaf with the majority class of rows
+        label = self._majority(stats, rows)
+        return TreeNode(label=label, counts=stats.class_counts, majority=label)
+
+    def _node_stats(
+        self, rows: np.ndarray, attrs: List[str], cache: Optional[Dict[tuple, SplitStats]], path: tuple
+    ) -> SplitStats:
+        # cache: SplitStats per node path ((attribute, value code), ...) shared by the fits of fit_grid()
+        stats = cache.get(path) if cache is not None else None
+        if stats is None:
+            stats = self._split_stats(rows, attrs)
+            if cache is not None:
+                cache[path] = stats
+        return stats
+
+    def _best_split(self, stats: SplitStats, rows: np.ndarray, attrs: List[str], depth: int) -> Optional[str]:
+        # attribute the node is split on, None when the node is a leaf
+        # if only one class -> leaf
+        if np.count_nonzero(stats.class_counts) == 1:
+            return None
+
+        # if no attr or depth limit -> leaf with majority class
+        if not attrs or (self.max_depth is not None and depth >= self.max_depth):
+            return None
+
+        gains = self._gains(stats, rows, attrs)
+        assert stats.smallest_branch is not None
+        candidates = [a for a in attrs if stats.smallest_branch[a] >= self.min_samples_leaf]
+        if not candidates:
+            return None
+        best_attr = max(candidates, key=lambda a: gains[a])
+        if self.min_gain > 0 and gains[best_attr] < self.min_gain:
+            return None
+        return best_attr
+
+    def _split_rows(
+        self, stats: SplitStats, rows: np.ndarray, attrs: List[str], attr: str, cache: Optional[Dict[tuple, SplitStats]]
+    ) -> List[Tuple[int, np.ndarray]]:
+        # (value code, rows) of every value of attr present in rows, in order of appearance
+        subsets = stats.splits.get(attr)
+        if subsets is None:
+            assert self.data is not None and stats.values is not None
+            column = self.data.codes[rows, self.data.column_index(attr)]
+            subsets = [(value, rows[column == value]) for value in stats.values[attrs.index(attr)]]
+            if cache is not None:
+                stats.splits[attr] = subsets
+        return subsets
+
+    def _build_tree(
+        self,
+        rows: np.ndarray,
+        attrs: List[str],
+        depth: int = 0,
+        cache: Optional[Dict[tuple, SplitStats]] = None,
+        path: tuple = (),
+    ) -> TreeNode:
+        # rows: indices into the encoded training matrix, no sub-DataFrames are built.
+        stats = self._node_stats(rows, attrs, cache, path)
+        best_attr = self._best_split(stats, rows, attrs, depth)
+        if best_attr is None:
+            return self._leaf(stats, rows)
+        remaining_attrs = [a for a in attrs if a != best_attr]
+        # divide rows by best_attr and continue with the remaining attributes
+        subsets = self._split_rows(stats, rows, attrs, best_attr, cache)
+
+        futures: Dict[int, Future] = {}
+        if self._pool is not None:
+            # in a parallel fit every node built here has parallel_min_rows rows or more,
+            # smaller children go to the workers first and are collected in branch order
+            pool, _ = self._pool
+            futures = {
+                value: pool.submit(_subtree_job, subset, remaining_attrs, depth + 1)
+                for value, subset in subsets if len(subset) < self.parallel_min_rows
+            }
+
+        children = {}
+        for value, subset in subsets:
+            if value not in futures:
+                children[value] = self._build_tree(
+                    subset, remaining_attrs, depth + 1, cache, path + ((best_attr, value),)
+                )
+        branches = {}
+        for value, _ in subsets:
+            branches[self._label(best_attr, value)] = futures[value].result() if value in futures else children[value]
 
         # return ID3 Tree
-        return TreeNode(attribute=best_attr, branches=branches)
+        return TreeNode(
+            attribute=best_attr, branches=branches, counts=stats.class_counts, majority=self._majority(stats, rows)
+        )
+
+    def _grow_best_first(
+        self, rows: np.ndarray, attrs: List[str], cache: Optional[Dict[tuple, SplitStats]] = None
+    ) -> TreeNode:
+        # Tree of at most max_nodes nodes. Of the leaves _build_tree() would split, the one with the largest
+        # information gain weighted by its rows (first created on ties) is split next, as long as its branches
+        # fit in the budget. Nodes past the budget are never built, so fit time and memory stay bounded.
+        # With a large enough budget this is the tree of _build_tree().
+        assert self.max_nodes is not None
+        order = itertools.count()
+        # (-weighted gain, creation order, leaf, stats, rows, attrs, depth, path, split attribute)
+        frontier: List[tuple] = []
+
+        def grow(stats: SplitStats, rows: np.ndarray, attrs: List[str], depth: int, path: tuple) -> TreeNode:
+            leaf = self._leaf(stats, rows)
+            best_attr = self._best_split(stats, rows, attrs, depth)
+            if best_attr is not None:
+                assert stats.gains is not None
+                priority = -stats.gains[best_attr] * len(rows)
+                heapq.heappush(frontier, (priority, next(order), leaf, stats, rows, attrs, depth, path, best_attr))
+            return leaf
+
+        root = grow(self._node_stats(rows, attrs, cache, ()), rows, attrs, 0, ())
+        n_nodes = 1
+        while frontier:
+            _, _, node, stats, rows, attrs, depth, path, best_attr = heapq.heappop(frontier)
+            assert stats.values is not None
+            if n_nodes + len(stats.values[attrs.index(best_attr)]) > self.max_nodes:
+                continue
+            remaining_attrs = [a for a in attrs if a != best_attr]
+            # the leaf becomes the inner node, its majority class is kept
+            node.label, node.attribute, node.branches = None, best_attr, {}
+            for value, subset in self._split_rows(stats, rows, attrs, best_attr, cache):
+                child_path = path + ((best_attr, value),)
+                child_stats = self._node_stats(subset, remaining_attrs, cache, child_path)
+                node.branches[self._label(best_attr, value)] = grow(
+                    child_stats, subset, remaining_attrs, depth + 1, child_path
+                )
+                n_nodes += 1
+        return root
+
+    def _as_leaf(self, node: TreeNode) -> TreeNode:
+        # node replaced by a leaf with the majority class of its training rows (same tie-break as _leaf())
+        assert node.counts is not None and node.majority is not None
+        return TreeNode(label=node.majority, counts=node.counts, majority=node.majority)
+
+    def _leaf_errors(self, node: TreeNode) -> Tuple[int, int]:
+        # (misclassified training rows, leaves) of the subtree under node
+        assert node.counts is not None
+        if node.is_leaf():
+            classes = self.vocabularies[self.target_col]
+            return int(node.counts.sum() - node.counts[classes.index(node.label)]), 1
+        errors, leaves = 0, 0
+        assert node.branches is not None
+        for child in node.branches.values():
+            e, l = self._leaf_errors(child)
+            errors += e
+            leaves += l
+        return errors, leaves
+
+    def _prune_pessimistic(self, node: TreeNode) -> TreeNode:
+        # Pessimistic error pruning (Quinlan), bottom-up on the training counts only: every leaf gets
+        # 0.5 extra errors, a subtree becomes a leaf when the leaf's corrected errors are within one
+        # standard error of the subtree's.
+        if node.is_leaf():
+            return node
+        assert node.branches is not None and node.counts is not None
+        node.branches = {val: self._prune_pessimistic(child) for val, child in node.branches.items()}
+        errors, leaves = self._leaf_errors(node)
+        n = int(node.counts.sum())
+        subtree_errors = errors + 0.5 * leaves
+        standard_error = math.sqrt(subtree_errors * max(n - subtree_errors, 0.0) / n)
+        if n - int(node.counts.max()) + 0.5 <= subtree_errors + standard_error:
+            return self._as_leaf(node)
+        return node
+
+    def prune_reduced_error(self, validation: Union[pd.DataFrame, EncodedDataset]):
+        # Reduced error pruning with held-out rows: bottom-up, a subtree becomes a leaf (majority class
+        # of its training rows) when that does not lower the accuracy on the validation rows reaching it.
+        if not self.fitted or self.tree is None:
+            raise RuntimeError("Model not fitted. Call fit() first.")
+        if self.tree.counts is None:
+            raise RuntimeError("Tree has no training counts (loaded from an artifact). Fit it again to prune.")
+        data = recode(as_encoded(validation, self.vocabularies), self.vocabularies)
+        y = data.column(self.target_col)
+        classes = self.vocabularies[self.target_col]
+
+        def prune(node: TreeNode, rows: np.ndarray) -> Tuple[TreeNode, int]:
+            if node.is_leaf():
+                return node, int((y[rows] == classes.index(node.label)).sum())
+            assert node.branches is not None and node.attribute is not None
+            column = data.column(node.attribute)[rows]
+            vocabulary = self.vocabularies[node.attribute]
+            correct = 0
+            covered = np.zeros(len(rows), dtype=bool)
+            for val, child in list(node.branches.items()):
+                mask = column == vocabulary.index(val)
+                covered |= mask
+                node.branches[val], child_correct = prune(child, rows[mask])
+                correct += child_correct
+            # rows without a branch get the default class
+            correct += int((y[rows[~covered]] == self.default_code).sum())
+            leaf = self._as_leaf(node)
+            leaf_correct = int((y[rows] == classes.index(leaf.label)).sum())
+            if leaf_correct >= correct:
+                return leaf, leaf_correct
+            return node, correct
+
+        with span("prune_reduced_error", rows=len(data), model="id3") as stage:
+            self.tree, _ = prune(self.tree, np.arange(len(data)))
+            self._compile(self.attributes)
+            self.build_lookup()
+            stage.set(nodes=self.compiled.n_nodes)
+
+    def root_attribute_from_counts(self, counts: ContingencyCounts) -> Tuple[str, Dict[str, float]]:
+        # Root split of the tree from counts only: (best attribute, information gain of every attribute).
+        # Values are summed in code order, fit() sums them in order of appearance; the choice
+        # can only differ between attributes whose gains are equal up to float rounding.
+        base_entropy = self._entropy(counts.class_counts.tolist())
+        gains = {}
+        for attr in counts.attributes:
+            table = counts.attr_counts[attr]
+            gains[attr] = self._info_gain(base_entropy, counts.total, [row.tolist() for row in table if row.sum() > 0])
+        best_attr = max(gains, key=lambda a: gains[a])
+        return best_attr, gains
 
+    def root_attribute_stream(self, chunks: Iterable[Union[pd.DataFrame, EncodedDataset]], target_col: str) -> Tuple[str, Dict[str, float]]:
+        # Same as root_attribute_from_counts() for a dataset read in chunks, memory is bounded by the chunk size
+        with span("root_attribute_stream", model="id3") as stage:
+            counts = counts_from_chunks(chunks, target_col)
+            stage.set(rows=counts.total)
+            return self.root_attribute_from_counts(counts)
 
     def fit(self, target_col: str):
-        if self.df is None:
+        if self.data is None:
             raise RuntimeError("Use set_training_data() first.")
-
+        if (self.data.codes == UNKNOWN_CODE).any():
+            raise ValueError("Training data contains values outside the vocabulary.")
+
+        with span("fit", rows=len(self.data), model="id3") as stage:
+            self._fit(target_col)
+            # the prediction table is part of the fitted model, predictions and evaluations only read it
+            self.build_lookup()
+            stage.set(nodes=self.compiled.n_nodes)
+
+    def _fit(
+        self,
+        target_col: str,
+        cache: Optional[Dict[tuple, SplitStats]] = None,
+        rows: Optional[np.ndarray] = None,
+        attrs: Optional[List[str]] = None,
+    ):
+        # rows: training row indices (may repeat, e.g. a bootstrap sample), all rows by default
+        # attrs: candidate attributes, all but target_col by default
+        assert self.data is not None
         self.target_col = target_col
+        # int32 row indices while they fit, the arrays of the row splits are half the size
+        # (the row chunks and subtrees of a parallel fit are pickled to the workers)
+        if rows is None:
+            rows = np.arange(len(self.data), dtype=row_index_dtype(len(self.data)))
+        else:
+            rows = rows.astype(row_index_dtype(len(self.data)), copy=False)
+        if attrs is None:
+            attrs = [c for c in self.data.columns if c != target_col]
         # Default class is the global majority, used as fallback in prediction
-        self.default_class = self._majority_class(self.df)
-        attrs = [c for c in self.df.columns if c != target_col]
-
-        self.tree = self._build_tree(self.df, attrs)
+        if cache is None:
+            self.default_class = self._majority_class(rows)
+        else:
+            if () not in cache:
+                cache[()] = self._split_stats(rows, attrs)
+            self.default_class = self._leaf(cache[()], rows).label
+
+        workers = self._workers()
+        if self.max_nodes is not None:
+            # bounded growth is serial, the budget already bounds the work
+            self.tree = self._grow_best_first(rows, attrs, cache)
+        elif workers > 1 and cache is None and len(rows) >= self.parallel_min_rows:
+            with SharedArrays.from_dataset(self.data) as shared:
+                with ProcessPoolExecutor(max_workers=workers, initializer=_init_id3_worker,
+                                         initargs=(shared.handle, self.params, target_col)) as pool:
+                    self._pool = (pool, workers)
+                    try:
+                        self.tree = self._build_tree(rows, attrs)
+                    finally:
+                        self._pool = None
+        else:
+            self.tree = self._build_tree(rows, attrs, cache=cache)
+        if self.pruning == "pessimistic":
+            self.tree = self._prune_pessimistic(self.tree)
+        self._compile(attrs)
         self.fitted = True
 
-    def _predict_from_tree(self, node: TreeNode, row: Dict[str, str]) -> str:
-        # If node is a leaf -> return its class label
-        if node.is_leaf():
-            assert node.label is not None
-            return node.label
-
-        # Otherwise follow the branch matching the value of the node's attribute
-        assert node.attribute is not None
-        assert node.branches is not None
-
-        val = row.get(node.attribute)
-        # If the value exists among the branches, continue recursively
-        if val in node.branches:
-            return self._predict_from_tree(node.branches[val], row)
-
-        # If unseen attribute value -> fallback to default class
-        assert self.default_class is not None
-        return self.default_class
+    def _workers(self) -> int:
+        # Serial inside worker processes (e.g. a cross-validation job or a bagged tree), see pool_workers()
+        return pool_workers(self.n_jobs)
+
+    @property
+    def params(self) -> Dict[str, Any]:
+        return {
+            "max_depth": self.max_depth,
+            "min_samples_leaf": self.min_samples_leaf,
+            "min_gain": self.min_gain,
+            "max_nodes": self.max_nodes,
+            "pruning": self.pruning,
+        }
+
+    def fit_grid(self, target_col: str, param_sets: Sequence[Dict[str, Any]]) -> List["ID3Classifier"]:
+        # One model per parameter set on the training data of this model. The class counts,
+        # gains and row splits of every node are computed once and shared: the unlimited tree
+        # is grown once and the other trees mostly reuse its nodes. Each model is the same as
+        # ID3Classifier(**params) fitted on its own.
+        if self.data is None:
+            raise RuntimeError("Use set_training_data() first.")
+        if (self.data.codes == UNKNOWN_CODE).any():
+            raise ValueError("Training data contains values outside the vocabulary.")
+
+        cache: Dict[tuple, SplitStats] = {}
+        models = []
+        with span("fit_grid", rows=len(self.data), model="id3", configs=len(param_sets)):
+            for params in param_sets:
+                model = ID3Classifier(**params)
+                model.data = self.data
+                model.vocabularies = self.vocabularies
+                model._fit(target_col, cache)
+                model.build_lookup()
+                models.append(model)
+        return models
+
+    def _compile(self, attrs: List[str]):
+        # Number nodes in preorder and store them in flat arrays.
+        # Value code -1 (unseen value) indexes the last children column, which is always -1.
+        assert self.tree is not None
+        # a refit invalidates the prediction table
+        self.lookup = None
+        classes = self.vocabularies[self.target_col]
+        width = max([len(self.vocabularies[a]) for a in attrs], default=0) + 1
+        feature: List[int] = []
+        children: List[List[int]] = []
+        label: List[int] = []
+        node_rows: List[int] = []
+
+        stack = [(self.tree, -1, UNKNOWN_CODE)]
+        while stack:
+            node, parent, code = stack.pop()
+            index = len(feature)
+            if parent >= 0:
+                children[parent][code] = index
+            children.append([UNKNOWN_CODE] * width)
+            node_rows.append(int(node.counts.sum()) if node.counts is not None else 0)
+            if node.is_leaf():
+                feature.append(UNKNOWN_CODE)
+                label.append(classes.index(node.label))
+                continue
+            assert node.attribute is not None and node.branches is not None
+            feature.append(attrs.index(node.attribute))
+            label.append(UNKNOWN_CODE)
+            vocabulary = self.vocabularies[node.attribute]
+            for val, child in reversed(list(node.branches.items())):
+                stack.append((child, index, vocabulary.index(val)))
+
+        self.attributes = list(attrs)
+        self.compiled = CompiledTree(
+            feature=np.array(feature, dtype=np.intp),
+            children=np.array(children, dtype=np.intp).reshape(len(feature), width),
+            label=np.array(label, dtype=np.intp),
+        )
+        self.default_code = classes.index(self.default_class)
+        self._node_rows = np.array(node_rows, dtype=np.int64)
+        self._value_codes = {a: {v: k for k, v in enumerate(self.vocabularies[a])} for a in attrs}
+        self._row_feature = feature
+        self._row_children = children
+        self._row_label = [classes[k] if k >= 0 else None for k in label]
+
+    def to_state(self) -> Dict[str, Any]:
+        # The compiled node arrays describe the whole tree, no rows are stored
+        if not self.fitted or self.compiled is None:
+            raise RuntimeError("Model not fitted. Call fit() first.")
+        return {
+            "target_col": self.target_col,
+            "attributes": list(self.attributes),
+            "vocabularies": {c: list(self.vocabularies[c]) for c in self.attributes + [self.target_col]},
+            "default_class": self.default_class,
+            "params": self.params,
+            "feature": self.compiled.feature.tolist(),
+            "children": self.compiled.children.tolist(),
+            "label": self.compiled.label.tolist(),
+        }
+
+    @classmethod
+    def from_state(cls, state: Dict[str, Any]) -> "ID3Classifier":
+        model = cls(**state.get("params", {}))
+        model.target_col = state["target_col"]
+        model.vocabularies = {c: list(v) for c, v in state["vocabularies"].items()}
+        model.default_class = state["default_class"]
+        attrs = list(state["attributes"])
+        classes = model.vocabularies[model.target_col]
+        feature, children, label = state["feature"], state["children"], state["label"]
+
+        # Nodes are in preorder: children come after their parent and in branch order
+        nodes: List[TreeNode] = [TreeNode()] * len(feature)
+        for index in reversed(range(len(feature))):
+            if feature[index] < 0:
+                nodes[index] = TreeNode(label=classes[label[index]])
+                continue
+            attr = attrs[feature[index]]
+            branches = sorted((child, code) for code, child in enumerate(children[index]) if child >= 0)
+            nodes[index] = TreeNode(
+                attribute=attr,
+                branches={model.vocabularies[attr][code]: nodes[child] for child, code in branches},
+            )
+        model.tree = nodes[0]
+        model._compile(attrs)
+        model.fitted = True
+        return model
+
+    def save(self, path, fingerprint: Optional[str] = None):
+        write_artifact(path, "id3", self.to_state(), fingerprint)
+
+    @classmethod
+    def load(cls, path, fingerprint: Optional[str] = None) -> "ID3Classifier":
+        # fingerprint: when given, artifacts trained on other data raise ValueError
+        state, _ = read_artifact(path, "id3", fingerprint)
+        model = cls.from_state(state)
+        model.build_lookup()
+        return model
+
+    def build_lookup(self, max_cells: int = LOOKUP_MAX_CELLS) -> bool:
+        # Precomputes the leaf of every combination of known values of the attributes used by the tree,
+        # used by predict_encoded()/predict_batch(). A single row is cheaper to walk: the walk looks up
+        # only the attributes on its path. Returns False when the space is larger than max_cells (no table).
+        if not self.fitted or self.compiled is None:
+            raise RuntimeError("Model not fitted. Call fit() first.")
+        if self.lookup is not None:
+            return True
+        used = sorted(set(self.compiled.feature[self.compiled.feature >= 0].tolist()))
+        self.lookup = build_prediction_table(
+            [self.attributes[j] for j in used], self.vocabularies, self.target_col, self._predict_codes, max_cells
+        )
+        return self.lookup is not None
 
     def predict_row(self, row):
-        if not self.fitted or self.tree is None:
+        if not self.fitted or self.compiled is None:
             raise RuntimeError("Model not fitted. Call fit() first.")
 
-        row = {k: str(v).strip() for k, v in row.items()}
-        return self._predict_from_tree(self.tree, row)
+        # Walk the flat node lists; only attributes on the path are looked up
+        feature = self._row_feature
+        children = self._row_children
+        node = 0
+        while feature[node] >= 0:
+            attr = self.attributes[feature[node]]
+            code = self._value_codes[attr].get(normalize_value(row[attr]), UNKNOWN_CODE) if attr in row else UNKNOWN_CODE
+            node = children[node][code]
+            # If unseen attribute value -> fallback to default class
+            if node < 0:
+                assert self.default_class is not None
+                return self.default_class
+        return self._row_label[node]
+
+    def _walk(self, codes: np.ndarray) -> np.ndarray:
+        # codes: (rows, attributes) value codes; all rows descend one level per iteration
+        assert self.compiled is not None
+        tree = self.compiled
+        out = np.full(len(codes), self.default_code, dtype=np.intp)
+        rows = np.arange(len(codes))
+        node = np.zeros(len(codes), dtype=np.intp)
+        while len(rows):
+            feature = tree.feature[node]
+            leaf = feature < 0
+            out[rows[leaf]] = tree.label[node[leaf]]
+            rows, node, feature = rows[~leaf], node[~leaf], feature[~leaf]
+            node = tree.children[node, codes[rows, feature]]
+            # rows without a matching branch keep the default class
+            alive = node >= 0
+            rows, node = rows[alive], node[alive]
+        return out
+
+    def predict_encoded(self, data: EncodedDataset) -> np.ndarray:
+        if not self.fitted or self.compiled is None:
+            raise RuntimeError("Model not fitted. Call fit() first.")
+
+        data = recode(data, self.vocabularies)
+        if self.lookup is not None:
+            return self.lookup.predict_encoded(data, self._predict_codes)
+        return self._predict_codes(data)
+
+    def _predict_codes(self, data: EncodedDataset) -> np.ndarray:
+        # data is already in the model vocabularies
+        # missing columns behave like unseen values
+        codes = np.full((len(data), len(self.attributes)), UNKNOWN_CODE, dtype=np.int8)
+        for j, attr in enumerate(self.attributes):
+            if attr in data.columns:
+                codes[:, j] = data.column(attr)
+        return self._walk(codes)
+
+    def predict_batch(self, data: Union[pd.DataFrame, EncodedDataset]) -> np.ndarray:
+        if isinstance(data, pd.DataFrame):
+            # only the tree attributes have to be encoded
+            data = data[[a for a in self.attributes if a in data.columns]]
+        codes = self.predict_encoded(as_encoded(data, self.vocabularies))
+        return np.array(self.vocabularies[self.target_col], dtype=object)[codes]
 
     def predict_all_training(self):
-        assert self.df is not None
-        return [self.predict_row(self.df.iloc[i].to_dict()) for i in range(len(self.df))]
+        assert self.data is not None
+        return self.predict_batch(self.data).tolist()
 
     def score(self):
-        assert self.df is not None
+        assert self.data is not None
+        assert self.target_col is not None
         # Compare predicted class vs. actual class
-        preds = self.predict_all_training()
-        real = self.df[self.target_col].tolist()
+        preds = self.predict_encoded(self.data)
+        real = self.data.column(self.target_col)
         # Accuracy = correct predictions / total samples
-        return sum(p == r for p, r in zip(preds, real)) / len(real)
+        return int((preds == real).sum()) / len(real)
 
-    def print_tree(self, node: Optional[TreeNode] = None, indent=""):
-        if node is None:
-            node = self.tree
+    def tree_stats(self) -> Dict[str, float]:
+        # Size of the tree and the cost of a prediction: the path length is the number of
+        # attribute tests, averaged over the training rows of the leaves (over the leaves
+        # for a tree loaded from an artifact)
+        if not self.fitted or self.compiled is None:
+            raise RuntimeError("Model not fitted. Call fit() first.")
+        tree = self.compiled
+        # preorder: a parent always comes before its children
+        depth = np.zeros(tree.n_nodes, dtype=np.intp)
+        for index in range(tree.n_nodes):
+            children = tree.children[index]
+            depth[children[children >= 0]] = depth[index] + 1
+        leaves = tree.feature < 0
+        weights = self._node_rows[leaves]
+        if weights.sum() > 0:
+            avg_path = float((depth[leaves] * weights).sum() / weights.sum())
+        else:
+            avg_path = float(depth[leaves].mean())
+        return {
+            "nodes": tree.n_nodes,
+            "leaves": int(leaves.sum()),
+            "max_depth": int(depth.max()),
+            "avg_path_length": avg_path,
+        }
 
+    def print_tree(self, node: Optional[TreeNode] = None, indent=""):
         if node is None:
-            print("Empty tree.")
+            if self.tree is None:
+                print("Empty tree.")
+                return
+            self._print_node(self.tree, indent)
+            stats = self.tree_stats()
+            print(
+                f"Nodes: {stats['nodes']}, leaves: {stats['leaves']}, max depth: {stats['max_depth']}, "
+                f"average path length: {stats['avg_path_length']:.2f}"
+            )
             return
+        self._print_node(node, indent)
 
+    def _print_node(self, node: TreeNode, indent=""):
         if node.is_leaf():
             print(indent + "->", node.label)
             return
@@ -143,7 +788,7 @@ class ID3Classifier:
         if node.branches:
             for val, child in node.branches.items():
                 print(f"{indent}[{node.attribute} = {val}]")
-                self.print_tree(child, indent + "  ")
+                self._print_node(child, indent + "  ")
 
     def run_evaluate(self, test_df):
         print("\n===============================")
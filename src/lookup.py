@@ -0,0 +1,101 @@
+# ============================================================
+# Dense prediction tables over the known attribute values
+# ============================================================
+# The input space is tiny (36 combinations for the lenses schema), so a
+# fitted model can be asked once for every combination of known values:
+#   classes[code_1, ..., code_n] = predicted class code
+# Prediction is then one index into the table. Rows with a value outside
+# the vocabularies (code -1) or a missing attribute are not in the table
+# and go through the model's normal prediction path.
+# ============================================================
+
+import math
+from dataclasses import dataclass
+from typing import Callable, Dict, List, Optional, Sequence
+
+import numpy as np
+
+from src.encoding import EncodedDataset, normalize_value
+
+# larger attribute spaces are not tabulated
+LOOKUP_MAX_CELLS = 1 << 16
+# table cell of combinations with an unseen value (code -1)
+NOT_IN_TABLE = -1
+
+
+@dataclass
+class PredictionTable:
+    attributes: List[str]
+    # classes[c_1, ..., c_n] = class code for the value codes c_j of the attributes.
+    # Every axis has one extra last slot holding NOT_IN_TABLE, so code -1 indexes it directly.
+    classes: np.ndarray
+    labels: List[str]                   # class vocabulary
+    # plain Python copies for the single-row path
+    value_codes: List[Dict[str, int]]
+    row_strides: List[int]
+    row_labels: List[str]               # labels of the known cells, row-major
+
+    @property
+    def n_cells(self) -> int:
+        return int(np.prod([n - 1 for n in self.classes.shape], dtype=np.int64))
+
+    def predict_row(self, row) -> Optional[str]:
+        # Class label, or None when the row is not covered by the table
+        index = 0
+        for attr, codes, stride in zip(self.attributes, self.value_codes, self.row_strides):
+            if attr not in row:
+                return None
+            code = codes.get(normalize_value(row[attr]))
+            if code is None:
+                return None
+            index += code * stride
+        return self.row_labels[index]
+
+    def predict_encoded(self, data: EncodedDataset, fallback: Callable[[EncodedDataset], np.ndarray]) -> np.ndarray:
+        # data must be encoded with the vocabularies the table was built from.
+        # Rows outside the table are predicted by fallback(rows).
+        if any(a not in data.columns for a in self.attributes):
+            return fallback(data)
+        if not self.attributes:
+            # constant model (e.g. a tree that is a single leaf)
+            return np.full(len(data), self.classes[()], dtype=np.intp)
+        preds = self.classes[tuple(data.column(a) for a in self.attributes)].astype(np.intp)
+        unknown = np.flatnonzero(preds == NOT_IN_TABLE)
+        if len(unknown):
+            preds[unknown] = fallback(data.take(unknown))
+        return preds
+
+
+def build_prediction_table(
+    attributes: Sequence[str],
+    vocabularies: Dict[str, List[str]],
+    target_col: str,
+    predict_codes: Callable[[EncodedDataset], np.ndarray],
+    max_cells: int = LOOKUP_MAX_CELLS,
+) -> Optional[PredictionTable]:
+    # Runs predict_codes once on every combination of known attribute values.
+    # Returns None when the attribute space has more than max_cells combinations.
+    attributes = list(attributes)
+    sizes = [len(vocabularies[a]) for a in attributes]
+    # exact integer product, int64 wraps around for wide attribute spaces
+    n_cells = math.prod(sizes)
+    if n_cells > max_cells:
+        return None
+
+    # row-major grid: row i holds the value codes of combination i
+    grid = np.indices(sizes, dtype=np.int8).reshape(len(sizes), n_cells).T
+    data = EncodedDataset(np.asfortranarray(grid), attributes, {a: vocabularies[a] for a in attributes})
+    predicted = np.asarray(predict_codes(data)).reshape(sizes)
+
+    classes = np.full([n + 1 for n in sizes], NOT_IN_TABLE, dtype=np.int8)
+    classes[tuple(slice(0, n) for n in sizes)] = predicted
+
+    labels = list(vocabularies[target_col])
+    return PredictionTable(
+        attributes=attributes,
+        classes=classes,
+        labels=labels,
+        value_codes=[{v: k for k, v in enumerate(vocabularies[a])} for a in attributes],
+        row_strides=[int(np.prod(sizes[j + 1:], dtype=np.int64)) for j in range(len(sizes))],
+        row_labels=[labels[k] for k in predicted.ravel().tolist()],
+    )
@@ -0,0 +1,181 @@
+# ============================================================
+# Timing spans and latency histograms
+# ============================================================
+# span(name, rows=...) times one pipeline stage and appends a JSON line
+# to METRICS_LOG_FILE when it ends:
+#   {"ts": ..., "span": "fit", "parent": null, "status": "ok",
+#    "seconds": 0.12, "rows": 240, "rows_per_sec": 2000.0,
+#    "rss_delta_bytes": 1048576, "model": "id3"}
+# Histogram keeps per-label latency buckets in memory and renders them
+# in the Prometheus text format (served by the web app on /metrics).
+# ============================================================
+
+import json
+import os
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
+
+from src.config import METRICS_LOG_FILE
+
+# seconds; single predictions take microseconds, batches up to seconds
+LATENCY_BUCKETS = (
+    1e-5, 2.5e-5, 5e-5, 1e-4, 2.5e-4, 5e-4, 1e-3, 2.5e-3, 5e-3,
+    1e-2, 2.5e-2, 5e-2, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0,
+)
+
+_PAGE_SIZE = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+
+
+def rss_bytes() -> Optional[int]:
+    # Resident memory of this process, None where /proc is not available (e.g. Windows)
+    try:
+        with open("/proc/self/statm", "r") as f:
+            return int(f.read().split()[1]) * _PAGE_SIZE
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+class MetricsLog:
+    # Appends one JSON object per line; the file is opened per record, so several
+    # processes (CV workers, web app workers) can share it
+    def __init__(self, path: Optional[Path]):
+        self.path = Path(path) if path else None
+        self._lock = threading.Lock()
+
+    def emit(self, record: dict):
+        if self.path is None:
+            return
+        line = json.dumps(record, default=str) + "\n"
+        with self._lock:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(line)
+
+
+log = MetricsLog(METRICS_LOG_FILE)
+# names of the open spans of every thread, the innermost is the parent of a new span
+_open_spans = threading.local()
+
+
+def configure(path: Optional[Path]):
+    # Redirects the JSON lines to another file, None turns them off
+    log.path = Path(path) if path else None
+
+
+class Span:
+    def __init__(self, name: str, rows: Optional[int], fields: dict):
+        self.name = name
+        self.rows = rows
+        self.fields = fields
+
+    def set(self, rows: Optional[int] = None, **fields):
+        # rows / fields known only at the end of the stage
+        if rows is not None:
+            self.rows = rows
+        self.fields.update(fields)
+
+
+@contextmanager
+def span(name: str, rows: Optional[int] = None, **fields) -> Iterator[Span]:
+    stack: List[str] = _open_spans.__dict__.setdefault("stack", [])
+    current = Span(name, rows, fields)
+    parent = stack[-1] if stack else None
+    stack.append(name)
+    status, error = "ok", None
+    rss_before = rss_bytes()
+    start = time.perf_counter()
+    try:
+        yield current
+    except BaseException as e:
+        status, error = "error", f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        seconds = time.perf_counter() - start
+        rss_after = rss_bytes()
+        stack.pop()
+        record = {
+            "ts": datetime.now(timezone.utc).isoformat(timespec="milliseconds"),
+            "span": name,
+            "parent": parent,
+            "status": status,
+            "seconds": round(seconds, 6),
+            "rows": current.rows,
+            "rows_per_sec": round(current.rows / seconds, 1) if current.rows and seconds > 0 else None,
+            "rss_delta_bytes": rss_after - rss_before if rss_before is not None and rss_after is not None else None,
+            **current.fields,
+        }
+        if error:
+            record["error"] = error
+        log.emit(record)
+
+
+class Histogram:
+    # Cumulative-bucket histogram with labels, thread-safe
+    def __init__(self, name: str, documentation: str, label_names: Sequence[str] = (), buckets: Sequence[float] = LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self.buckets = tuple(sorted(buckets))
+        self._lock = threading.Lock()
+        # label values -> (count per bucket plus one for +Inf, [sum of observed values])
+        self._series: Dict[Tuple[str, ...], Tuple[List[int], List[float]]] = {}
+        REGISTRY.append(self)
+
+    def observe(self, value: float, **labels):
+        key = tuple(str(labels[n]) for n in self.label_names)
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = ([0] * (len(self.buckets) + 1), [0.0])
+            series[0][index] += 1
+            series[1][0] += value
+
+    @contextmanager
+    def time(self, **labels) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series = {key: (list(counts), total[0]) for key, (counts, total) in self._series.items()}
+        for key, (counts, total) in sorted(series.items()):
+            labels = [f'{n}="{_escape(v)}"' for n, v in zip(self.label_names, key)]
+            cumulative = 0
+            for bound, count in zip(list(self.buckets) + [float("inf")], counts):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else repr(float(bound))
+                bucket_labels = ",".join(labels + [f'le="{le}"'])
+                lines.append(f"{self.name}_bucket{{{bucket_labels}}} {cumulative}")
+            suffix = f"{{{','.join(labels)}}}" if labels else ""
+            lines.append(f"{self.name}_sum{suffix} {total!r}")
+            lines.append(f"{self.name}_count{suffix} {cumulative}")
+        return lines
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+REGISTRY: List[Histogram] = []
+
+
+def render_prometheus() -> str:
+    # Text exposition format of every registered histogram
+    return "\n".join(line for histogram in REGISTRY for line in histogram.render()) + "\n"
+
+
+PREDICT_LATENCY = Histogram(
+    "lenses_predict_seconds",
+    "Prediction latency per model and method.",
+    label_names=("model", "method"),
+)
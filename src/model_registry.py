@@ -0,0 +1,143 @@
+# ============================================================
+# Hot-swappable set of trained models for the web app
+# ============================================================
+# Requests read registry.current once and use that ModelSet to the end,
+# refits build a complete new ModelSet on a background thread and swap
+# it in with a single reference assignment. A request therefore never
+# waits for training and never sees a partly trained set.
+# ============================================================
+
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any, Dict, Optional, Tuple
+
+from src.artifacts import data_fingerprint, load_or_fit_models
+from src.config import ARTIFACTS_DIR
+from src.metrics import span
+
+
+@dataclass(frozen=True)
+class ModelSet:
+    version: int
+    models: Dict[str, Any]
+    fingerprint: str
+    loaded_at: str
+
+
+class ModelRegistry:
+    def __init__(
+        self,
+        model_classes: Dict[str, type],
+        data_file: Path,
+        target_col: str = "lenses",
+        artifacts_dir: Path = ARTIFACTS_DIR,
+        fit_params: Optional[Dict[str, Dict[str, Any]]] = None,
+    ):
+        # fit_params: constructor arguments of the models trained by a refit, per model name
+        # (e.g. n_jobs=1, see webapp/app.py)
+        self.model_classes = dict(model_classes)
+        self.fit_params = dict(fit_params or {})
+        self.data_file = Path(data_file)
+        self.target_col = target_col
+        self.artifacts_dir = artifacts_dir
+        self.last_error: Optional[str] = None
+        self._current: Optional[ModelSet] = None
+        # one refit at a time, later requests join the running one
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="refit")
+        self._lock = threading.Lock()
+        self._pending: Optional[Future] = None
+        # (mtime, size) of data_file when it was last fingerprinted, skips hashing an unchanged file
+        self._file_stat: Optional[Tuple[float, int]] = None
+        self._stop = threading.Event()
+        self._watcher: Optional[threading.Thread] = None
+
+    @property
+    def current(self) -> ModelSet:
+        current = self._current
+        if current is None:
+            raise RuntimeError("No models loaded. Call load() first.")
+        return current
+
+    @property
+    def refit_running(self) -> bool:
+        pending = self._pending
+        return pending is not None and not pending.done()
+
+    def load(self) -> ModelSet:
+        # Synchronous first load (artifacts when they match the data, training otherwise),
+        # runs on the refit thread like every refit
+        return self.refit(force=False).result()
+
+    def refit(self, force: bool = False) -> Future:
+        # Schedules a refit off the caller's thread. Without force the models are rebuilt only
+        # when the data file changed. Returns the Future of the ModelSet in use after the refit.
+        with self._lock:
+            if self._pending is None or self._pending.done():
+                self._pending = self._executor.submit(self._refit, force)
+            return self._pending
+
+    def _refit(self, force: bool) -> ModelSet:
+        try:
+            stat = self.data_file.stat()
+            if not force and self._current is not None and self._file_stat == (stat.st_mtime, stat.st_size):
+                return self._current
+            fingerprint = data_fingerprint(self.data_file)
+            current = self._current
+            if not force and current is not None and current.fingerprint == fingerprint:
+                # touched but not changed
+                self._file_stat = (stat.st_mtime, stat.st_size)
+                return current
+
+            version = current.version + 1 if current is not None else 1
+            with span("refit", version=version, force=force):
+                models = load_or_fit_models(
+                    self.model_classes,
+                    data_file=self.data_file,
+                    target_col=self.target_col,
+                    artifacts_dir=self.artifacts_dir,
+                    retrain=force,
+                    fit_params=self.fit_params,
+                )
+
+            new_set = ModelSet(
+                version=version,
+                models=models,
+                fingerprint=fingerprint,
+                loaded_at=datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            )
+            # the swap: readers see either the old or the new complete set
+            self._current = new_set
+            self._file_stat = (stat.st_mtime, stat.st_size)
+            self.last_error = None
+            print(f"[OK] Models version {version} in use")
+            return new_set
+        except Exception as e:
+            # the models in use stay as they were
+            self.last_error = f"{type(e).__name__}: {e}"
+            print(f"[Error] Refit failed: {self.last_error}")
+            raise
+
+    def start_watching(self, interval_seconds: float):
+        # Checks the data file every interval_seconds and refits when it changed
+        if self._watcher is not None:
+            return
+        self._stop.clear()
+
+        def watch():
+            while not self._stop.wait(interval_seconds):
+                try:
+                    self.refit().result()
+                except Exception:
+                    pass    # already reported in last_error, try again on the next tick
+
+        self._watcher = threading.Thread(target=watch, name="refit-watcher", daemon=True)
+        self._watcher.start()
+
+    def stop_watching(self):
+        self._stop.set()
+        if self._watcher is not None:
+            self._watcher.join()
+            self._watcher = None
@@ -1,125 +1,261 @@
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple, Union
+
+import numpy as np
 import pandas as pd
 
+from src.artifacts import counts_from_state, counts_to_state, read_artifact, write_artifact
+from src.contingency import ContingencyCounts, counts_from_chunks, counts_from_db
+from src.metrics import span
+from src.encoding import UNKNOWN_CODE, EncodedDataset, as_encoded, first_seen_values, normalize_value, recode
+from src.lookup import LOOKUP_MAX_CELLS, PredictionTable, build_prediction_table
+
+
 class NaiveBayesClassifier:
-    def __init__(self):
+    def __init__(self, alpha: float = 1.0):
+        # alpha: additive (Laplace) smoothing of P(attribute = value | class), 1 = add-one
+        if alpha <= 0:
+            raise ValueError("alpha must be > 0.")
+        self.alpha = alpha
         self.target_col = None
         self.class_priors = {}
         self.cond_probs = {}
         self.default_class = None
         self.fitted = False
-        self.df = None
+        self.data: Optional[EncodedDataset] = None
+        self.vocabularies: Dict[str, List[str]] = {}
+        # sufficient statistics the probabilities are derived from
+        self.counts: Optional[ContingencyCounts] = None
+        # target codes of the classes present in training, in score column order
+        # (order of their first training row when it is known, ties go to the earlier class)
+        self.class_codes: np.ndarray = np.empty(0, dtype=np.intp)
+        # P(class) and P(attr=value | class), and their logs; each table has one row per value code
+        # (unseen values get the "__UNK__" fallback) plus the fallback as the last row (code -1)
+        self.priors: np.ndarray = np.empty(0)
+        self.prob_tables: Dict[str, np.ndarray] = {}
+        self.log_priors: np.ndarray = np.empty(0)
+        self.log_prob_tables: Dict[str, np.ndarray] = {}
+        # optional dense prediction table, see build_lookup()
+        self.lookup: Optional[PredictionTable] = None
 
-    def set_training_data(self, df: pd.DataFrame):
-        # simple normalization
-        self.df = df.astype(str).apply(lambda col: col.str.strip())
+    def set_training_data(self, data: Union[pd.DataFrame, EncodedDataset]):
+        self.data = as_encoded(data)
+        self.vocabularies = self.data.vocabularies
 
     def fit(self, target_col: str):
-        if self.df is None:
+        if self.data is None:
             raise RuntimeError("Model has no data loaded. Use set_training_data() first!")
-        
-        self.target_col = target_col
+        if (self.data.codes == UNKNOWN_CODE).any():
+            raise ValueError("Training data contains values outside the vocabulary.")
+
+        with span("fit", rows=len(self.data), model="nb"):
+            # one pass over the rows builds the whole (attribute, value, class) count tensor
+            counts = ContingencyCounts.from_encoded(self.data, target_col)
+            self.fit_counts(counts, class_order=first_seen_values(self.data, target_col))
+
+    def fit_stream(self, chunks: Iterable[Union[pd.DataFrame, EncodedDataset]], target_col: str):
+        # Fit from chunks of rows (see iter_dataset_chunks), merging their counts.
+        # Memory is bounded by the chunk size, no rows are kept.
+        with span("fit_stream", model="nb") as stage:
+            counts = counts_from_chunks(chunks, target_col)
+            self.fit_counts(counts)
+            stage.set(rows=counts.total)
+
+    def fit_db(self, db, dataset_table: str, target_col: str):
+        # Fit from counts aggregated in the database (see counts_from_db), db: DatabaseManager.
+        # Only the grouped counts are fetched, the rows never leave the server.
+        with span("fit_db", model="nb", table=dataset_table) as stage:
+            counts = counts_from_db(db, dataset_table, target_col)
+            self.fit_counts(counts)
+            stage.set(rows=counts.total)
 
-        # Default class = most common label
-        self.default_class = self.df[target_col].value_counts().idxmax()
+    def partial_fit(self, data: Union[pd.DataFrame, EncodedDataset], target_col: Optional[str] = None):
+        # Adds the counts of new rows to the kept counts and recomputes the probabilities,
+        # cost grows with the new rows only. Rows given to set_training_data() are not changed.
+        new_data = as_encoded(data)
+        if (new_data.codes == UNKNOWN_CODE).any():
+            raise ValueError("Training data contains values outside the vocabulary.")
+        if self.counts is None:
+            if target_col is None:
+                raise RuntimeError("Model Naive Bayes was not trained. Pass target_col to the first partial_fit()!")
+            self.fit_counts(
+                ContingencyCounts.from_encoded(new_data, target_col), first_seen_values(new_data, target_col)
+            )
+        else:
+            # the new rows come after the old ones: their new classes are appended to the class order
+            target_col = self.counts.target_col
+            known = self.class_order
+            order = known + [c for c in first_seen_values(new_data, target_col) if c not in known]
+            self.fit_counts(self.counts + ContingencyCounts.from_encoded(new_data, target_col), order)
 
-        classes = self.df[target_col].unique().tolist()
-        attrs = [c for c in self.df.columns if c != target_col]
+    @property
+    def class_order(self) -> List[str]:
+        # classes present in training, in score column order
+        return [self.vocabularies[self.target_col][k] for k in self.class_codes]
+
+    def fit_counts(self, counts: ContingencyCounts, class_order: Optional[Sequence[str]] = None):
+        # class_order: class labels in the order of their first training row, ties of the scores and of
+        # the default class go to the earlier class (like fit() and the row by row model it replaced).
+        # None (counts only, fit_stream/fit_db) = code order.
+        self.target_col = counts.target_col
+        self.counts = counts
+        # a refit invalidates the prediction table
+        self.lookup = None
+        self.vocabularies = {**self.vocabularies, **counts.vocabularies}
+        classes = counts.vocabularies[counts.target_col]
+
+        # Only classes present in training take part in prediction, in class_order
+        if class_order is None:
+            order = np.arange(counts.n_classes)
+        else:
+            class_index = {c: k for k, c in enumerate(classes)}
+            order = np.array([class_index[c] for c in class_order], dtype=np.intp)
+            if not set(np.flatnonzero(counts.class_counts).tolist()) <= set(order.tolist()):
+                raise ValueError("class_order does not list every trained class.")
+        self.class_codes = order[counts.class_counts[order] > 0]
+        class_counts = counts.class_counts[self.class_codes].astype(float)
+
+        # Default class = most common label (earliest in class order on ties)
+        self.default_class = classes[self.class_codes[int(np.argmax(class_counts))]]
 
         # Prior probability P(class) estimated as relative frequency in training data
-        total = len(self.df)
-        for c in classes:
-            count_c = len(self.df[self.df[target_col] == c])
-            self.class_priors[c] = count_c / total
+        self.priors = class_counts / counts.total
+        self.log_priors = np.log(self.priors)
 
         # Conditional probability P(attribute = value | class)
-        # Estimated with Laplace smoothing to avoid zero probabilities:
-        # (count + 1) / (class_count + number_of_possible_values)
-        self.cond_probs = {attr: {} for attr in attrs}
-
-        for attr in attrs:
-            # All values for given attribute
-            all_values = self.df[attr].unique().tolist()
-
-            for v in all_values:
-                if v not in self.cond_probs[attr]:
-                    self.cond_probs[attr][v] = {}
-
-                for c in classes:
-                    subset_c = self.df[self.df[target_col] == c]
-                    count_v_c = len(subset_c[subset_c[attr] == v])
-
-                    # Laplace smoothing:
-                    # (count_v_c + 1) / (|class_c| + |values_of_attr|)
-                    prob = (count_v_c + 1) / (len(subset_c) + len(all_values))
-                    self.cond_probs[attr][v][c] = prob
-
-            # If a new (unseen) attribute value appears during prediction,
-            # assign it a small fallback probability to avoid zero-probability errors.
-            # This fallback is stored under a special key "__UNK__".
-            unk = {}
-            for c in classes:
-                subset_c = self.df[self.df[target_col] == c]
-                unk[c] = 1 / (len(subset_c) + len(all_values))
-            self.cond_probs[attr]["__UNK__"] = unk
+        # Estimated with additive smoothing to avoid zero probabilities:
+        # (count + alpha) / (class_count + alpha * number_of_possible_values)
+        # If a new (unseen) attribute value appears during prediction,
+        # it gets the fallback alpha / (class_count + alpha * number_of_possible_values).
+        self.prob_tables = {}
+        self.log_prob_tables = {}
+        for attr in counts.attributes:
+            attr_counts = counts.attr_counts[attr][:, self.class_codes]
+            seen = attr_counts.sum(axis=1) > 0
+            denominator = class_counts + self.alpha * seen.sum()
+            unk = self.alpha / denominator
+            table = (attr_counts + self.alpha) / denominator
+            table[~seen] = unk
+            self.prob_tables[attr] = np.vstack([table, unk])
+            self.log_prob_tables[attr] = np.log(self.prob_tables[attr])
+
+        # Readable probabilities, "__UNK__" holds the fallback for unseen values
+        labels = [classes[k] for k in self.class_codes]
+        self.class_priors = {c: float(p) for c, p in zip(labels, self.priors)}
+        self.cond_probs = {}
+        for attr, probs in self.prob_tables.items():
+            values = counts.vocabularies[attr]
+            seen = counts.attr_counts[attr].sum(axis=1) > 0
+            self.cond_probs[attr] = {values[v]: dict(zip(labels, probs[v].tolist())) for v in np.flatnonzero(seen)}
+            self.cond_probs[attr]["__UNK__"] = dict(zip(labels, probs[-1].tolist()))
 
         self.fitted = True
+        # built with every fit (and load), evaluate_on_test() only reads it
+        self.build_lookup()
+
+    def save(self, path, fingerprint: Optional[str] = None):
+        # Only the counts are stored, the probabilities are derived from them on load
+        if not self.fitted or self.counts is None:
+            raise RuntimeError("Model Naive Bayes was not trained. Use fit() first!")
+        state = {"counts": counts_to_state(self.counts), "alpha": self.alpha, "class_order": self.class_order}
+        write_artifact(path, "nb", state, fingerprint)
+
+    @classmethod
+    def load(cls, path, fingerprint: Optional[str] = None) -> "NaiveBayesClassifier":
+        # fingerprint: when given, artifacts trained on other data raise ValueError
+        state, _ = read_artifact(path, "nb", fingerprint)
+        model = cls(alpha=state.get("alpha", 1.0))
+        model.fit_counts(counts_from_state(state["counts"]), class_order=state.get("class_order"))
+        return model
+
+    def build_lookup(self, max_cells: int = LOOKUP_MAX_CELLS) -> bool:
+        # Precomputes the most probable class of every combination of known attribute values.
+        # Returns False when the attribute space is larger than max_cells (no table).
+        if not self.fitted or self.counts is None:
+            raise RuntimeError("Model Naive Bayes was not trained. Use fit() first!")
+        if self.lookup is not None:
+            return True
+        self.lookup = build_prediction_table(
+            self.counts.attributes, self.vocabularies, self.target_col, self._predict_codes, max_cells
+        )
+        return self.lookup is not None
 
     def _predict_single_rowdict(self, row: dict) -> str:
         # Compute P(class) * Π P(attr=value | class)
         if not self.fitted:
             raise RuntimeError("Model Naive Bayes was not trained. Use fit() first!")
 
-        best_class = None
-        best_score = None
-
-        for c in self.class_priors:
-            score = self.class_priors[c]
-
-            for attr, val in row.items():
-                if attr == self.target_col:
-                    continue
-                # Use conditional probability if known, otherwise fallback
-                if val in self.cond_probs[attr]:
-                    prob_val = self.cond_probs[attr][val][c]
-                else:
-                    prob_val = self.cond_probs[attr]["__UNK__"][c]
-                # Multiply probabilities
-                score *= prob_val
-            # Keep the class with the highest probability score
-            if best_score is None or score > best_score:
-                best_score = score
-                best_class = c
-
-        return str(best_class or self.default_class)
+        columns = []
+        for attr, val in row.items():
+            if attr == self.target_col:
+                continue
+            vocabulary = self.vocabularies[attr]
+            # Use conditional probability if known, otherwise fallback (last row)
+            code = vocabulary.index(val) if val in vocabulary else UNKNOWN_CODE
+            columns.append((attr, np.array([code])))
+        return self.vocabularies[self.target_col][self._best_classes(columns, 1)[0]]
+
+    def _best_classes(self, columns: List[Tuple[str, np.ndarray]], n_rows: int) -> np.ndarray:
+        # columns: (attribute, value code of every row), multiplied in this order.
+        # The scores are the products of the row by row model (same rounding, the class with the highest
+        # score and the first one in class order on ties). Rows whose products underflow are compared
+        # with summed log-probabilities instead, long attribute lists keep their best class.
+        scores = np.tile(self.priors, (n_rows, 1))
+        for attr, codes in columns:
+            scores *= self.prob_tables[attr][codes]
+        best = np.argmax(scores, axis=1)
+
+        underflow = np.flatnonzero(scores[np.arange(n_rows), best] < np.finfo(float).tiny)
+        if len(underflow):
+            log_scores = np.tile(self.log_priors, (len(underflow), 1))
+            for attr, codes in columns:
+                log_scores += self.log_prob_tables[attr][codes[underflow]]
+            best[underflow] = np.argmax(log_scores, axis=1)
+        return self.class_codes[best]
 
     def predict_row(self, row):
         if not self.fitted:
             raise RuntimeError("Model Naive Bayes was not trained. Use fit() first!")
+        if self.lookup is not None:
+            label = self.lookup.predict_row(row)
+            if label is not None:
+                return label
         # Normalize input row to match training data formatting
-        rowdict = {k: str(v).strip() for k, v in row.items()}
+        rowdict = {k: normalize_value(v) for k, v in row.items()}
         return self._predict_single_rowdict(rowdict)
 
+    def predict_encoded(self, data: EncodedDataset) -> np.ndarray:
+        if not self.fitted:
+            raise RuntimeError("Model Naive Bayes was not trained. Use fit() first!")
+
+        data = recode(data, self.vocabularies)
+        if self.lookup is not None:
+            return self.lookup.predict_encoded(data, self._predict_codes)
+        return self._predict_codes(data)
+
+    def _predict_codes(self, data: EncodedDataset) -> np.ndarray:
+        # data is already in the model vocabularies
+        columns = [(attr, data.codes[:, j]) for j, attr in enumerate(data.columns) if attr != self.target_col]
+        return self._best_classes(columns, len(data))
+
+    def predict_batch(self, data: Union[pd.DataFrame, EncodedDataset]) -> np.ndarray:
+        codes = self.predict_encoded(as_encoded(data, self.vocabularies))
+        return np.array(self.vocabularies[self.target_col], dtype=object)[codes]
 
     def score(self):
-        if self.df is None:
+        if self.data is None:
             raise RuntimeError("Model has no data loaded. Use set_training_data() first!")
         if not self.fitted:
             raise RuntimeError("Model Naive Bayes was not trained. Use fit() first!")
         if self.target_col is None:
             raise ValueError("No target column found. Use fit() first!")
         
-        correct = 0
-        total = len(self.df)
-
-        for i in range(total):
-            row = {k: str(self.df.iloc[i][k]).strip() for k in self.df.columns if k != self.target_col}
-            pred = self._predict_single_rowdict(row)
-            real = str(self.df.iloc[i][self.target_col]).strip()
-            if pred == real:
-                correct += 1
-
+        total = len(self.data)
         if total == 0:
             return 0.0
+
+        preds = self.predict_encoded(self.data)
+        real = self.data.column(self.target_col)
+        correct = int((preds == real).sum())
         return correct / total
 
     def run_evaluate(self, test_df):
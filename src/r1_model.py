@@ -1,5 +1,22 @@
+from typing import Dict, Iterable, List, Optional, Union
+
+import numpy as np
 import pandas as pd
 
+from src.artifacts import counts_from_state, counts_to_state, read_artifact, write_artifact
+from src.contingency import ContingencyCounts, counts_from_chunks, counts_from_db
+from src.metrics import span
+from src.encoding import (
+    UNKNOWN_CODE,
+    EncodedDataset,
+    as_encoded,
+    encode_column,
+    first_seen_values,
+    majority_code_from_counts,
+    normalize_value,
+    recode,
+)
+
 class OneRClassifier:
     def __init__(self):
         self.best_attribute = None
@@ -7,55 +24,117 @@ class OneRClassifier:
         self.default_class = None
         self.target_col = None
         self.fitted = False
-        self.df = None
-
-    def set_training_data(self, df: pd.DataFrame):
-        self.df = df.copy()
-
-    @staticmethod
-    def _normalize_df(df: pd.DataFrame, target_col: str) -> pd.DataFrame:
-        # norm everything as string
-        df = df.copy()
-        for c in df.columns:
-            if df[c].dtype == bool:
-                df[c] = df[c].map({True: "yes", False: "no"})
-        for c in df.columns:
-            df[c] = df[c].astype(str).str.strip()
-        if target_col not in df.columns:
-            raise ValueError(f"Brak kolumny docelowej '{target_col}' w danych.")
-        return df
+        self.data: Optional[EncodedDataset] = None
+        self.vocabularies: Dict[str, List[str]] = {}
+        # rule_codes[value_code] = class code (default class for values unseen in training)
+        self.rule_codes: Optional[np.ndarray] = None
+        # sufficient statistics the rules are built from
+        self.counts: Optional[ContingencyCounts] = None
+        # trained classes in the order of their first row (code order when fitted from counts only),
+        # ties of the default class go to the earlier class
+        self.class_order: List[str] = []
 
-    def _build_rules_for_attribute(self, attr, target_col):
-        if self.df is None:
-            raise RuntimeError("Model has no data loaded. Use set_training_data() first!")
-        counts = (
-            self.df.groupby([attr, target_col])
-              .size()
-              .reset_index(name='count')
-        )
-        rules = {}
-        for value in counts[attr].unique():
-            subset = counts[counts[attr] == value]
-            majority_row = subset.loc[subset['count'].idxmax()]
-            rules[value] = majority_row[target_col]
-
-        predictions = self.df[attr].map(rules)
-        accuracy = (predictions == self.df[target_col]).mean()
+    def set_training_data(self, data: Union[pd.DataFrame, EncodedDataset]):
+        self.data = as_encoded(data)
+        self.vocabularies = self.data.vocabularies
+
+    def _build_rules_for_attribute(self, counts: ContingencyCounts, attr):
+        # (value, class) contingency table of attr
+        table = counts.attr_counts[attr]
+        values = counts.vocabularies[attr]
+        classes = counts.vocabularies[counts.target_col]
+        seen = table.sum(axis=1) > 0
+        # argmax keeps the first class in (sorted) code order on ties
+        majority = table.argmax(axis=1)
+        rules = {values[v]: classes[majority[v]] for v in np.flatnonzero(seen)}
+
+        # every row whose class is the majority of its value is predicted correctly
+        correct = int(table.max(axis=1).sum())
+        accuracy = correct / counts.total
         return rules, accuracy
 
     def fit(self, target_col):
-        if self.df is None:
+        if self.data is None:
             raise RuntimeError("Model has no data loaded. Use set_training_data() first!")
-        self.df = self._normalize_df(self.df, target_col)
+        if target_col not in self.data.columns:
+            raise ValueError(f"Brak kolumny docelowej '{target_col}' w danych.")
+        if (self.data.codes == UNKNOWN_CODE).any():
+            raise ValueError("Training data contains values outside the vocabulary.")
+
+        with span("fit", rows=len(self.data), model="1r"):
+            counts = ContingencyCounts.from_encoded(self.data, target_col)
+            # with the rows at hand, ties of the default class go to the first seen class
+            self._fit_in_order(counts, first_seen_values(self.data, target_col))
+
+    def fit_counts(self, counts: ContingencyCounts, default_code: Optional[int] = None):
+        # Fit from sufficient statistics only (no rows needed). default_code: class code of
+        # the default class, the most frequent class (first in code order on ties) when None
+        if default_code is None:
+            default_code = int(np.argmax(counts.class_counts))
+        self._fit_from_counts(counts, default_code)
+        classes = counts.vocabularies[counts.target_col]
+        self.class_order = [classes[k] for k in np.flatnonzero(counts.class_counts)]
+
+    def _fit_in_order(self, counts: ContingencyCounts, class_order: List[str]):
+        # class_order: trained classes in the order of their first row
+        classes = counts.vocabularies[counts.target_col]
+        first_seen = np.full(counts.n_classes, len(class_order), dtype=np.intp)
+        for position, label in enumerate(class_order):
+            first_seen[classes.index(label)] = position
+        self._fit_from_counts(counts, majority_code_from_counts(counts.class_counts, first_seen))
+        self.class_order = list(class_order)
+
+    def fit_stream(self, chunks: Iterable[Union[pd.DataFrame, EncodedDataset]], target_col: str):
+        # Fit from chunks of rows (see iter_dataset_chunks), merging their counts.
+        # Memory is bounded by the chunk size, no rows are kept. The default class is
+        # the most frequent one (first in code order on ties).
+        with span("fit_stream", model="1r") as stage:
+            counts = counts_from_chunks(chunks, target_col)
+            self.fit_counts(counts)
+            stage.set(rows=counts.total)
+
+    def fit_db(self, db, dataset_table: str, target_col: str):
+        # Fit from counts aggregated in the database (see counts_from_db), db: DatabaseManager.
+        # Only the grouped counts are fetched, the rows never leave the server.
+        # Ties of the default class as in fit_stream().
+        with span("fit_db", model="1r", table=dataset_table) as stage:
+            counts = counts_from_db(db, dataset_table, target_col)
+            self.fit_counts(counts)
+            stage.set(rows=counts.total)
+
+    def partial_fit(self, data: Union[pd.DataFrame, EncodedDataset], target_col: Optional[str] = None):
+        # Adds the counts of new rows to the kept counts and rebuilds the rules,
+        # cost grows with the new rows only. Rows given to set_training_data() are not changed.
+        new_data = as_encoded(data)
+        if (new_data.codes == UNKNOWN_CODE).any():
+            raise ValueError("Training data contains values outside the vocabulary.")
+        if self.counts is None:
+            if target_col is None:
+                raise RuntimeError("Model was not trained. Pass target_col to the first partial_fit().")
+            self._fit_in_order(
+                ContingencyCounts.from_encoded(new_data, target_col), first_seen_values(new_data, target_col)
+            )
+        else:
+            # the new rows come after the old ones, their new classes go to the end of the class order
+            target_col = self.counts.target_col
+            new_classes = [c for c in first_seen_values(new_data, target_col) if c not in self.class_order]
+            self._fit_in_order(
+                self.counts + ContingencyCounts.from_encoded(new_data, target_col), self.class_order + new_classes
+            )
+
+    def _fit_from_counts(self, counts: ContingencyCounts, default_code: int):
+        target_col = counts.target_col
         self.target_col = target_col
+        self.counts = counts
+        self.vocabularies = {**self.vocabularies, **counts.vocabularies}
 
-        candidate_attributes = [c for c in self.df.columns if c != target_col]
+        candidate_attributes = counts.attributes
         best_attr_local = None
         best_rules_local = None
         best_acc_local = -1.0
 
         for attr in candidate_attributes:
-            rules_attr, acc_attr = self._build_rules_for_attribute(attr, target_col)
+            rules_attr, acc_attr = self._build_rules_for_attribute(counts, attr)
             if acc_attr > best_acc_local:
                 best_acc_local = acc_attr
                 best_attr_local = attr
@@ -63,38 +142,86 @@ class OneRClassifier:
 
         self.best_attribute = best_attr_local
         self.rules = best_rules_local
-        self.default_class = self.df[target_col].value_counts().idxmax()
+        classes = counts.vocabularies[target_col]
+        self.default_class = classes[default_code]
+
+        values = counts.vocabularies[self.best_attribute]
+        class_index = {c: k for k, c in enumerate(classes)}
+        self.rule_codes = np.array(
+            [class_index[self.rules[v]] if v in self.rules else default_code for v in values] + [default_code],
+            dtype=np.intp,
+        )
         self.fitted = True
 
+    def save(self, path, fingerprint: Optional[str] = None):
+        # Counts + default class are enough to rebuild the rules, no rows are stored
+        if not self.fitted or self.counts is None or self.rule_codes is None:
+            raise RuntimeError("Model was not trained. Use fit() first.")
+        state = {
+            "counts": counts_to_state(self.counts),
+            "default_code": int(self.rule_codes[-1]),
+            "class_order": self.class_order,
+        }
+        write_artifact(path, "1r", state, fingerprint)
+
+    @classmethod
+    def load(cls, path, fingerprint: Optional[str] = None) -> "OneRClassifier":
+        # fingerprint: when given, artifacts trained on other data raise ValueError
+        state, _ = read_artifact(path, "1r", fingerprint)
+        model = cls()
+        counts = counts_from_state(state["counts"])
+        model._fit_from_counts(counts, int(state["default_code"]))
+        classes = counts.vocabularies[counts.target_col]
+        model.class_order = state.get("class_order") or [classes[k] for k in np.flatnonzero(counts.class_counts)]
+        return model
+
+    def build_lookup(self, max_cells: Optional[int] = None) -> bool:
+        # rule_codes already is the dense prediction table of 1R (one class code per value
+        # of the selected attribute, plus the default class for code -1), nothing to build.
+        # Kept so every model can be asked for its lookup table the same way.
+        if not self.fitted or self.rule_codes is None:
+            raise RuntimeError("Model was not trained. Use fit() first.")
+        return True
+
     def predict_row(self, row):
         if not self.fitted:
             raise RuntimeError("Model was not trained. Use fit() first.")
-        attr_value = str(row[self.best_attribute]).strip()
+        attr_value = normalize_value(row[self.best_attribute])
         if self.rules:
             return self.rules.get(attr_value, self.default_class)
         else:
             print("[Error] This should not happen!!!")
 
+    def predict_encoded(self, data: EncodedDataset) -> np.ndarray:
+        # Class codes for already encoded rows; -1 picks the last entry (default class)
+        if not self.fitted or self.rule_codes is None:
+            raise RuntimeError("Model was not trained. Use fit() first.")
+        data = recode(data, self.vocabularies)
+        return self.rule_codes[data.column(self.best_attribute)]
+
+    def predict_batch(self, data: Union[pd.DataFrame, EncodedDataset]) -> np.ndarray:
+        if not self.fitted or self.rule_codes is None:
+            raise RuntimeError("Model was not trained. Use fit() first.")
+        if isinstance(data, EncodedDataset):
+            codes = self.predict_encoded(data)
+        else:
+            # only the selected attribute has to be encoded
+            values = encode_column(data[self.best_attribute], self.vocabularies[self.best_attribute])
+            codes = self.rule_codes[values]
+        return np.array(self.vocabularies[self.target_col], dtype=object)[codes]
+
     def predict(self):
-        if self.df is None:
+        if self.data is None:
             raise RuntimeError("Model has no data loaded. Use set_training_data() first!")
-        df = self.df.copy()
-        for c in df.columns:
-            df[c] = df[c].astype(str).str.strip()
-        return [self.predict_row(df.iloc[i]) for i in range(len(df))]
+        return self.predict_batch(self.data).tolist()
 
     def score(self):
-        if self.df is None:
+        if self.data is None:
             raise RuntimeError("Model has no data loaded. Use set_training_data() first!")
-        df = self.df.copy()
-        for c in df.columns:
-            df[c] = df[c].astype(str).str.strip()
-        preds = self.predict()
-        real = df[self.target_col].tolist()
-        total = len(real)
+        total = len(self.data)
         if total == 0:
             return 0.0
-        correct = sum(1 for p, r in zip(preds, real) if p == r)
+        correct = int((self.predict_encoded(self.data) == self.data.column(self.target_col)).sum())
         return correct / total
 
     def pretty_print_rules(self):
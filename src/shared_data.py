@@ -0,0 +1,112 @@
+# ============================================================
+# Sharing encoded datasets with worker processes
+# ============================================================
+# numpy arrays are copied once into a single shared memory block.
+# Workers receive only a small picklable handle and attach to the
+# block, so the data is never pickled to each process.
+# ============================================================
+
+import multiprocessing
+import os
+from dataclasses import dataclass, field
+from multiprocessing import shared_memory
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from src.encoding import EncodedDataset
+
+CODES_KEY = "codes"
+
+
+@dataclass(frozen=True)
+class ArraySpec:
+    offset: int
+    shape: Tuple[int, ...]
+    dtype: str
+    order: str
+
+
+@dataclass(frozen=True)
+class SharedHandle:
+    name: str
+    arrays: Dict[str, ArraySpec]
+    # EncodedDataset metadata, empty when only plain arrays are shared
+    columns: List[str] = field(default_factory=list)
+    vocabularies: Dict[str, List[str]] = field(default_factory=dict)
+
+
+class SharedArrays:
+    # Owner side: creates the block, copies the arrays in and unlinks it on close()
+    def __init__(self, arrays: Dict[str, np.ndarray], data: Optional[EncodedDataset] = None):
+        specs = {}
+        offset = 0
+        for key, array in arrays.items():
+            order = "F" if array.flags.f_contiguous and not array.flags.c_contiguous else "C"
+            specs[key] = ArraySpec(offset, tuple(array.shape), array.dtype.str, order)
+            # keep every array 8-byte aligned
+            offset += (array.nbytes + 7) // 8 * 8
+
+        self.shm = shared_memory.SharedMemory(create=True, size=max(offset, 1))
+        for key, array in arrays.items():
+            _view(self.shm, specs[key])[...] = array
+
+        self.handle = SharedHandle(
+            name=self.shm.name,
+            arrays=specs,
+            columns=list(data.columns) if data is not None else [],
+            vocabularies=dict(data.vocabularies) if data is not None else {},
+        )
+
+    @classmethod
+    def from_dataset(cls, data: EncodedDataset, **extra: np.ndarray) -> "SharedArrays":
+        return cls({CODES_KEY: data.codes, **extra}, data)
+
+    def close(self):
+        self.shm.close()
+        self.shm.unlink()
+
+    def __enter__(self) -> "SharedArrays":
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def _view(shm: shared_memory.SharedMemory, spec: ArraySpec) -> np.ndarray:
+    return np.ndarray(spec.shape, dtype=np.dtype(spec.dtype), buffer=shm.buf, offset=spec.offset, order=spec.order)
+
+
+# worker side: blocks stay attached for the lifetime of the process
+_attached: Dict[str, shared_memory.SharedMemory] = {}
+
+
+def attach_arrays(handle: SharedHandle) -> Dict[str, np.ndarray]:
+    shm = _attached.get(handle.name)
+    if shm is None:
+        # track=False: the owner process is responsible for unlinking the block
+        shm = shared_memory.SharedMemory(name=handle.name, track=False)
+        _attached[handle.name] = shm
+    return {key: _view(shm, spec) for key, spec in handle.arrays.items()}
+
+
+def attach_dataset(handle: SharedHandle) -> Tuple[EncodedDataset, Dict[str, np.ndarray]]:
+    # Zero-copy EncodedDataset over the shared codes, plus the extra arrays
+    arrays = attach_arrays(handle)
+    codes = arrays.pop(CODES_KEY)
+    return EncodedDataset(codes, list(handle.columns), dict(handle.vocabularies)), arrays
+
+
+def pool_workers(n_jobs: Optional[int]) -> int:
+    # Worker processes a process pool may use (n_jobs: None = one per CPU), 1 inside a worker
+    # process (pools are not nested). Multi-threaded processes (the web app) pass n_jobs=1
+    # themselves: forking them can deadlock the child on locks held by the other threads.
+    if multiprocessing.parent_process() is not None:
+        return 1
+    return n_jobs or os.cpu_count() or 1
+
+
+def row_index_dtype(n_rows: int) -> np.dtype:
+    # Smallest integer type indexing n_rows rows, row index arrays sent to workers are
+    # pickled with every job (int32: 4 bytes per row instead of 8)
+    return np.dtype(np.int32) if n_rows <= np.iinfo(np.int32).max else np.dtype(np.int64)
@@ -0,0 +1,156 @@
+# ============================================================
+# Row by row reference models
+# ============================================================
+# The pandas implementations the array based models replaced, kept
+# as small as possible: every fit filters DataFrames and every
+# prediction walks one row. The tests check that the models in src/
+# give the same rules, trees, predictions and CV scores.
+# ============================================================
+
+import math
+
+import numpy as np
+import pandas as pd
+from sklearn.model_selection import StratifiedKFold
+
+
+def normalize(df: pd.DataFrame) -> pd.DataFrame:
+    return df.astype(str).apply(lambda col: col.str.strip())
+
+
+class RefOneR:
+    def fit(self, df: pd.DataFrame, target_col: str):
+        self.df = normalize(df)
+        self.target_col = target_col
+        best_acc = -1.0
+        for attr in [c for c in self.df.columns if c != target_col]:
+            counts = self.df.groupby([attr, target_col]).size().reset_index(name="count")
+            rules = {}
+            for value in counts[attr].unique():
+                subset = counts[counts[attr] == value]
+                rules[value] = subset.loc[subset["count"].idxmax()][target_col]
+            acc = (self.df[attr].map(rules) == self.df[target_col]).mean()
+            if acc > best_acc:
+                best_acc, self.best_attribute, self.rules = acc, attr, rules
+        self.default_class = self.df[target_col].value_counts().idxmax()
+        return self
+
+    def predict_row(self, row) -> str:
+        return self.rules.get(str(row[self.best_attribute]).strip(), self.default_class)
+
+
+class RefID3:
+    # a tree is a class label (leaf) or (attribute, {value: subtree}) in branch order
+    def fit(self, df: pd.DataFrame, target_col: str):
+        self.df = normalize(df)
+        self.target_col = target_col
+        self.default_class = self._majority(self.df)
+        self.tree = self._build(self.df, [c for c in self.df.columns if c != target_col])
+        return self
+
+    def _entropy(self, col: pd.Series) -> float:
+        total = len(col)
+        return -sum((n / total) * math.log2(n / total) for n in col.value_counts() if n > 0)
+
+    def _gain(self, df: pd.DataFrame, attr: str) -> float:
+        after = 0.0
+        for v in df[attr].unique():
+            subset = df[df[attr] == v]
+            after += len(subset) / len(df) * self._entropy(subset[self.target_col])
+        return self._entropy(df[self.target_col]) - after
+
+    def _majority(self, df: pd.DataFrame) -> str:
+        return str(df[self.target_col].value_counts().index[0])
+
+    def _build(self, df: pd.DataFrame, attrs):
+        classes = df[self.target_col].unique()
+        if len(classes) == 1:
+            return str(classes[0])
+        if not attrs:
+            return self._majority(df)
+        gains = {a: self._gain(df, a) for a in attrs}
+        best = max(gains, key=lambda a: gains[a])
+        remaining = [a for a in attrs if a != best]
+        return best, {v: self._build(df[df[best] == v], remaining) for v in df[best].unique()}
+
+    def predict_row(self, row) -> str:
+        row = {k: str(v).strip() for k, v in row.items()}
+        node = self.tree
+        while not isinstance(node, str):
+            attr, branches = node
+            if row.get(attr) not in branches:
+                return self.default_class
+            node = branches[row[attr]]
+        return node
+
+
+class RefNaiveBayes:
+    def fit(self, df: pd.DataFrame, target_col: str):
+        self.df = normalize(df)
+        self.target_col = target_col
+        classes = self.df[target_col].unique().tolist()
+        total = len(self.df)
+        self.priors = {c: len(self.df[self.df[target_col] == c]) / total for c in classes}
+        self.cond = {}
+        for attr in [c for c in self.df.columns if c != target_col]:
+            values = self.df[attr].unique().tolist()
+            table = {}
+            for v in values:
+                table[v] = {}
+                for c in classes:
+                    subset = self.df[self.df[target_col] == c]
+                    table[v][c] = (len(subset[subset[attr] == v]) + 1) / (len(subset) + len(values))
+            table["__UNK__"] = {
+                c: 1 / (len(self.df[self.df[target_col] == c]) + len(values)) for c in classes
+            }
+            self.cond[attr] = table
+        self.default_class = self.df[target_col].value_counts().idxmax()
+        return self
+
+    def predict_row(self, row) -> str:
+        row = {k: str(v).strip() for k, v in row.items()}
+        best_class, best_score = None, None
+        for c in self.priors:
+            score = self.priors[c]
+            for attr, val in row.items():
+                if attr == self.target_col:
+                    continue
+                score *= self.cond[attr].get(val, self.cond[attr]["__UNK__"])[c]
+            if best_score is None or score > best_score:
+                best_class, best_score = c, score
+        return str(best_class or self.default_class)
+
+
+def ref_accuracy(model, test_df: pd.DataFrame, target_col: str) -> float:
+    test_df = normalize(test_df)
+    preds = [model.predict_row(test_df.iloc[i]) for i in range(len(test_df))]
+    return sum(p == r for p, r in zip(preds, test_df[target_col])) / len(test_df)
+
+
+def ref_kfold_scores(ref_cls, df: pd.DataFrame, target_col: str, k: int = 5, random_state=None):
+    skf = StratifiedKFold(n_splits=k, shuffle=True, random_state=random_state)
+    y = df[target_col].astype(str).values
+    X = df.reset_index(drop=True)
+    return [
+        ref_accuracy(ref_cls().fit(X.iloc[train], target_col), X.iloc[test], target_col)
+        for train, test in skf.split(X, y)
+    ]
+
+
+def random_dataset(seed: int, n_rows=None, n_attrs=None) -> pd.DataFrame:
+    # Small categorical dataset with many ties: 2-4 attributes of 2-3 values, 2-3 classes
+    rng = np.random.default_rng(seed)
+    n_rows = n_rows or int(rng.integers(6, 60))
+    n_attrs = n_attrs or int(rng.integers(2, 5))
+    df = pd.DataFrame({
+        f"a{j}": rng.choice(["x", "y", "z"][:int(rng.integers(2, 4))], n_rows) for j in range(n_attrs)
+    })
+    df["label"] = rng.choice(["p", "q", "r"][:int(rng.integers(2, 4))], n_rows)
+    return df
+
+
+def value_grid(df: pd.DataFrame, target_col: str) -> pd.DataFrame:
+    # every combination of the attribute values of df plus one unseen value per attribute
+    attrs = [c for c in df.columns if c != target_col]
+    values = [sorted(df[a].astype(str).unique().tolist()) + ["unseen"] for a in attrs]
+    return pd.DataFrame(pd.MultiIndex.from_product(values).tolist(), columns=attrs)
@@ -0,0 +1,120 @@
+import contextlib
+import io
+import tempfile
+import unittest
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from src.artifacts import data_fingerprint, load_or_fit_models
+from src.bagging import BaggedID3Classifier
+from src.dataset_cache import cache_paths, load_encoded_dataset, read_dataset_cache
+from src.encoding import encode_dataset
+from src.id3_model import ID3Classifier
+from src.naive_bayes_model import NaiveBayesClassifier
+from src.r1_model import OneRClassifier
+from tests.reference import random_dataset, value_grid
+
+TARGET = "label"
+MODEL_CLASSES = {"1r": OneRClassifier, "id3": ID3Classifier, "nb": NaiveBayesClassifier, "bagged": BaggedID3Classifier}
+
+
+def quiet(call, *args, **kwargs):
+    with contextlib.redirect_stdout(io.StringIO()) as out:
+        result = call(*args, **kwargs)
+    return result, out.getvalue()
+
+
+class ArtifactRoundTrip(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.dir = Path(self.tmp.name)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_saved_models_predict_the_same(self):
+        for seed in range(10):
+            df = random_dataset(seed)
+            grid = value_grid(df, TARGET)
+            for name, model_cls in MODEL_CLASSES.items():
+                with self.subTest(model=name, seed=seed):
+                    model = model_cls()
+                    model.set_training_data(df)
+                    model.fit(TARGET)
+                    path = self.dir / f"{name}.json"
+                    model.save(path, fingerprint="abc")
+                    loaded = model_cls.load(path, fingerprint="abc")
+                    self.assertEqual(loaded.predict_batch(grid).tolist(), model.predict_batch(grid).tolist())
+                    rows = grid.to_dict("records")
+                    self.assertEqual([loaded.predict_row(r) for r in rows], [model.predict_row(r) for r in rows])
+                    self.assertEqual(getattr(loaded, "default_class", None), getattr(model, "default_class", None))
+
+    def test_loaded_models_keep_their_tie_order(self):
+        # partial_fit of a loaded model equals partial_fit of the fitted one
+        for seed in range(10):
+            df = random_dataset(seed)
+            half = len(df) // 2
+            grid = value_grid(df, TARGET)
+            for name, model_cls in (("1r", OneRClassifier), ("nb", NaiveBayesClassifier)):
+                model = model_cls()
+                model.set_training_data(df.iloc[:half])
+                model.fit(TARGET)
+                model.save(self.dir / f"{name}.json")
+                loaded = model_cls.load(self.dir / f"{name}.json")
+                model.partial_fit(df.iloc[half:])
+                loaded.partial_fit(df.iloc[half:])
+                self.assertEqual(loaded.predict_batch(grid).tolist(), model.predict_batch(grid).tolist())
+
+    def test_fingerprint_mismatch_is_rejected(self):
+        model = ID3Classifier()
+        model.set_training_data(random_dataset(0))
+        model.fit(TARGET)
+        model.save(self.dir / "id3.json", fingerprint="abc")
+        with self.assertRaises(ValueError):
+            ID3Classifier.load(self.dir / "id3.json", fingerprint="other")
+
+    def test_load_or_fit_models_retrains_only_after_data_changes(self):
+        df = random_dataset(4, n_rows=80)
+        data_file = self.dir / "dataset.tab"
+        df.to_csv(data_file, sep="\t", index=False)
+        grid = value_grid(df, TARGET)
+
+        first, out = quiet(load_or_fit_models, MODEL_CLASSES, data_file=data_file, target_col=TARGET,
+                           artifacts_dir=self.dir)
+        self.assertEqual(out.count("trained and saved"), len(MODEL_CLASSES))
+        second, out = quiet(load_or_fit_models, MODEL_CLASSES, data_file=data_file, target_col=TARGET,
+                            artifacts_dir=self.dir)
+        self.assertEqual(out.count("loaded from"), len(MODEL_CLASSES))
+        for name in MODEL_CLASSES:
+            self.assertEqual(second[name].predict_batch(grid).tolist(), first[name].predict_batch(grid).tolist())
+
+        df.iloc[:5].to_csv(data_file, sep="\t", index=False, mode="a", header=False)
+        _, out = quiet(load_or_fit_models, MODEL_CLASSES, data_file=data_file, target_col=TARGET,
+                       artifacts_dir=self.dir)
+        self.assertEqual(out.count("trained and saved"), len(MODEL_CLASSES))
+
+    def test_dataset_cache_round_trip(self):
+        df = random_dataset(5, n_rows=50)
+        data_file = self.dir / "dataset.tab"
+        df.to_csv(data_file, sep="\t", index=False)
+        expected = encode_dataset(pd.read_csv(data_file, sep="\t"))
+
+        (built, _), (cached, _) = quiet(load_encoded_dataset, data_file), quiet(load_encoded_dataset, data_file)
+        for data in (built, cached):
+            np.testing.assert_array_equal(data.codes, expected.codes)
+            self.assertEqual((data.columns, data.vocabularies), (expected.columns, expected.vocabularies))
+        self.assertTrue(all(p.exists() for p in cache_paths(data_file)))
+
+        # a changed file is not read from the old cache
+        fingerprint = data_fingerprint(data_file)
+        df.iloc[:3].to_csv(data_file, sep="\t", index=False, mode="a", header=False)
+        self.assertNotEqual(data_fingerprint(data_file), fingerprint)
+        self.assertIsNone(read_dataset_cache(data_file))
+        rebuilt, _ = quiet(load_encoded_dataset, data_file)
+        self.assertEqual(len(rebuilt), len(df) + 3)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,98 @@
+import contextlib
+import io
+import os
+import tempfile
+import unittest
+from pathlib import Path
+
+import pandas as pd
+
+from src.config import DB_CONFIG, MODELS_DATASET_TABLE, MODELS_SQL_CREATE_DATASET_VIEW
+from src.database_manager import INSERT_EXAMINATION, DatabaseManager
+from src.dataset import MODELS_DATASET_COLUMNS, export_to_csv, generate_examination_batches
+
+# The tests rebuild the schema and delete every examination of the DB_CONFIG database,
+# they only run when ISEL_TEST_DATABASE=1 is set (on a scratch PostgreSQL)
+ENABLED = os.environ.get("ISEL_TEST_DATABASE") == "1"
+
+
+@unittest.skipUnless(ENABLED, "set ISEL_TEST_DATABASE=1 to run the tests on the DB_CONFIG database")
+class ExaminationInsertAndExport(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        with contextlib.redirect_stdout(io.StringIO()):
+            cls.db = DatabaseManager(DB_CONFIG)
+        if cls.db.pool is None:
+            raise unittest.SkipTest("PostgreSQL is not reachable")
+        cls.db.setup_schema()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.db.clear_examinations()
+        cls.db.close()
+
+    def setUp(self):
+        self.db.clear_examinations()
+        self.tmp = tempfile.TemporaryDirectory()
+        self.dir = Path(self.tmp.name)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def records(self, n: int):
+        batches = generate_examination_batches(
+            n, self.db.get_patients(), self.db.get_doctors(), self.db.get_disease_map(), batch_size=n
+        )
+        return next(batches)
+
+    def count(self) -> int:
+        return self.db.fetch_one("SELECT count(*) AS n FROM examination;")["n"]
+
+    def test_every_insert_path_commits_its_rows(self):
+        records = self.records(40)
+        for record in records[:5]:
+            self.db.insert_examination_record(*record)
+        self.assertEqual(self.count(), 5)
+
+        with self.db.transaction() as cur:
+            for record in records[5:10]:
+                cur.execute(INSERT_EXAMINATION, record)
+        self.assertEqual(self.count(), 10)
+
+        self.db.insert_examination_records(records[10:25], method="copy", batch_size=4)
+        self.db.insert_examination_records(records[25:], method="values", batch_size=4)
+        self.assertEqual(self.count(), 40)
+
+    def test_failed_transaction_is_rolled_back(self):
+        records = self.records(3)
+        with self.assertRaises(ZeroDivisionError):
+            with self.db.transaction() as cur:
+                for record in records:
+                    cur.execute(INSERT_EXAMINATION, record)
+                1 / 0
+        self.assertEqual(self.count(), 0)
+
+    def test_export_writes_every_row(self):
+        records = self.records(60)
+        self.db.insert_examination_records(records)
+        self.db.execute_sql_file(MODELS_SQL_CREATE_DATASET_VIEW)
+        self.db.refresh_materialized_views()
+
+        output_file = export_to_csv(self.db, MODELS_SQL_CREATE_DATASET_VIEW, MODELS_DATASET_TABLE, self.dir / "dataset.tab")
+        df = pd.read_csv(output_file, sep="\t")
+        self.assertEqual(list(df.columns), MODELS_DATASET_COLUMNS)
+        self.assertEqual(len(df), len(records))
+        self.assertEqual(sorted(df["lenses"]), sorted(r[3] for r in records))
+
+    def test_failed_export_keeps_the_previous_file(self):
+        output_file = self.dir / "dataset.tab"
+        output_file.write_text("previous\n")
+        with contextlib.redirect_stdout(io.StringIO()):
+            rows = self.db.copy_query_to_file("SELECT * FROM no_such_table", output_file, "FORMAT csv")
+        self.assertEqual(rows, 0)
+        self.assertEqual(output_file.read_text(), "previous\n")
+        self.assertEqual(list(self.dir.iterdir()), [output_file])
+
+
+if __name__ == "__main__":
+    unittest.main()
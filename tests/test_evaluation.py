@@ -0,0 +1,76 @@
+import unittest
+from functools import partial
+
+import numpy as np
+
+from src.encoding import as_encoded
+from src.evaluation import (
+    count_loo_scores,
+    evaluate_on_test,
+    grid_search_cv,
+    stratified_kfold_scores,
+)
+from src.id3_model import ID3Classifier
+from src.naive_bayes_model import NaiveBayesClassifier
+from src.r1_model import OneRClassifier
+from tests.reference import RefID3, RefNaiveBayes, RefOneR, random_dataset, ref_kfold_scores
+
+TARGET = "label"
+MODELS = [(OneRClassifier, RefOneR), (ID3Classifier, RefID3), (NaiveBayesClassifier, RefNaiveBayes)]
+
+
+def cv_dataset(seed: int):
+    # at least k rows of every class, so StratifiedKFold can split it
+    df = random_dataset(seed, n_rows=60)
+    return df if df[TARGET].value_counts().min() >= 5 else cv_dataset(seed + 1000)
+
+
+class CrossValidationMatchesReference(unittest.TestCase):
+    def test_kfold_scores(self):
+        for model_cls, ref_cls in MODELS:
+            for seed in range(10):
+                with self.subTest(model=model_cls.__name__, seed=seed):
+                    df = cv_dataset(seed)
+                    expected = ref_kfold_scores(ref_cls, df, TARGET, k=5, random_state=seed)
+                    self.assertEqual(stratified_kfold_scores(model_cls, df, TARGET, k=5, random_state=seed), expected)
+
+    def test_count_cv_matches_refit_cv(self):
+        for model_cls in (OneRClassifier, NaiveBayesClassifier):
+            for seed in range(20):
+                df = cv_dataset(seed)
+                self.assertEqual(
+                    stratified_kfold_scores(model_cls, df, TARGET, k=5, random_state=seed, use_counts=True),
+                    stratified_kfold_scores(model_cls, df, TARGET, k=5, random_state=seed, use_counts=False),
+                )
+
+    def test_leave_one_out_matches_refits(self):
+        for model_cls in (OneRClassifier, NaiveBayesClassifier):
+            for seed in range(10):
+                df = random_dataset(seed, n_rows=25)
+                data = as_encoded(df)
+                expected = []
+                for i in range(len(df)):
+                    model = model_cls()
+                    model.set_training_data(data.take(np.delete(np.arange(len(df)), i)))
+                    model.fit(TARGET)
+                    expected.append(evaluate_on_test(model, data.take(np.array([i])), TARGET))
+                self.assertEqual(count_loo_scores(model_cls, df, TARGET).tolist(), expected)
+
+    def test_grid_search_matches_separate_cv(self):
+        grids = [
+            (ID3Classifier, {"max_depth": [None, 1], "min_samples_leaf": [1, 4], "max_nodes": [None, 5]}),
+            (NaiveBayesClassifier, {"alpha": [0.5, 1.0, 2.0]}),
+        ]
+        for model_cls, param_grid in grids:
+            for seed in range(5):
+                df = cv_dataset(seed)
+                for result in grid_search_cv(model_cls, df, TARGET, param_grid, k=5, random_state=seed):
+                    # partial() is refitted on every fold, without the shared statistics and fold counts
+                    separate = stratified_kfold_scores(
+                        partial(model_cls, **result["params"]), df, TARGET, k=5, random_state=seed
+                    )
+                    self.assertEqual(result["scores"], separate, result["params"])
+
+
+if __name__ == "__main__":
+    unittest.main()
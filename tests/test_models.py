@@ -0,0 +1,144 @@
+import unittest
+
+import numpy as np
+
+from src.bagging import BaggedID3Classifier
+from src.evaluation import evaluate_on_test
+from src.id3_model import ID3Classifier, TreeNode
+from src.naive_bayes_model import NaiveBayesClassifier
+from src.r1_model import OneRClassifier
+from tests.reference import RefID3, RefNaiveBayes, RefOneR, random_dataset, ref_accuracy, value_grid
+
+TARGET = "label"
+SEEDS = range(40)
+
+
+def fitted(model_cls, df, **params):
+    model = model_cls(**params)
+    model.set_training_data(df)
+    model.fit(TARGET)
+    return model
+
+
+def as_reference_tree(node: TreeNode):
+    # TreeNode in the form of RefID3.tree
+    if node.is_leaf():
+        return node.label
+    return node.attribute, {value: as_reference_tree(child) for value, child in node.branches.items()}
+
+
+class PredictionsMatchReference(unittest.TestCase):
+    def check(self, model_cls, ref_cls):
+        for seed in SEEDS:
+            with self.subTest(seed=seed):
+                df = random_dataset(seed)
+                model, ref = fitted(model_cls, df), ref_cls().fit(df, TARGET)
+                grid = value_grid(df, TARGET)
+                expected = [ref.predict_row(row) for row in grid.to_dict("records")]
+                self.assertEqual(model.predict_batch(grid).tolist(), expected)
+                self.assertEqual([model.predict_row(row) for row in grid.to_dict("records")], expected)
+                self.assertEqual(model.default_class, ref.default_class)
+                self.assertEqual(model.score(), ref_accuracy(ref, df, TARGET))
+                self.assertEqual(evaluate_on_test(model, df, TARGET), ref_accuracy(ref, df, TARGET))
+
+    def test_one_rule(self):
+        self.check(OneRClassifier, RefOneR)
+
+    def test_id3(self):
+        self.check(ID3Classifier, RefID3)
+
+    def test_naive_bayes(self):
+        self.check(NaiveBayesClassifier, RefNaiveBayes)
+
+    def test_one_rule_rules(self):
+        for seed in SEEDS:
+            df = random_dataset(seed)
+            model, ref = fitted(OneRClassifier, df), RefOneR().fit(df, TARGET)
+            self.assertEqual((model.best_attribute, model.rules), (ref.best_attribute, ref.rules))
+
+    def test_id3_tree(self):
+        for seed in SEEDS:
+            df = random_dataset(seed)
+            self.assertEqual(as_reference_tree(fitted(ID3Classifier, df).tree), RefID3().fit(df, TARGET).tree)
+
+    def test_naive_bayes_probabilities(self):
+        for seed in SEEDS:
+            df = random_dataset(seed)
+            model, ref = fitted(NaiveBayesClassifier, df), RefNaiveBayes().fit(df, TARGET)
+            self.assertEqual(model.class_priors, ref.priors)
+            self.assertEqual(list(model.class_priors), list(ref.priors))
+            self.assertEqual(model.cond_probs, ref.cond)
+
+    def test_partial_fit_matches_fit(self):
+        for model_cls in (OneRClassifier, NaiveBayesClassifier):
+            for seed in SEEDS:
+                df = random_dataset(seed)
+                half = len(df) // 2
+                model = model_cls()
+                model.partial_fit(df.iloc[:half], TARGET)
+                model.partial_fit(df.iloc[half:])
+                grid = value_grid(df, TARGET)
+                self.assertEqual(model.predict_batch(grid).tolist(), fitted(model_cls, df).predict_batch(grid).tolist())
+
+
+class ID3Options(unittest.TestCase):
+    def test_large_max_nodes_is_the_unbounded_tree(self):
+        for seed in SEEDS:
+            df = random_dataset(seed)
+            self.assertEqual(fitted(ID3Classifier, df, max_nodes=10_000).tree, fitted(ID3Classifier, df).tree)
+
+    def test_max_nodes_bounds_the_tree(self):
+        for seed in SEEDS:
+            df = random_dataset(seed)
+            for max_nodes in (1, 3, 5, 8):
+                self.assertLessEqual(fitted(ID3Classifier, df, max_nodes=max_nodes).tree_stats()["nodes"], max_nodes)
+            # a root cut to a leaf predicts what a root leaf grown with max_depth=0 predicts (first seen on ties)
+            self.assertEqual(
+                fitted(ID3Classifier, df, max_nodes=1).tree.label, fitted(ID3Classifier, df, max_depth=0).tree.label
+            )
+
+    def test_fit_grid_matches_separate_fits(self):
+        grid = [{}, {"max_depth": 1}, {"min_samples_leaf": 3}, {"min_gain": 0.05}, {"max_nodes": 4},
+                {"pruning": "pessimistic"}, {"max_nodes": 6, "pruning": "pessimistic"}]
+        for seed in SEEDS:
+            df = random_dataset(seed)
+            base = ID3Classifier()
+            base.set_training_data(df)
+            for params, model in zip(grid, base.fit_grid(TARGET, grid)):
+                self.assertEqual(model.tree, fitted(ID3Classifier, df, **params).tree, params)
+
+    def test_parallel_fit_matches_serial_fit(self):
+        df = random_dataset(0, n_rows=3000, n_attrs=4)
+        parallel = fitted(ID3Classifier, df, n_jobs=2, parallel_min_rows=200)
+        self.assertEqual(parallel.tree, fitted(ID3Classifier, df, n_jobs=1).tree)
+
+
+class BaggedEnsemble(unittest.TestCase):
+    def test_fits_are_reproducible(self):
+        df = random_dataset(1, n_rows=200)
+        grid = value_grid(df, TARGET)
+        first = fitted(BaggedID3Classifier, df, n_estimators=7, max_features=2, n_jobs=1)
+        second = fitted(BaggedID3Classifier, df, n_estimators=7, max_features=2, n_jobs=1)
+        self.assertEqual(first.predict_batch(grid).tolist(), second.predict_batch(grid).tolist())
+        self.assertEqual([t.to_state() for t in first.trees], [t.to_state() for t in second.trees])
+
+    def test_result_does_not_depend_on_workers(self):
+        df = random_dataset(2, n_rows=200)
+        serial = fitted(BaggedID3Classifier, df, n_estimators=4, n_jobs=1)
+        pooled = fitted(BaggedID3Classifier, df, n_estimators=4, n_jobs=2, parallel_min_rows=1)
+        self.assertEqual([t.to_state() for t in serial.trees], [t.to_state() for t in pooled.trees])
+
+    def test_vote_matches_trees(self):
+        df = random_dataset(3, n_rows=120)
+        model = fitted(BaggedID3Classifier, df, n_estimators=5, n_jobs=1)
+        grid = value_grid(df, TARGET)
+        classes = model.vocabularies[TARGET]
+        votes = np.array([[classes.index(tree.predict_row(row)) for row in grid.to_dict("records")]
+                          for tree in model.trees])
+        expected = [classes[np.bincount(column, minlength=len(classes)).argmax()] for column in votes.T]
+        self.assertEqual(model.predict_batch(grid).tolist(), expected)
+        self.assertEqual([model.predict_row(row) for row in grid.to_dict("records")], expected)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,30 +1,48 @@
 # webapp/app.py
-from fastapi import FastAPI, Request, Form
-from fastapi.responses import HTMLResponse
+import asyncio
+import hmac
+import json
+from contextlib import asynccontextmanager
+from typing import Optional
+
+from fastapi import FastAPI, Request, Form, Header, HTTPException
+from fastapi.responses import HTMLResponse, JSONResponse, PlainTextResponse
 from fastapi.templating import Jinja2Templates
+from starlette.concurrency import run_in_threadpool
 import pandas as pd
 
 from src.r1_model import OneRClassifier
 from src.id3_model import ID3Classifier
 from src.naive_bayes_model import NaiveBayesClassifier
-from src.config import TAB_DATASET_FILE
+from src.bagging import BaggedID3Classifier
+from src.config import TAB_DATASET_FILE, REFIT_INTERVAL_SECONDS, ADMIN_TOKEN
+from src.encoding import DATASET_SCHEMA
+from src.model_registry import ModelRegistry
+from src.metrics import PREDICT_LATENCY, render_prometheus
 
-app = FastAPI()
-templates = Jinja2Templates(directory="webapp/templates")
+MODEL_CLASSES = {"1r": OneRClassifier, "id3": ID3Classifier, "nb": NaiveBayesClassifier, "bagged": BaggedID3Classifier}
+FEATURE_COLUMNS = [c for c in DATASET_SCHEMA if c != "lenses"]
+# Refits run next to the server threads: forking this process for a worker pool can deadlock
+# the workers on locks held by those threads, so the models are fitted serially
+FIT_PARAMS = {"id3": {"n_jobs": 1}, "bagged": {"n_jobs": 1}}
+
+# Saved models are loaded when they match dataset.tab, training happens only after the data changed.
+# Later refits run in the background and swap the whole model set at once (see src/model_registry.py),
+# every request takes registry.current once and uses only that set.
+registry = ModelRegistry(MODEL_CLASSES, data_file=TAB_DATASET_FILE, target_col="lenses", fit_params=FIT_PARAMS)
+registry.load()
 
-df = pd.read_csv(TAB_DATASET_FILE, sep="\t")
 
-model_1r = OneRClassifier()
-model_1r.set_training_data(df)
-model_1r.fit("lenses")
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    if REFIT_INTERVAL_SECONDS:
+        registry.start_watching(REFIT_INTERVAL_SECONDS)
+    yield
+    registry.stop_watching()
 
-model_id3 = ID3Classifier()
-model_id3.set_training_data(df)
-model_id3.fit("lenses")
 
-model_naive_bayes = NaiveBayesClassifier()
-model_naive_bayes.set_training_data(df)
-model_naive_bayes.fit("lenses")
+app = FastAPI(lifespan=lifespan)
+templates = Jinja2Templates(directory="webapp/templates")
 
 
 @app.get("/", response_class=HTMLResponse)
@@ -48,11 +66,98 @@ def predict(
         "tear_rate": tear_rate.strip()
     }
     
-    if model == "1r":
-        result = model_1r.predict_row(row)
-    elif model == "id3":
-        result = model_id3.predict_row(row)
-    else:
-        result = model_naive_bayes.predict_row(row)
+    models = registry.current.models
+    if model not in models:
+        model = "nb"
+    with PREDICT_LATENCY.time(model=model, method="predict_row"):
+        result = models[model].predict_row(row)
 
     return templates.TemplateResponse("index.html", {"request": request, "prediction": result})
+
+
+def _predict_batch(model_name: str, df: pd.DataFrame) -> dict:
+    # one model set for all requested models, even if a refit swaps it meanwhile
+    models = registry.current.models
+    names = list(models) if model_name == "all" else [model_name]
+    predictions = {}
+    for name in names:
+        with PREDICT_LATENCY.time(model=name, method="predict_batch"):
+            predictions[name] = models[name].predict_batch(df).tolist()
+    return predictions
+
+
+@app.post("/api/predict/batch")
+async def predict_batch(request: Request):
+    # Body: {"model": "1r" | "id3" | "nb" | "bagged" | "all", "rows": [{"age_group": ..., ...}, ...]}
+    # The rows are scored as one DataFrame through predict_batch, without a per-row loop.
+    try:
+        payload = json.loads(await request.body())
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Request body is not valid JSON.")
+    if not isinstance(payload, dict):
+        raise HTTPException(status_code=400, detail="Request body must be a JSON object.")
+
+    model_name = payload.get("model", "all")
+    if model_name != "all" and model_name not in MODEL_CLASSES:
+        raise HTTPException(status_code=400, detail=f"Unknown model '{model_name}', use one of: {', '.join(MODEL_CLASSES)}, all.")
+
+    rows = payload.get("rows")
+    if not isinstance(rows, list) or not all(isinstance(r, dict) for r in rows):
+        raise HTTPException(status_code=400, detail="'rows' must be a JSON array of objects.")
+
+    df = pd.DataFrame.from_records(rows, columns=FEATURE_COLUMNS) if rows else pd.DataFrame(columns=FEATURE_COLUMNS)
+    missing = [c for c in FEATURE_COLUMNS if df[c].isna().any()]
+    if missing:
+        raise HTTPException(status_code=400, detail=f"Missing values for: {', '.join(missing)}.")
+
+    # scoring is CPU bound, keep it off the event loop
+    predictions = await run_in_threadpool(_predict_batch, model_name, df)
+    # JSONResponse skips FastAPI's per-element jsonable_encoder pass
+    return JSONResponse({"model": model_name, "count": len(df), "predictions": predictions})
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+def metrics():
+    # Prometheus text exposition format, histograms are kept per worker process
+    return PlainTextResponse(render_prometheus(), media_type="text/plain; version=0.0.4")
+
+
+def _check_admin(token: Optional[str]):
+    # without a configured token the admin endpoints are disabled, they never run unauthenticated
+    if not ADMIN_TOKEN:
+        raise HTTPException(status_code=403, detail="Admin endpoints are disabled, set ADMIN_TOKEN to enable them.")
+    if token is None or not hmac.compare_digest(token.encode("utf-8"), ADMIN_TOKEN.encode("utf-8")):
+        raise HTTPException(status_code=403, detail="Invalid or missing X-Admin-Token header.")
+
+
+def _model_status() -> dict:
+    current = registry.current
+    return {
+        "version": current.version,
+        "fingerprint": current.fingerprint,
+        "loaded_at": current.loaded_at,
+        "models": list(current.models),
+        "refit_running": registry.refit_running,
+        "last_error": registry.last_error,
+    }
+
+
+@app.get("/admin/models")
+def admin_models(x_admin_token: Optional[str] = Header(default=None)):
+    _check_admin(x_admin_token)
+    return _model_status()
+
+
+@app.post("/admin/refit")
+async def admin_refit(force: bool = False, wait: bool = False, x_admin_token: Optional[str] = Header(default=None)):
+    # Refits in the background, force=true retrains even when dataset.tab did not change.
+    # wait=true answers after the new models are in use, otherwise right away with 202.
+    _check_admin(x_admin_token)
+    future = registry.refit(force=force)
+    if not wait:
+        return JSONResponse(_model_status(), status_code=202)
+    try:
+        await asyncio.wrap_future(future)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Refit failed: {type(e).__name__}: {e}")
+    return _model_status()